@@ -1,61 +1,68 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from fastapi.responses import JSONResponse
-import shutil, os, pickle, json
-from langchain_chroma import Chroma
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_openai import OpenAIEmbeddings
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Depends, BackgroundTasks, Query
+from typing import List, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import os, json
 
 
 # Import your functions
-from vectorStoring import storing
-from noPklRetrieval import rag
-from reportMaker import build_report
-import os
+# (heavy dependencies - unstructured, Chroma, provider SDKs - load on first use)
+from vectorStoring import storing, STRATEGIES
+from reportMaker import build_report, iter_sections, assemble, SECTION_QUERIES
+from config import Settings, get_settings
+from stores import (
+    get_vectorstore, get_summary_to_chunk, get_retriever, get_registry, get_sessions, get_screening_index,
+)
+import cleanup
+import documents
+import ingest
+import metrics
+import portfolio
+import reportfiles
+import rowslices
+import sessions
+import storage
 import uuid
-import json
 app = FastAPI(title="Multi-Modal CRE RAG API")
 
 # -------------------------------
 # Global vectorstore setup
 # -------------------------------
-VECTORSTORE_DIR = "./chroma_db"
-COLLECTION_NAME = "multi_modal_rag"
-
-# vectorstore = Chroma(
-#     persist_directory=VECTORSTORE_DIR,
-#     collection_name=COLLECTION_NAME,
-#     embedding_function=GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-# )
-
-vectorstore = Chroma(
-    persist_directory=VECTORSTORE_DIR,
-    collection_name=COLLECTION_NAME,
-    embedding_function=OpenAIEmbeddings(model="text-embedding-3-large")
-)
-
-
-# Load existing summary mapping or create empty
-if os.path.exists("summary_to_chunk.pkl"):
-    with open("summary_to_chunk.pkl", "rb") as f:
-        summary_to_chunk = pickle.load(f)
-else:
-    summary_to_chunk = {}
+# One Chroma client per worker, created on first request and injected into
+# the routes with Depends(get_vectorstore); see stores.py / config.py.
 
-
-UPLOAD_DIR = "uploads"
-REPORT_DIR = "reports"
+settings = get_settings()
+UPLOAD_DIR = settings.upload_dir
+REPORT_DIR = settings.report_dir
 
 # Ensure directories exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(REPORT_DIR, exist_ok=True)
 
-FRONTEND_URL = "http://localhost:3000"
+
+@app.on_event("startup")
+def start_garbage_collection():
+    # retention and compaction every DEALLENS_GC_INTERVAL_HOURS (off by default)
+    cleanup.start(settings)
+
+
+# -------------------------------
+# Metrics (Prometheus text format)
+# -------------------------------
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+FRONTEND_URL = settings.frontend_url
 REPORT_SELECTOR = "#report-container"  # Change to your main report div id
 
 @app.get("/export-pdf/{report_id}")
 async def export_pdf(report_id: str):
     try:
+        from pyppeteer import launch
+
         # Launch headless browser
         browser = await launch(
             args=["--no-sandbox", "--disable-setuid-sandbox"],
@@ -110,9 +117,9 @@ async def upload_file(file: UploadFile = File(...)):
         file_path = os.path.join(UPLOAD_DIR, f"{file_key}_{file.filename}")
 
         # Save uploaded file
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
-        
+        storage.atomic_write_bytes(file_path, await file.read())
+        get_registry().add(file_key, file.filename, file_path)
+
         print("returnong response with id ", file_key)
 
         # here will do vectordb storing of data and addition of map about report id to vector db collection name 
@@ -122,33 +129,220 @@ async def upload_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
 
 
+# ---------------------------
+# Bulk ingestion API
+# ---------------------------
+@app.post("/documents/batch")
+async def ingest_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    directory: Optional[str] = Form(None),
+    strategy: Optional[str] = Form(None),
+    settings: Settings = Depends(get_settings),
+):
+    """Queue many PDFs (uploaded, or a directory under DEALLENS_INGEST_ROOT) for ingestion.
+
+    `strategy` (summary | raw | hybrid | tables) overrides DEALLENS_INGEST_STRATEGY;
+    "raw" makes documents searchable without any LLM calls.
+    """
+    if not files and not directory:
+        raise HTTPException(status_code=400, detail="Send 'files' or a 'directory'")
+    if strategy and strategy not in STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of {', '.join(STRATEGIES)}")
+
+    paths = {}
+    try:
+        for file in files or []:
+            file_id, file_path = ingest.new_upload_path(file.filename)
+            await run_in_threadpool(storage.atomic_copy_stream, file_path, file.file)
+            paths[file_id] = file_path
+        if directory:
+            for source in await run_in_threadpool(ingest.pdfs_in_directory, directory):
+                file_id, file_path = await run_in_threadpool(ingest.copy_into_uploads, source)
+                paths[file_id] = file_path
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"Directory not found: {e}")
+
+    if not paths:
+        raise HTTPException(status_code=400, detail="No PDF files found")
+
+    job_id = await run_in_threadpool(ingest.submit, paths, settings.llm_provider, None, strategy)
+    return JSONResponse(
+        status_code=202,
+        content={"status": "accepted", "jobId": job_id, "reportIds": list(paths)},
+    )
+
+
+@app.get("/documents/batch/{job_id}")
+async def ingest_batch_status(job_id: str):
+    status = await run_in_threadpool(ingest.job_status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=status)
+
+
+@app.post("/documents/{file_id}/summaries")
+async def summarize_document(file_id: str, settings: Settings = Depends(get_settings)):
+    """Add LLM summaries to a document ingested with a raw or partial strategy (or revised
+    with a different one, see revisions.py)."""
+    doc = await run_in_threadpool(get_registry().get, file_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if doc.get("strategy") == "summary":
+        return JSONResponse(content={"status": "success", "detail": "Already summarized"})
+    ingest.summarize_later(file_id, settings.llm_provider)
+    return JSONResponse(status_code=202, content={"status": "accepted"})
+
+
+@app.post("/documents/{file_id}/revisions")
+async def revise_document(
+    file_id: str,
+    file: UploadFile = File(...),
+    strategy: Optional[str] = Form(None),
+    settings: Settings = Depends(get_settings),
+):
+    """Replace a document with a revised version, re-ingesting only what changed.
+
+    Unchanged chunks keep their vectors and summaries, and only the report
+    sections whose retrieved chunks changed are extracted again.
+    """
+    if strategy and strategy not in STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of {', '.join(STRATEGIES)}")
+    doc = await run_in_threadpool(get_registry().get, file_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if doc["status"] in (documents.QUEUED, documents.PARTITIONING, documents.SUMMARIZING, documents.STORING):
+        raise HTTPException(status_code=409, detail=f"Document is being ingested ({doc['status']})")
+
+    file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{os.path.basename(file.filename)}")
+    await run_in_threadpool(storage.atomic_copy_stream, file_path, file.file)
+    await run_in_threadpool(ingest.submit_revision, file_id, file_path, settings.llm_provider, strategy)
+    return JSONResponse(status_code=202, content={"status": "accepted", "reportId": file_id})
+
+
+@app.get("/documents/{file_id}")
+async def document_status(file_id: str):
+    doc = await run_in_threadpool(get_registry().get, file_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return JSONResponse(content=doc)
+
+
+@app.delete("/documents/{file_id}")
+async def delete_document(file_id: str):
+    """Remove a document and everything derived from it (vectors, chunks, report, chats, upload)."""
+    try:
+        removed = await run_in_threadpool(cleanup.delete_document, file_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Document not found")
+    except cleanup.DocumentBusy as e:
+        raise HTTPException(status_code=409, detail=f"Document is being ingested ({e})")
+    return JSONResponse(content={"status": "success", "reportId": file_id, "removed": removed})
+
+
+@app.get("/documents/{file_id}/metrics")
+async def document_metrics(file_id: str):
+    """Price ratios, GPR, occupancy, unit mix and the cap rate check, computed from the table facts."""
+    import derived
+
+    registry = get_registry()
+    if await run_in_threadpool(registry.get, file_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    facts = await run_in_threadpool(registry.facts, file_id)
+    return JSONResponse(content={"status": "success", "metrics": derived.derive([facts])[0]})
+
+
+@app.get("/documents/{file_id}/tables")
+async def document_tables(file_id: str):
+    """Tables stored as row slices: header, row count and the rows of each slice."""
+    if await run_in_threadpool(get_registry().get, file_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return JSONResponse(content={"status": "success", "tables": rowslices.list_tables(file_id)})
+
+
+@app.get("/documents/{file_id}/tables/{table_id}")
+async def document_table(file_id: str, table_id: str, offset: int = Query(0, ge=0),
+                         limit: Optional[int] = Query(None, ge=1)):
+    """Rows of one sliced table, column by column."""
+    if await run_in_threadpool(get_registry().get, file_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    table = await run_in_threadpool(rowslices.read_table, file_id, table_id, offset, limit)
+    if table is None:
+        raise HTTPException(status_code=404, detail="Table not found")
+    return JSONResponse(content={"status": "success", "table": table})
+
+
 # ---------------------------
 # 2️⃣ Report API
 # ---------------------------
+def _has_upload(file_key):
+    return any(f.startswith(file_key) for f in os.listdir(UPLOAD_DIR))
+
+
+def _report_sections(report_path, vectorstore, summary_to_chunk, settings, file_id):
+    """`(section, data)` of a report as each becomes available.
+
+    From the cached report when there is one; otherwise finished sections
+    come from the section cache, the rest are extracted (and cached) in
+    turn, and the full report is stored at the end.
+    """
+    if reportfiles.ensure_current(report_path) is None:
+        # Only one worker builds a given report; the others wait, then read it
+        with storage.file_lock(report_path):
+            if reportfiles.current_etag(report_path) is None:
+                metrics.cache("report", False)
+                done = reportfiles.cached_sections(report_path, SECTION_QUERIES)
+                sources = reportfiles.cached_sources(report_path, done)
+                yield from done.items()
+                # 🔹 Here call your pipeline:
+                print("calling build ")
+                facts = get_registry().facts(file_id)
+                for section, data in iter_sections(
+                    vectorstore, summary_to_chunk, settings.llm_provider, facts=facts, file_id=file_id,
+                    sections=[s for s in SECTION_QUERIES if s not in done], sources=sources,
+                ):
+                    reportfiles.write_section(report_path, section, data, sources.get(section))
+                    done[section] = data
+                    yield section, data
+                reportfiles.write(report_path, assemble(done.items()), sources)
+                return
+    metrics.cache("report", True)
+    print("Returning cached report")
+    yield from (reportfiles.read(report_path) or {}).items()
+
+
+def _ensure_report(report_path, vectorstore, summary_to_chunk, settings, file_id=None):
+    """ETag of the cached report, building it first if needed."""
+    for _ in _report_sections(report_path, vectorstore, summary_to_chunk, settings, file_id):
+        pass
+    return reportfiles.current_etag(report_path)
+
+
 @app.get("/report/{file_key}")
-async def generate_report(file_key: str):
+async def generate_report(
+    file_key: str,
+    request: Request,
+    vectorstore=Depends(get_vectorstore),
+    summary_to_chunk=Depends(get_summary_to_chunk),
+    settings: Settings = Depends(get_settings),
+):
     try:
         print("got file key ", file_key)
-        # Check if uploaded file exists
-        matching_files = [
-            f for f in os.listdir(UPLOAD_DIR) if f.startswith(file_key)
-        ]
-        if not matching_files:
-            raise HTTPException(status_code=404, detail="File not found")
-
-        file_path = os.path.join(UPLOAD_DIR, matching_files[0])
-
-        # Check if report already exists
+        # Check if report already exists, else build it (once across workers)
         report_path = os.path.join(REPORT_DIR, f"{file_key}_report.json")
-        if os.path.exists(report_path):
-            with open(report_path, "r", encoding="utf-8") as f:
-                report = json.load(f)
-            print("Returning cached report")
-            return JSONResponse(content={"status": "success", "report": report})
-        # -------------------------
-        # 🔹 Here call your pipeline:
-        print("calling build ")
-        report = build_report(vectorstore, summary_to_chunk)
+        etag = reportfiles.ensure_current(report_path)
+        if etag is None:
+            # Check if uploaded file exists
+            if not _has_upload(file_key):
+                raise HTTPException(status_code=404, detail="File not found")
+
+            etag = await run_in_threadpool(
+                _ensure_report, report_path, vectorstore, summary_to_chunk, settings, file_key
+            )
+        else:
+            metrics.cache("report", True)
+        await run_in_threadpool(get_registry().touch, file_key)
         # -------------------------
         # For demo, we’ll return dummy data
         # report = {
@@ -159,15 +353,10 @@ async def generate_report(file_key: str):
         # with open("exampleReportJson/example.json","r",encoding="utf-8") as f:
         #     report = json.load(f)
 
-        # Save report JSON
-        # print('savin report json')
-        report_path = os.path.join(REPORT_DIR, f"{file_key}_report.json")
-        with open(report_path, "w", encoding="utf-8") as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
-        
         print("sending back")
 
-        return JSONResponse(content={"status": "success", "report": report})
+        # Straight from disk: 304, precompressed gzip / brotli, or streamed JSON
+        return reportfiles.response(report_path, request, etag)
 
     except HTTPException:
         raise
@@ -175,6 +364,119 @@ async def generate_report(file_key: str):
         raise HTTPException(status_code=500, detail=f"Report generation failed: {e}")
 
 
+def _stream_format(request, format):
+    if format in ("ndjson", "sse"):
+        return format
+    return "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+
+
+async def _iterate_in_thread(produce):
+    """Items of the generator `produce()`, run start to end on one worker thread.
+
+    `metrics.track` context and the report lock stay valid across its yields;
+    if the client goes away the report is still finished and cached.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    end = object()
+
+    def run():
+        try:
+            for item in produce():
+                loop.call_soon_threadsafe(queue.put_nowait, ("item", item))
+        except Exception as e:
+            print(f"Report stream failed: {e}")
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", str(e)))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, end)
+
+    loop.run_in_executor(None, run)
+    while True:
+        event = await queue.get()
+        if event is end:
+            return
+        yield event
+
+
+@app.get("/report/{file_key}/stream")
+async def stream_report(
+    file_key: str,
+    request: Request,
+    format: Optional[str] = None,
+    vectorstore=Depends(get_vectorstore),
+    summary_to_chunk=Depends(get_summary_to_chunk),
+    settings: Settings = Depends(get_settings),
+):
+    """Each report section as soon as it is extracted, as NDJSON (default) or SSE."""
+    report_path = os.path.join(REPORT_DIR, f"{file_key}_report.json")
+    if reportfiles.ensure_current(report_path) is None and not _has_upload(file_key):
+        raise HTTPException(status_code=404, detail="File not found")
+    await run_in_threadpool(get_registry().touch, file_key)
+    sse = _stream_format(request, format) == "sse"
+
+    def encode(event, payload):
+        body = json.dumps(payload, ensure_ascii=False)
+        return f"event: {event}\ndata: {body}\n\n" if sse else body + "\n"
+
+    async def body():
+        sections = lambda: _report_sections(report_path, vectorstore, summary_to_chunk, settings, file_key)
+        async for kind, item in _iterate_in_thread(sections):
+            if kind == "error":
+                yield encode("error", {"error": item})
+                return
+            section, data = item
+            yield encode("section", {"section": section, "data": data})
+        yield encode("done", {"done": True, "etag": reportfiles.current_etag(report_path)})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+
+def _report_section(report_path, name, vectorstore, summary_to_chunk, settings, file_id):
+    if reportfiles.ensure_current(report_path) is not None:
+        metrics.cache("report", True)
+        return (reportfiles.read(report_path) or {}).get(name)
+    found, data = reportfiles.read_section(report_path, name)
+    if not found:
+        with storage.file_lock(reportfiles.section_path(report_path, name)):
+            found, data = reportfiles.read_section(report_path, name)
+            if not found:
+                facts = get_registry().facts(file_id)
+                sources = {}
+                for _, data in iter_sections(
+                    vectorstore, summary_to_chunk, settings.llm_provider, facts=facts, file_id=file_id,
+                    sections=[name], sources=sources,
+                ):
+                    reportfiles.write_section(report_path, name, data, sources.get(name))
+    metrics.cache("report_section", found)
+    return data
+
+
+@app.get("/report/{file_key}/sections/{name}")
+async def report_section(
+    file_key: str,
+    name: str,
+    vectorstore=Depends(get_vectorstore),
+    summary_to_chunk=Depends(get_summary_to_chunk),
+    settings: Settings = Depends(get_settings),
+):
+    """One report section, from the cached report or computed on its own."""
+    if name not in SECTION_QUERIES:
+        raise HTTPException(status_code=404, detail=f"Unknown section {name}")
+    report_path = os.path.join(REPORT_DIR, f"{file_key}_report.json")
+    if reportfiles.ensure_current(report_path) is None and not _has_upload(file_key):
+        raise HTTPException(status_code=404, detail="File not found")
+    await run_in_threadpool(get_registry().touch, file_key)
+    try:
+        data = await run_in_threadpool(
+            _report_section, report_path, name, vectorstore, summary_to_chunk, settings, file_key
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Section extraction failed: {e}")
+    return JSONResponse(content={"status": "success", "section": name, "data": data})
+
+
 # -------------------------------
 # Endpoint 2: Query RAG
 # -------------------------------
@@ -187,7 +489,21 @@ async def generate_report(file_key: str):
 #         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/chat/{file_id}")
-async def chat(file_id: str,request: Request):
+async def chat(
+    file_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    vectorstore=Depends(get_vectorstore),
+    summary_to_chunk=Depends(get_summary_to_chunk),
+    settings: Settings = Depends(get_settings),
+):
+    """Answer `{"message", "sessionId"?}` about one document.
+
+    The response carries the `sessionId` of the chat; send it back with the
+    next message to continue that conversation (summarized history and
+    retrieved context). API clients that leave it out start a new session
+    on every call, with no follow-up context.
+    """
     try:
         print("got request")
         body = await request.json()
@@ -210,14 +526,30 @@ async def chat(file_id: str,request: Request):
 
 
         # ---------------------------
-        # Call your RAG function
+        # Continue (or start) the chat session
         # ---------------------------
-        print("calling rag")
-        answer = rag(message, vectorstore, summary_to_chunk)
+        session_id = body.get("sessionId")
+        if session_id:
+            session = await run_in_threadpool(get_sessions().get, session_id)
+            if session is None or session["file_id"] != file_id:
+                raise HTTPException(status_code=404, detail="Chat session not found")
+        else:
+            session = await run_in_threadpool(get_sessions().create, file_id)
+
+        print("calling chat")
+        retrieval = {}
+        answer = await run_in_threadpool(
+            sessions.ask, session, message, vectorstore, settings.llm_provider, retrieval
+        )
+        # Summarizing old turns doesn't hold up this answer
+        background_tasks.add_task(sessions.compact_if_needed, session["session_id"], settings.llm_provider)
 
         print("answer ", answer)
 
-        return JSONResponse(content={"status": "success", "answer": answer.content})
+        return JSONResponse(content={
+            "status": "success", "answer": answer.content,
+            "sessionId": session["session_id"], "retrieval": retrieval,
+        })
 
     except HTTPException:
         raise
@@ -225,17 +557,89 @@ async def chat(file_id: str,request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/chat/{file_id}/sessions/{session_id}")
+async def chat_session(file_id: str, session_id: str):
+    session = await run_in_threadpool(get_sessions().get, session_id)
+    if session is None or session["file_id"] != file_id:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return JSONResponse(content={
+        "sessionId": session_id,
+        "summary": session["summary"],
+        "turns": session["turns"],
+        "contextChunks": len(session["context"]),
+    })
+
+
+@app.post("/api/portfolio/chat")
+async def portfolio_chat(
+    request: Request,
+    vectorstore=Depends(get_vectorstore),
+    settings: Settings = Depends(get_settings),
+):
+    """Ask one question across several documents ({"message", "fileIds"})."""
+    body = await request.json()
+    message = body.get("message")
+    file_ids = list(dict.fromkeys(body.get("fileIds") or []))
+    if not message:
+        raise HTTPException(status_code=400, detail="Missing 'message' in request body")
+    if not file_ids:
+        raise HTTPException(status_code=400, detail="Missing 'fileIds' in request body")
+
+    registry = get_registry()
+    docs = {file_id: await run_in_threadpool(registry.get, file_id) for file_id in file_ids}
+    unknown = [file_id for file_id, doc in docs.items() if doc is None]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Documents not found: {', '.join(unknown)}")
+
+    retrieval = {}
+    try:
+        answer = await run_in_threadpool(
+            portfolio.ask, message, file_ids, vectorstore, settings.llm_provider, retrieval
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(content={"status": "success", "answer": answer.content, "retrieval": retrieval})
+
+
+# ---------------------------
+# Deal screening API
+# ---------------------------
+@app.get("/deals/screen")
+async def screen_deals(
+    where: List[str] = Query([]),
+    sort: List[str] = Query([]),
+    fields: List[str] = Query([]),
+    limit: int = Query(50, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Deals whose report fields match every `where` condition (e.g. `financial_summary.cap_rate>=6`)."""
+    try:
+        result = await run_in_threadpool(get_screening_index().screen, where, sort, fields or None, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={"status": "success", **result})
+
+
+@app.get("/deals/fields")
+async def screening_fields():
+    """Every field `/deals/screen` can filter, sort or return, with its type."""
+    return JSONResponse(content={"status": "success", "fields": get_screening_index().fields()})
+
+
 # -------------------------------
 # Endpoint 3: Generate report
 # -------------------------------
 @app.get("/generate-report/")
-async def generate_report():
+async def generate_report(
+    vectorstore=Depends(get_vectorstore),
+    summary_to_chunk=Depends(get_summary_to_chunk),
+    settings: Settings = Depends(get_settings),
+):
     try:
-        report = build_report(vectorstore, summary_to_chunk)
+        report = build_report(vectorstore, summary_to_chunk, settings.llm_provider)
 
         # Save JSON output
-        with open("final_report.json", "w") as f:
-            json.dump(report, f, indent=2)
+        storage.atomic_write_json("final_report.json", report, indent=2)
 
         return JSONResponse(content={"status": "success", "report": report})
     except Exception as e:
@@ -246,31 +650,41 @@ async def generate_report():
 # Endpoint: Upload PDF and generate report
 # -------------------------------
 @app.post("/upload-and-generate-report/")
-async def upload_and_generate_report(file: UploadFile = File(...)):
+async def upload_and_generate_report(
+    file: UploadFile = File(...),
+    vectorstore=Depends(get_vectorstore),
+    summary_to_chunk=Depends(get_summary_to_chunk),
+    settings: Settings = Depends(get_settings),
+):
     try:
         print("got request now saving")
         # # Step 1: Save uploaded file
-        save_path = os.path.join("./uploads", file.filename)
-        os.makedirs("./uploads", exist_ok=True)
-        with open(save_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        save_path = os.path.join(settings.upload_dir, file.filename)
+        os.makedirs(settings.upload_dir, exist_ok=True)
+        storage.atomic_copy_stream(save_path, file.file)
+
+        file_id = str(uuid.uuid4())
+        get_registry().add(file_id, file.filename, save_path)
 
         # # Step 2: Store chunks in vectorstore
-        updated_mapping, _ = storing(save_path, vectorstore, vectorstore)
-        # summary_to_chunk.update(updated_mapping)
+        updated_mapping, _ = storing(
+            save_path, get_retriever(), vectorstore,
+            provider=settings.llm_provider, file_id=file_id,
+        )
 
         # Persist mapping
         # with open("summary_to_chunk.pkl", "wb") as f:
             # pickle.dump(summary_to_chunk, f)
 
         # Step 3: Build report
-        report = build_report(vectorstore, summary_to_chunk)
+        report = build_report(
+            vectorstore, summary_to_chunk, settings.llm_provider, facts=get_registry().facts(file_id),
+            file_id=file_id,
+        )
 
         # Optionally, save JSON output
         # print("loading statc")
-        with open("backend/final_report.json", "w") as f:
-            json.dump(report, f, indent=2)
-        import json
+        storage.atomic_write_json("backend/final_report.json", report, indent=2)
 
         # Assuming 'report' is a Python dictionary or list
         try:
@@ -285,3 +699,10 @@ async def upload_and_generate_report(file: UploadFile = File(...)):
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # DEALLENS_WORKERS=N runs N processes sharing the stores on this host
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=settings.workers)
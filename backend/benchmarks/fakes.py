@@ -0,0 +1,213 @@
+"""
+Deterministic local stand-ins for the chat and embedding models.
+
+Outputs depend only on the input, so two runs over the same fixtures do the
+same amount of work. Network cost is simulated with a fixed per-call
+`latency` and a token-bucket rate limit (`requests_per_second`).
+"""
+
+import hashlib
+import math
+import re
+import time
+from typing import Any, List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.runnables import RunnableLambda
+
+import llms
+
+PROVIDER = "fake"
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9.,$%/-]*")
+
+
+def _message_text(messages):
+    """Flatten chat messages into plain text, counting image blocks separately."""
+    parts, images = [], 0
+    for message in messages:
+        content = message.content
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif block.get("type") == "text":
+                parts.append(block.get("text", ""))
+            else:
+                images += 1
+    return "\n".join(parts), images
+
+
+def _rate_limiter(requests_per_second):
+    if not requests_per_second:
+        return None
+    return InMemoryRateLimiter(
+        requests_per_second=requests_per_second,
+        check_every_n_seconds=0.01,
+        max_bucket_size=max(1, requests_per_second),
+    )
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+# -------------------------------
+# Structured output from a JSON schema
+# -------------------------------
+def fake_from_schema(schema, digest, key="value"):
+    """Build a deterministic instance of a JSON schema seeded by `digest`."""
+    seed = int(digest[:8], 16)
+    typ = schema.get("type", "object")
+    if isinstance(typ, list):
+        typ = next((t for t in typ if t != "null"), "null")
+
+    if typ == "object":
+        return {
+            name: fake_from_schema(sub, hashlib.sha256((digest + name).encode()).hexdigest(), name)
+            for name, sub in schema.get("properties", {}).items()
+        }
+    if typ == "array":
+        item = schema.get("items", {"type": "string"})
+        return [
+            fake_from_schema(item, hashlib.sha256(f"{digest}{i}".encode()).hexdigest(), key)
+            for i in range(2)
+        ]
+    if typ == "integer":
+        return seed % 1000
+    if typ == "number":
+        return round((seed % 1_000_000) / 100, 2)
+    if typ == "boolean":
+        return bool(seed % 2)
+    if typ == "null":
+        return None
+    if schema.get("format") == "date":
+        return f"20{seed % 25:02d}-{seed % 12 + 1:02d}-{seed % 28 + 1:02d}"
+    return f"{key}-{digest[:8]}"
+
+
+# -------------------------------
+# Chat model
+# -------------------------------
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers with an extract of its own prompt."""
+
+    latency: float = 0.0
+    summary_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "deallens-fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text, images = _message_text(messages)
+        if self.latency:
+            time.sleep(self.latency)
+
+        # Keep the most "informative" words so summaries stay retrievable.
+        words = _WORD.findall(text.lower())
+        answer = " ".join(words[-self.summary_words:]) or "no content"
+        if images:
+            answer = f"image {hashlib.sha256(text.encode()).hexdigest()[:8]} " + answer
+
+        prompt_tokens = _estimate_tokens(text) + 85 * images
+        completion_tokens = _estimate_tokens(answer)
+        message = AIMessage(
+            content=answer,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+                "model_name": self._llm_type,
+            },
+        )
+
+    def with_structured_output(self, schema, **kwargs: Any):
+        """Return a runnable producing a schema-shaped dict after a normal model call."""
+
+        def _invoke(messages):
+            message = self.invoke(messages)
+            text, _ = _message_text(messages)
+            digest = hashlib.sha256((text + message.content).encode()).hexdigest()
+            return fake_from_schema(schema, digest)
+
+        return RunnableLambda(_invoke)
+
+
+# -------------------------------
+# Embeddings
+# -------------------------------
+class HashingEmbeddings(Embeddings):
+    """Signed feature-hashing bag of words; similar texts get similar vectors."""
+
+    def __init__(self, dim=256, latency=0.0, rate_limiter=None, batch_size=64):
+        self.dim = dim
+        self.latency = latency
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for word in _WORD.findall(text.lower()):
+            h = int(hashlib.md5(word.encode()).hexdigest(), 16)
+            vector[h % self.dim] += 1.0 if (h >> 64) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _call(self):
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        if self.latency:
+            time.sleep(self.latency)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            self._call()
+            vectors.extend(self._embed(t) for t in texts[start:start + self.batch_size])
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        self._call()
+        return self._embed(text)
+
+
+def install(latency=0.0, requests_per_second=None, embed_latency=0.0,
+            embed_requests_per_second=None, dim=256):
+    """
+    Register the stand-ins under the `fake` provider name in `llms`.
+
+    Rate limits are shared by every model the factories hand out, the same
+    way a provider quota is shared by every client using one API key.
+    """
+    chat_limiter = _rate_limiter(requests_per_second)
+    embed_limiter = _rate_limiter(embed_requests_per_second)
+
+    def chat(**kwargs):
+        params = {"latency": latency, "rate_limiter": chat_limiter}
+        params.update(kwargs)
+        return FakeChatModel(**params)
+
+    def embeddings(**kwargs):
+        params = {"dim": dim, "latency": embed_latency, "rate_limiter": embed_limiter}
+        params.update(kwargs)
+        return HashingEmbeddings(**params)
+
+    llms.register_provider(PROVIDER, chat=chat, embeddings=embeddings)
+    return PROVIDER
@@ -0,0 +1,194 @@
+"""
+Generated offering-memorandum style PDFs for the benchmarks.
+
+The files are written with a tiny built-in PDF writer (no extra
+dependencies) and are byte-for-byte reproducible for a given size, so
+timings from different runs are always measured on the same input. Each
+page mixes prose, a ruled financial table and, every few pages, a photo-like
+raster image, which exercises the text, table and image paths of `chunking`.
+"""
+
+import os
+import random
+import zlib
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), ".fixtures")
+
+# name -> page count
+SIZES = {
+    "small": 4,
+    "medium": 16,
+    "large": 48,
+}
+
+PAGE_W, PAGE_H = 612, 792
+
+_SENTENCES = [
+    "The property is a garden style multifamily community located minutes from the regional employment core.",
+    "Units feature in-unit washers and dryers, updated kitchens and private patios or balconies.",
+    "Ownership has completed roof, siding and parking lot replacements over the past three years.",
+    "The submarket has recorded positive absorption in each of the last eight quarters.",
+    "Average household income within a three mile radius exceeds the county median by twelve percent.",
+    "Current rents trail the market comparables, leaving a clear value-add opportunity through renovations.",
+    "The offering is being presented free and clear of existing debt to qualified investors.",
+    "Water, sewer and garbage are billed back to residents through a ratio utility billing system.",
+    "The asset benefits from strong visibility and direct access to the state highway network.",
+    "Occupancy has averaged above ninety five percent over the trailing twenty four months.",
+]
+
+_TABLE_ROWS = [
+    "Gross Potential Rent",
+    "Vacancy Allowance",
+    "Effective Gross Income",
+    "Property Taxes",
+    "Insurance",
+    "Repairs & Maintenance",
+    "Utilities",
+    "Management Fee",
+    "Total Operating Expenses",
+    "Net Operating Income",
+]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _text(x, y, text, size=10, font="F1"):
+    return f"BT /{font} {size} Tf {x} {y} Td ({_escape(text)}) Tj ET"
+
+
+def _wrap(text, width=95):
+    lines, line = [], ""
+    for word in text.split():
+        if len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _page_stream(rnd, page_no, with_image):
+    ops = [_text(50, 740, f"Section {page_no}: Investment Overview", size=16, font="F2")]
+
+    # Prose
+    y = 710
+    for _ in range(3):
+        paragraph = " ".join(rnd.choice(_SENTENCES) for _ in range(4))
+        for line in _wrap(paragraph):
+            ops.append(_text(50, y, line))
+            y -= 13
+        y -= 8
+
+    # Ruled financial table
+    ops.append(_text(50, y - 4, f"Operating Statement - Year {2014 + page_no % 8}", size=12, font="F2"))
+    top = y - 16
+    row_h, cols = 16, [50, 280, 400, 520]
+    rows = [("Line Item", "Annual", "Per Unit")]
+    for label in _TABLE_ROWS:
+        amount = rnd.randint(5_000, 400_000)
+        rows.append((label, f"${amount:,}", f"${amount // 25:,}"))
+    bottom = top - row_h * len(rows)
+    ops.append("0.5 w")
+    for i in range(len(rows) + 1):
+        ops.append(f"{cols[0]} {top - i * row_h} m {cols[-1]} {top - i * row_h} l S")
+    for x in cols:
+        ops.append(f"{x} {top} m {x} {bottom} l S")
+    for i, row in enumerate(rows):
+        for j, cell in enumerate(row):
+            font = "F2" if i == 0 else "F1"
+            ops.append(_text(cols[j] + 4, top - (i + 1) * row_h + 4, cell, size=9, font=font))
+
+    if with_image:
+        ops.append(f"q 240 0 0 150 50 {max(40, bottom - 170)} cm /Im1 Do Q")
+    return "\n".join(ops).encode("latin-1")
+
+
+def _image_data(seed, w=160, h=100):
+    rnd = random.Random(seed)
+    base = [rnd.randint(40, 200) for _ in range(3)]
+    rows = bytearray()
+    for y in range(h):
+        for x in range(w):
+            sky = y < h // 2
+            r = (base[0] + x) % 256 if sky else (base[0] // 2 + y) % 256
+            g = (base[1] + y) % 256 if sky else (base[1] // 2 + x // 2) % 256
+            b = 230 if sky else (base[2] // 3) % 256
+            rows += bytes((r, g, b))
+    return w, h, zlib.compress(bytes(rows))
+
+
+def build_pdf(pages, seed=0):
+    """Return the bytes of a `pages`-page memorandum-like PDF."""
+    rnd = random.Random(seed)
+    objects = {}
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    objects[4] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>"
+
+    kids, next_id = [], 5
+    for page_no in range(1, pages + 1):
+        with_image = page_no % 3 == 1
+        page_id, content_id = next_id, next_id + 1
+        next_id += 2
+
+        xobjects = b""
+        if with_image:
+            image_id = next_id
+            next_id += 1
+            w, h, data = _image_data(seed * 1000 + page_no)
+            objects[image_id] = (
+                f"<< /Type /XObject /Subtype /Image /Width {w} /Height {h} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+                f"/Length {len(data)} >>\nstream\n"
+            ).encode() + data + b"\nendstream"
+            xobjects = f" /XObject << /Im1 {image_id} 0 R >>".encode()
+
+        stream = zlib.compress(_page_stream(rnd, page_no, with_image))
+        objects[content_id] = (
+            f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode()
+            + stream + b"\nendstream"
+        )
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_W} {PAGE_H}] "
+            f"/Contents {content_id} 0 R /Resources << /Font << /F1 3 0 R /F2 4 0 R >>"
+        ).encode() + xobjects + b" >> >>"
+        kids.append(page_id)
+
+    objects[2] = (
+        f"<< /Type /Pages /Count {len(kids)} /Kids [{' '.join(f'{k} 0 R' for k in kids)}] >>"
+    ).encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n".encode() + objects[obj_id] + b"\nendobj\n"
+    xref = len(out)
+    size = max(objects) + 1
+    out += f"xref\n0 {size}\n0000000000 65535 f \n".encode()
+    for obj_id in range(1, size):
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def ensure_fixtures(names=None, directory=FIXTURE_DIR):
+    """Write the requested fixtures (all by default) and return {name: path}."""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name in names or SIZES:
+        path = os.path.join(directory, f"memorandum_{name}.pdf")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(build_pdf(SIZES[name], seed=list(SIZES).index(name)))
+        paths[name] = path
+    return paths
+
+
+if __name__ == "__main__":
+    for name, path in ensure_fixtures().items():
+        print(f"{name}: {path}")
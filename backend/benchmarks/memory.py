@@ -0,0 +1,156 @@
+"""
+Peak memory of ingestion as the page count grows.
+
+Every (page count, mode) pair runs in a fresh subprocess, which builds a
+fixture PDF of that many pages (`fixtures.build_pdf`, a photo every third
+page), ingests it with the deterministic stand-ins from `fakes` into a
+vector store (`--backend`) and an SQLite chunk store in a temporary
+directory, and reports its peak RSS (`ru_maxrss`). Modes:
+
+- whole:    `storing`, the whole document at once
+- windowed: `storing_windowed`, `--window` pages at a time with images
+            spilled to disk (optionally under a `--memory-mb` ceiling)
+
+Windowed peak RSS should stay flat as pages grow; whole grows with them.
+
+Usage (from `backend/`):
+
+    python -m benchmarks.memory                       # 16 64 256 pages
+    python -m benchmarks.memory --pages 32 128 512 --window 8 --memory-mb 1500
+
+Like `benchmarks.run`, partitioning runs the real `unstructured` stack, so
+the layout model has to be installed.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import BACKEND_DIR, RESULTS_DIR, _git_commit, _vectorstore
+
+MODES = ("whole", "windowed")
+
+
+def _peak_rss_mb():
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# -------------------------------
+# One ingestion (child process)
+# -------------------------------
+def child(pages, mode, workdir, backend="chroma"):
+    from langchain.retrievers.multi_vector import MultiVectorRetriever
+
+    from benchmarks import fakes
+    from benchmarks.fixtures import build_pdf
+    from chunkstore import ChunkStore
+    import vectorStoring
+
+    provider = fakes.install()
+    path = os.path.join(workdir, f"memorandum_{pages}.pdf")
+    with open(path, "wb") as f:
+        f.write(build_pdf(pages, seed=pages))
+
+    vectorstore = _vectorstore(backend, provider, workdir)
+    retriever = MultiVectorRetriever(
+        vectorstore=vectorstore, docstore=ChunkStore(os.path.join(workdir, "chunks.sqlite3")), id_key="doc_id"
+    )
+    baseline = _peak_rss_mb()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        if mode == "whole":
+            summary_to_chunk, _ = vectorStoring.storing(path, retriever, vectorstore, provider=provider)
+            entries = len(summary_to_chunk)
+            del summary_to_chunk
+        else:
+            entries, _, _ = vectorStoring.storing_windowed(path, retriever, provider=provider)
+    return {
+        "pages": pages,
+        "mode": mode,
+        "entries": entries,
+        "seconds": round(time.perf_counter() - start, 3),
+        "baseline_mb": round(baseline, 1),
+        "peak_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _run_child(pages, mode, window, memory_mb, backend, verbose):
+    with tempfile.TemporaryDirectory(prefix="deallens-memory-") as workdir:
+        env = {
+            **os.environ,
+            "DEALLENS_STATE_DIR": os.path.join(workdir, "state"),
+            "DEALLENS_SPOOL_DIR": os.path.join(workdir, "spool"),
+            "DEALLENS_PARTITION_CACHE": "0",
+            "DEALLENS_INGEST_WINDOW_PAGES": str(window if mode == "windowed" else 0),
+            "DEALLENS_INGEST_MEMORY_MB": str(memory_mb if mode == "windowed" else 0),
+        }
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.memory", "--backend", backend, "--child", str(pages), mode, workdir],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE,
+            stderr=None if verbose else subprocess.DEVNULL, text=True, check=True,
+        )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(page_counts, window, memory_mb, backend, verbose):
+    results = []
+    print(f"{'pages':>6} {'mode':<9} {'entries':>8} {'seconds':>9} {'peak MB':>9}")
+    for pages in page_counts:
+        for mode in MODES:
+            result = _run_child(pages, mode, window, memory_mb, backend, verbose)
+            results.append(result)
+            print(f"{pages:>6} {mode:<9} {result['entries']:>8} {result['seconds']:>9.2f} {result['peak_mb']:>9.1f}")
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {"window_pages": window, "memory_mb": memory_mb, "backend": backend},
+        "runs": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", nargs="+", type=int, default=[16, 64, 256])
+    parser.add_argument("--window", type=int, default=8, help="pages per window in windowed mode")
+    parser.add_argument("--memory-mb", type=int, default=0, help="RSS ceiling in windowed mode (0 = none)")
+    parser.add_argument("--backend", choices=["chroma", "memmap"], default="chroma", help="vector store backend")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/memory-<timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own print output")
+    parser.add_argument("--child", nargs=3, metavar=("PAGES", "MODE", "WORKDIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    if args.child:
+        pages, mode, workdir = args.child
+        print(json.dumps(child(int(pages), mode, workdir, args.backend)))
+        return
+
+    result = run(args.pages, args.window, args.memory_mb, args.backend, args.verbose)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"memory-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[memory] results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
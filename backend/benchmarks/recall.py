@@ -0,0 +1,189 @@
+"""
+Recall / latency / size report for reduced vector storage (`vectorindex`).
+
+Embeds text chunks from the fixture PDFs once, then for every layout
+(truncated dimension x float32 / float16 / int8, with and without
+full-precision rescoring) writes a memmap segment and measures, against
+exact full-width float32 search:
+
+- recall@k of the returned ids
+- mean query latency (index lookup only, query embedded up front)
+- bytes per vector of the in-memory search matrix and on disk
+
+Usage (from `backend/`):
+
+    python -m benchmarks.recall                       # fake 3072-d embeddings
+    python -m benchmarks.recall --scale 20 --dims 3072 1024 256
+    python -m benchmarks.recall --provider openai      # real Matryoshka embeddings
+
+The default hashing embeddings are not Matryoshka-trained, so truncation
+costs them more recall than it costs text-embedding-3; use `--provider`
+for numbers that carry over to production.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.run import BACKEND_DIR, QUERIES, RESULTS_DIR, _git_commit
+
+
+def fixture_chunks(sizes, scale, window=3, stride=2):
+    """Overlapping line windows of the fixtures' page text, `scale` copies per deal."""
+    import pypdf
+
+    from benchmarks.fixtures import ensure_fixtures
+
+    pages = []
+    for path in ensure_fixtures(sizes).values():
+        pages.extend(page.extract_text() or "" for page in pypdf.PdfReader(path).pages)
+
+    chunks = []
+    for copy in range(scale):
+        for page_no, text in enumerate(pages):
+            lines = [line for line in text.splitlines() if line.strip()]
+            for start in range(0, max(1, len(lines) - window + 1), stride):
+                body = " ".join(lines[start:start + window])
+                chunks.append(f"deal {copy} page {page_no} {body}")
+    return chunks
+
+
+def layouts(dims, dtypes):
+    for dim in dims:
+        for dtype in dtypes:
+            yield {"dim": dim, "dtype": dtype, "rescore": False}
+            if dim or dtype != "float32":
+                yield {"dim": dim, "dtype": dtype, "rescore": True}
+
+
+def _disk_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(".npy"))
+
+
+def evaluate(vectors, ids, texts, queries, embeddings, k, layout, full_dim):
+    from vectorindex import MemmapVectorStore, write_segment
+
+    with tempfile.TemporaryDirectory(prefix="deallens-recall-") as directory:
+        dim = layout["dim"] if layout["dim"] and layout["dim"] < full_dim else 0
+        metadatas = [{"doc_id": i} for i in ids]
+        write_segment(directory, "default", ids, texts, metadatas, vectors,
+                      dim=dim, dtype=layout["dtype"], rescore=layout["rescore"])
+        store = MemmapVectorStore(directory, embeddings)
+        seg = store.segment("default")
+        search_bytes = seg.vectors.nbytes
+        disk_bytes = _disk_bytes(directory)
+
+        store.similarity_search_by_vector(queries[0][1], k=k)  # warm the page cache
+        hits, elapsed = [], 0.0
+        for _, query in queries:
+            start = time.perf_counter()
+            docs = store.similarity_search_by_vector(query, k=k)
+            elapsed += time.perf_counter() - start
+            hits.append([doc.id for doc in docs])
+        del seg, store
+    return hits, elapsed / len(queries), search_bytes / len(ids), disk_bytes / len(ids)
+
+
+def run(sizes, scale, dims, dtypes, k, n_queries, provider):
+    import numpy as np
+
+    from vectorindex import _normalize
+
+    if provider:
+        from llms import embedding_model
+
+        embeddings = embedding_model(provider)
+    else:
+        from benchmarks.fakes import HashingEmbeddings
+
+        embeddings = HashingEmbeddings(dim=3072)
+
+    texts = fixture_chunks(sizes, scale)
+    ids = [str(i) for i in range(len(texts))]
+    print(f"[recall] embedding {len(texts)} chunks")
+    vectors = _normalize(embeddings.embed_documents(texts))
+    full_dim = vectors.shape[1]
+
+    rnd = random.Random(0)
+    query_texts = list(QUERIES) + [" ".join(t.split()[4:16]) for t in rnd.sample(texts, min(len(texts), n_queries))]
+    queries = [(q, np.asarray(embeddings.embed_query(q), dtype=np.float32)) for q in query_texts]
+
+    # Ground truth: exact full-width float32 scores. The fixture copies make
+    # near-duplicate chunks, so a hit counts when it scores at least the k-th
+    # exact score (ties are interchangeable) rather than by id.
+    exact, cutoffs = [], []
+    for _, query in queries:
+        scores = vectors @ (query / (np.linalg.norm(query) or 1))
+        exact.append(scores)
+        cutoffs.append(np.sort(scores)[-k] - 1e-6)
+
+    rows = []
+    for layout in layouts(dims, dtypes):
+        hits, latency, search_bpv, disk_bpv = evaluate(
+            vectors, ids, texts, queries, embeddings, k, layout, full_dim
+        )
+        recall = sum(
+            sum(exact[i][int(id_)] >= cutoffs[i] for id_ in h) for i, h in enumerate(hits)
+        ) / (k * len(queries))
+        rows.append({
+            **layout,
+            "dim": layout["dim"] or full_dim,
+            "recall": round(recall, 4),
+            "latency_ms": round(latency * 1000, 4),
+            "search_bytes_per_vector": round(search_bpv, 1),
+            "disk_bytes_per_vector": round(disk_bpv, 1),
+            "search_shrink": round(full_dim * 4 / search_bpv, 2),
+        })
+        r = rows[-1]
+        print(f"[recall] dim={r['dim']:<5} {r['dtype']:<8} rescore={str(r['rescore']):<5} "
+              f"recall@{k}={r['recall']:.3f} {r['latency_ms']:.3f}ms "
+              f"{r['search_bytes_per_vector']:.0f}B/vec ({r['search_shrink']}x)")
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "config": {
+            "sizes": sizes, "scale": scale, "k": k, "queries": len(queries),
+            "vectors": len(ids), "full_dim": full_dim, "provider": provider or "hashing",
+        },
+        "layouts": rows,
+    }
+
+
+def main(argv=None):
+    from benchmarks.fixtures import SIZES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--scale", type=int, default=10, help="copies of the fixture corpus (deals)")
+    parser.add_argument("--dims", nargs="+", type=int, default=[0, 1024, 512, 256], help="0 = full width")
+    parser.add_argument("--dtypes", nargs="+", choices=["float32", "float16", "int8"],
+                        default=["float32", "float16", "int8"])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=50, help="extra queries sampled from the corpus")
+    parser.add_argument("--provider", help="embedding provider from llms (default: offline hashing)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/recall-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    result = run(args.sizes, args.scale, args.dims, args.dtypes, args.k, args.queries, args.provider)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"recall-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[recall] results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
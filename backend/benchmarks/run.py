@@ -0,0 +1,260 @@
+"""
+Offline benchmark for the ingest / retrieval / report pipeline.
+
+Runs `chunking`, `storing`, `rag` and `build_report` over the generated
+fixture PDFs with the deterministic model stand-ins from `fakes`, times
+every stage plus the end-to-end path, and writes the numbers as JSON.
+
+Usage (from `backend/`):
+
+    python -m benchmarks.run                          # all fixtures, no simulated latency
+    python -m benchmarks.run --sizes small --latency 0.2 --rps 5
+    python -m benchmarks.run --compare before.json after.json
+
+`chunking` still runs the real `unstructured` hi_res partitioner, so the
+layout model has to be installed; nothing talks to a hosted API.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+QUERIES = [
+    "What is the net operating income?",
+    "What are the operating expenses for property taxes and insurance?",
+    "Describe the location and the surrounding submarket.",
+    "What value-add opportunities are mentioned?",
+    "What is the occupancy history?",
+    "Describe the property photos.",
+]
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "seconds": round(sum(ordered), 6),
+        "calls": len(ordered),
+        "mean": round(statistics.fmean(ordered), 6) if ordered else 0.0,
+        "p50": round(ordered[len(ordered) // 2], 6) if ordered else 0.0,
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 6) if ordered else 0.0,
+        "max": round(ordered[-1], 6) if ordered else 0.0,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+# -------------------------------
+# One pipeline run over one fixture
+# -------------------------------
+def _vectorstore(backend, provider, workdir):
+    from llms import embedding_model
+
+    if backend == "memmap":
+        from vectorindex import MemmapVectorStore
+
+        return MemmapVectorStore(os.path.join(workdir, "vector_index"), embedding_model(provider))
+
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        persist_directory=os.path.join(workdir, "chroma_db"),
+        collection_name="benchmark",
+        embedding_function=embedding_model(provider),
+    )
+
+
+def run_fixture(path, provider, queries, workdir, backend="chroma"):
+    from langchain.retrievers.multi_vector import MultiVectorRetriever
+    from langchain.storage import InMemoryStore
+
+    from noPklRetrieval import rag
+    from reportMaker import build_report
+    from vectorStoring import chunking, storing
+
+    stages = {}
+
+    (chunks, images), seconds = _timed(chunking, path)
+    stages["chunking"] = {"seconds": seconds, "chunks": len(chunks), "images": len(images)}
+
+    vectorstore = _vectorstore(backend, provider, workdir)
+    retriever = MultiVectorRetriever(vectorstore=vectorstore, docstore=InMemoryStore(), id_key="doc_id")
+
+    e2e_start = time.perf_counter()
+    (summary_to_chunk, _), seconds = _timed(storing, path, retriever, vectorstore, provider=provider)
+    stages["storing"] = {"seconds": seconds, "entries": len(summary_to_chunk)}
+
+    samples = []
+    for query in queries:
+        _, seconds = _timed(rag, query, vectorstore, summary_to_chunk, llm_provider=provider)
+        samples.append(seconds)
+    stages["rag"] = _summary(samples)
+
+    # Index lookup alone (query embeddings computed up front)
+    vectors = [vectorstore.embeddings.embed_query(query) for query in queries]
+    samples = [_timed(vectorstore.similarity_search_by_vector, vector, k=5)[1] for vector in vectors]
+    stages["search"] = _summary(samples)
+
+    report, seconds = _timed(build_report, vectorstore, summary_to_chunk, llm_provider=provider)
+    stages["build_report"] = {"seconds": seconds, "sections": len(report)}
+
+    return stages, time.perf_counter() - e2e_start
+
+
+def _median_stage(runs, name):
+    """Collapse repeated runs of one stage into medians, keeping the raw samples."""
+    entries = [r[name] for r in runs]
+    merged = dict(entries[len(entries) // 2])
+    samples = [e["seconds"] for e in entries]
+    merged["seconds"] = round(statistics.median(samples), 6)
+    merged["samples"] = [round(s, 6) for s in samples]
+    return merged
+
+
+def run(sizes, repeat, latency, rps, embed_latency, embed_rps, n_queries, verbose, backend="chroma"):
+    from benchmarks import fakes
+    from benchmarks.fixtures import SIZES, ensure_fixtures
+
+    provider = fakes.install(
+        latency=latency,
+        requests_per_second=rps,
+        embed_latency=embed_latency,
+        embed_requests_per_second=embed_rps,
+    )
+    queries = QUERIES[:n_queries]
+    results = {}
+
+    for name, path in ensure_fixtures(sizes).items():
+        print(f"[bench] {name} ({SIZES[name]} pages) x{repeat}")
+        runs, e2e = [], []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory(prefix="deallens-bench-") as workdir:
+                sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+                with sink:
+                    stages, seconds = run_fixture(path, provider, queries, workdir, backend)
+            runs.append(stages)
+            e2e.append(seconds)
+
+        results[name] = {
+            "pages": SIZES[name],
+            "bytes": os.path.getsize(path),
+            "stages": {stage: _median_stage(runs, stage) for stage in runs[0]},
+            "end_to_end": {
+                "seconds": round(statistics.median(e2e), 6),
+                "samples": [round(s, 6) for s in e2e],
+            },
+        }
+        for stage, data in results[name]["stages"].items():
+            print(f"[bench]   {stage:<13} {data['seconds']:.3f}s")
+        print(f"[bench]   {'end_to_end':<13} {results[name]['end_to_end']['seconds']:.3f}s")
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            "provider": provider,
+            "repeat": repeat,
+            "latency": latency,
+            "requests_per_second": rps,
+            "embed_latency": embed_latency,
+            "embed_requests_per_second": embed_rps,
+            "queries": len(queries),
+            "backend": backend,
+        },
+        "fixtures": results,
+    }
+
+
+# -------------------------------
+# Comparing two result files
+# -------------------------------
+def compare(before_path, after_path):
+    with open(before_path, "r", encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_path, "r", encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"{'fixture':<8} {'stage':<13} {'before':>10} {'after':>10} {'speedup':>8}")
+    for name, data in after["fixtures"].items():
+        if name not in before["fixtures"]:
+            continue
+        old = before["fixtures"][name]
+        rows = [(s, old["stages"].get(s), d) for s, d in data["stages"].items()]
+        rows.append(("end_to_end", old.get("end_to_end"), data["end_to_end"]))
+        for stage, prev, cur in rows:
+            if not prev:
+                continue
+            ratio = prev["seconds"] / cur["seconds"] if cur["seconds"] else float("inf")
+            print(f"{name:<8} {stage:<13} {prev['seconds']:>10.3f} {cur['seconds']:>10.3f} {ratio:>7.2f}x")
+
+
+def main(argv=None):
+    from benchmarks.fixtures import SIZES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per chat call")
+    parser.add_argument("--rps", type=float, default=None, help="chat rate limit (requests/second)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="simulated seconds per embedding batch")
+    parser.add_argument("--embed-rps", type=float, default=None, help="embedding rate limit (requests/second)")
+    parser.add_argument("--queries", type=int, default=len(QUERIES), help="number of rag() queries to time")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/bench-<timestamp>.json)")
+    parser.add_argument("--backend", choices=["chroma", "memmap"], default="chroma", help="vector store backend")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own print output")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # The pipeline modules read schema.json etc. relative to backend/.
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+    result = run(
+        args.sizes, args.repeat, args.latency, args.rps,
+        args.embed_latency, args.embed_rps, args.queries, args.verbose, args.backend,
+    )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"[bench] results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Import-time budget check for the FastAPI app.
+
+Imports `app` in a fresh interpreter, measures wall time and peak RSS, and
+fails (exit status 1) when the import goes over budget or drags in one of
+the heavy dependencies that must only load on first use.
+
+Usage (from `backend/`):
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --budget-seconds 1.0 --budget-mb 150
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that a chat-only worker should never import at startup.
+LAZY_MODULES = [
+    "unstructured",
+    "unstructured_inference",
+    "chromadb",
+    "langchain_chroma",
+    "langchain_openai",
+    "langchain_google_genai",
+    "PIL",
+]
+
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+print(json.dumps({
+    "seconds": seconds,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": sorted(m for m in %r if m in sys.modules),
+}))
+"""
+
+
+def measure(runs=3):
+    """Import the app `runs` times in fresh interpreters; keep the fastest sample."""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.check_output(
+            [sys.executable, "-c", _PROBE % (LAZY_MODULES,)], cwd=BACKEND_DIR, text=True
+        )
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return min(samples, key=lambda s: s["seconds"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-seconds", type=float, default=1.5)
+    parser.add_argument("--budget-mb", type=float, default=200.0)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    result = measure(args.runs)
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if result["seconds"] > args.budget_seconds:
+        failures.append(f"import took {result['seconds']:.2f}s (budget {args.budget_seconds:.2f}s)")
+    if result["max_rss_mb"] > args.budget_mb:
+        failures.append(f"peak RSS {result['max_rss_mb']:.0f}MB (budget {args.budget_mb:.0f}MB)")
+    if result["loaded"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(result['loaded'])}")
+
+    for failure in failures:
+        print(f"[startup] FAIL {failure}")
+    if failures:
+        sys.exit(1)
+    print("[startup] OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+SQLite-backed doc_id -> original chunk store.
+
+Replaces the `summary_to_chunk.pkl` dict that every worker loaded into
+memory and `storing()` rewrote wholesale. SQLite (in WAL mode) gives
+transactional writes and always-fresh reads across worker processes, so
+there is no torn pickle and no stale per-worker copy.
+
+`ChunkStore` is a LangChain `BaseStore` (usable as the
+`MultiVectorRetriever` docstore) and also supports the small dict API the
+rest of the code uses on `summary_to_chunk` (`get`, `[]`, `in`, `len`,
+`update`, `items`).
+
+Each chunk can also carry the `file_id` and `type` of the vector it was
+stored with (`mset(..., tags=...)`), so the consistency check can embed a
+chunk that lost its vector back into the right document.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+
+from langchain_core.stores import BaseStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    doc_id TEXT PRIMARY KEY,
+    value  BLOB NOT NULL
+)
+"""
+# column -> SQL type; added to existing stores on open
+TAG_COLUMNS = {"file_id": "TEXT", "type": "TEXT"}
+
+
+class ChunkStore(BaseStore):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(_SCHEMA)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+            for name, typ in TAG_COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE chunks ADD COLUMN {name} {typ}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------------------
+    # BaseStore API
+    # -------------------------------
+    def mget(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        found = {}
+        conn = self._conn()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT doc_id, value FROM chunks WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update((doc_id, pickle.loads(value)) for doc_id, value in rows)
+        return [found.get(k) for k in keys]
+
+    def mset(self, key_value_pairs, tags=None):
+        """Store values; `tags` maps doc_ids to `(file_id, type)` (a chunk keeps its tags otherwise)."""
+        tags = tags or {}
+        rows = [(k, pickle.dumps(v), *tags.get(k, (None, None))) for k, v in key_value_pairs]
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO chunks (doc_id, value, file_id, type) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(doc_id) DO UPDATE SET value = excluded.value, "
+                "file_id = COALESCE(excluded.file_id, file_id), type = COALESCE(excluded.type, type)",
+                rows,
+            )
+
+    def tags(self, keys):
+        """`{doc_id: (file_id, type)}` of the `keys` stored with tags."""
+        keys = list(keys)
+        found = {}
+        conn = self._conn()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = conn.execute(
+                f"SELECT doc_id, file_id, type FROM chunks WHERE doc_id IN ({','.join('?' * len(batch))}) "
+                "AND (file_id IS NOT NULL OR type IS NOT NULL)",
+                batch,
+            )
+            found.update((doc_id, (file_id, kind)) for doc_id, file_id, kind in rows)
+        return found
+
+    def mdelete(self, keys):
+        with self._conn() as conn:
+            conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(k,) for k in keys])
+
+    def yield_keys(self, prefix=None):
+        conn = self._conn()
+        if prefix:
+            rows = conn.execute(
+                "SELECT doc_id FROM chunks WHERE doc_id >= ? AND doc_id < ? ORDER BY doc_id",
+                (prefix, prefix + "\uffff"),
+            )
+        else:
+            rows = conn.execute("SELECT doc_id FROM chunks ORDER BY doc_id")
+        for (doc_id,) in rows:
+            yield doc_id
+
+    # -------------------------------
+    # dict-style helpers (summary_to_chunk)
+    # -------------------------------
+    def get(self, key, default=None):
+        value = self.mget([key])[0]
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.mset([(key, value)])
+
+    def __contains__(self, key):
+        row = self._conn().execute("SELECT 1 FROM chunks WHERE doc_id = ?", (key,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def __iter__(self):
+        return self.yield_keys()
+
+    def keys(self):
+        return self.yield_keys()
+
+    def items(self):
+        for doc_id, value in self._conn().execute("SELECT doc_id, value FROM chunks ORDER BY doc_id"):
+            yield doc_id, pickle.loads(value)
+
+    def update(self, mapping):
+        self.mset(mapping.items())
+
+
+def open_chunk_store(path, legacy_pickle=None):
+    """Open the store, importing the legacy `summary_to_chunk.pkl` on first use."""
+    fresh = not os.path.exists(path)
+    store = ChunkStore(path)
+    if fresh and legacy_pickle and os.path.exists(legacy_pickle):
+        with open(legacy_pickle, "rb") as f:
+            store.update(pickle.load(f))
+        print(f"Imported {len(store)} entries from {legacy_pickle}")
+    return store
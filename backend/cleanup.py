@@ -0,0 +1,376 @@
+"""
+Document deletion, retention and store compaction.
+
+`delete_document` removes every artifact of one document: its vectors
+(the memmap segment, or the Chroma rows with its `file_id`), their chunk
+store entries, the report with its compressed variants, sources and
+section cache, chat sessions, table sidecars, the uploaded PDF and the
+registry row.
+
+`collect` is the garbage-collection job:
+
+- deletes documents nobody used for `DEALLENS_RETENTION_DAYS` (last
+  registry update, report read or chat turn), and failed or never-ingested ones after
+  `DEALLENS_RETENTION_FAILED_DAYS`
+- with `DEALLENS_GC_SWEEP_ORPHANS` (or `--orphans`), sweeps uploads,
+  reports, table sidecars, vectors and spool directories that belong to no
+  registered document (after a grace period, so nothing being written
+  right now is touched). Files from before the registry are registered by
+  `DocumentRegistry.backfill` when it is first opened, so they are not
+  orphans.
+- compacts the stores: VACUUMs the SQLite files (chunk store, registry,
+  sessions, screening index, Chroma's own database) once enough of them is free pages, and
+  removes memmap matrix files no segment refers to
+
+The app runs it every `DEALLENS_GC_INTERVAL_HOURS` (one worker at a time);
+it also runs from the command line (from `backend/`), where it only lists
+what it would remove unless given `--apply`:
+
+    python cleanup.py [--orphans] [--compact] [--apply]
+
+The partition cache is keyed by page content and shared between documents,
+so it is not tied to any one of them and is left alone.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import documents
+import metrics
+import rowslices
+import storage
+from config import get_settings
+
+# uploads / reports / vectors younger than this may still be being written
+GRACE_SECONDS = 3600
+# VACUUM once this share of a database is free pages
+VACUUM_FREE_RATIO = 0.2
+
+_INGESTING = (documents.QUEUED, documents.PARTITIONING, documents.SUMMARIZING, documents.STORING)
+
+
+class DocumentBusy(Exception):
+    """The document is being ingested and cannot be deleted right now."""
+
+
+def _file_id_of(name):
+    match = documents.FILE_ID.match(name)
+    return match.group(0) if match else None
+
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return True
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+# -------------------------------
+# One document
+# -------------------------------
+def _document_vectors(vectorstore, file_id, batch_size=500):
+    """`(vector id, doc_id)` of every vector of `file_id`, read in pages."""
+    found = []
+    while True:
+        page = vectorstore.get(
+            where={"file_id": file_id}, limit=batch_size, offset=len(found), include=["metadatas"]
+        )
+        ids = page.get("ids") or []
+        found.extend(
+            (vector_id, (metadata or {}).get("doc_id")) for vector_id, metadata in zip(ids, page["metadatas"])
+        )
+        if len(ids) < batch_size:
+            return found
+
+
+def delete_vectors(file_id, vectorstore, chunk_store):
+    """Remove the vectors of `file_id` and the chunks they point to; returns the vector count."""
+    from stores import vectorstore_write_lock
+
+    vectors = _document_vectors(vectorstore, file_id)
+    if not vectors:
+        return 0
+    with vectorstore_write_lock():
+        if hasattr(vectorstore, "drop_segment"):
+            vectorstore.drop_segment(file_id)
+        else:
+            vectorstore.delete(ids=[vector_id for vector_id, _ in vectors])
+        chunk_store.mdelete([doc_id for _, doc_id in vectors if doc_id])
+    storage.bump("vectorstore")
+    return len(vectors)
+
+
+def delete_report(file_id):
+    """Remove the report, its sources and section cache; True if there was one."""
+    import reportfiles
+    from revisions import report_path
+
+    path = report_path(file_id)
+    with storage.file_lock(path):
+        existed = os.path.exists(path) or os.path.isdir(reportfiles.sections_dir(path))
+        reportfiles.remove(path)
+        reportfiles.clear_sections(path)
+    return existed
+
+
+def _uploads_of(file_id, doc):
+    upload_dir = get_settings().upload_dir
+    paths = {os.path.join(upload_dir, name) for name in os.listdir(upload_dir) if name.startswith(f"{file_id}_")}
+    if doc and doc.get("path"):
+        paths.add(doc["path"])
+    return paths
+
+
+def delete_document(file_id, force=False):
+    """Remove every artifact of `file_id`; returns what was removed.
+
+    Raises `KeyError` for an unknown document and `DocumentBusy` while it
+    is being ingested (unless `force`).
+    """
+    from stores import get_chunk_store, get_registry, get_sessions, get_vectorstore
+
+    registry = get_registry()
+    doc = registry.get(file_id)
+    if doc is None:
+        raise KeyError(file_id)
+    if doc["status"] in _INGESTING and not force:
+        raise DocumentBusy(doc["status"])
+
+    with metrics.track("delete_document"):
+        removed = {
+            "vectors": delete_vectors(file_id, get_vectorstore(), get_chunk_store()),
+            "report": delete_report(file_id),
+            "sessions": get_sessions().delete_file(file_id),
+            "tables": rowslices.clear(file_id),
+            "uploads": sum(_remove_path(path) for path in _uploads_of(file_id, doc)),
+        }
+        # last, so an interrupted deletion can simply be retried
+        registry.delete(file_id)
+        metrics.count("documents_deleted")
+    print(f"Deleted document {file_id}: {removed}")
+    return removed
+
+
+# -------------------------------
+# Retention
+# -------------------------------
+def expired(settings=None, now=None):
+    """file_ids past their retention period."""
+    from stores import get_registry, get_sessions
+
+    settings = settings or get_settings()
+    now = now or time.time()
+    chats = get_sessions().last_used() if settings.retention_days else {}
+    out = []
+    for doc in get_registry().all():
+        if doc["status"] in _INGESTING:
+            continue
+        last_used = max(doc["updated_at"] or 0, doc["accessed_at"] or 0, chats.get(doc["file_id"]) or 0)
+        if doc["status"] in (documents.FAILED, documents.UPLOADED):
+            days = settings.retention_failed_days or settings.retention_days
+        else:
+            days = settings.retention_days
+        if days and now - last_used > days * 86400:
+            out.append(doc["file_id"])
+    return out
+
+
+# -------------------------------
+# Orphans
+# -------------------------------
+def _old(path, now):
+    try:
+        return now - os.stat(path).st_mtime > GRACE_SECONDS
+    except FileNotFoundError:
+        return False
+
+
+def orphan_files(known, known_paths, now=None):
+    """Uploads, report files, table sidecars and spool directories of no registered document."""
+    settings = get_settings()
+    now = now or time.time()
+    out = []
+    for directory in (settings.upload_dir, settings.report_dir, settings.table_dir):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            file_id = _file_id_of(name)
+            if file_id is None or file_id in known or os.path.abspath(path) in known_paths:
+                continue
+            if _old(path, now):
+                out.append(path)
+    if os.path.isdir(settings.spool_dir):
+        # an ingestion removes its spool on exit; these are left by crashed workers
+        out.extend(
+            os.path.join(settings.spool_dir, name) for name in os.listdir(settings.spool_dir)
+            if _old(os.path.join(settings.spool_dir, name), now)
+        )
+    return out
+
+
+def orphan_vector_files(vectorstore, known, batch_size=500):
+    """file_ids with vectors but no registry row (vectors without a file_id are kept)."""
+    if hasattr(vectorstore, "segment_names"):
+        stale = set()
+        for name in vectorstore.segment_names():
+            seg = vectorstore.segment(name)
+            if seg is not None and seg.metadatas:
+                file_id = seg.metadatas[0].get("file_id")
+                if file_id and file_id not in known:
+                    stale.add(file_id)
+        return stale
+    from equality_check import _pages
+
+    return {
+        metadata["file_id"]
+        for _, metadatas in _pages(vectorstore, batch_size)
+        for metadata in metadatas
+        if metadata and metadata.get("file_id") and metadata["file_id"] not in known
+    }
+
+
+# -------------------------------
+# Compaction
+# -------------------------------
+def _db_size(path):
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+def vacuum(path, force=False):
+    """VACUUM the SQLite file at `path` when enough of it is free; returns bytes reclaimed."""
+    if not os.path.exists(path):
+        return 0
+    before = _db_size(path)
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not pages or (not force and free / pages < VACUUM_FREE_RATIO):
+            return 0
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return max(0, before - _db_size(path))
+
+
+def compact(vectorstore, force=False):
+    """Compact the SQLite stores and the vector index; returns what was reclaimed."""
+    from stores import vectorstore_write_lock
+
+    settings = get_settings()
+    reclaimed = {
+        name: vacuum(path, force)
+        for name, path in (
+            ("chunks", settings.chunk_store_path),
+            ("documents", settings.documents_path),
+            ("sessions", settings.sessions_path),
+            ("screening", settings.screening_path),
+        )
+    }
+    with vectorstore_write_lock():
+        if hasattr(vectorstore, "compact"):
+            reclaimed["vector_files"] = vectorstore.compact()
+        else:
+            reclaimed["vectors"] = vacuum(os.path.join(settings.vectorstore_dir, "chroma.sqlite3"), force)
+    if reclaimed.get("vectors"):
+        storage.bump("vectorstore")
+    return reclaimed
+
+
+# -------------------------------
+# Garbage collection
+# -------------------------------
+def collect(dry_run=False, force_compact=False, settings=None, sweep_orphans=None):
+    """One garbage-collection pass; returns a summary of what it removed (or would remove).
+
+    Orphans are only looked for with `sweep_orphans` (default
+    `DEALLENS_GC_SWEEP_ORPHANS`).
+    """
+    from stores import get_chunk_store, get_registry, get_vectorstore
+
+    settings = settings or get_settings()
+    sweep_orphans = settings.gc_sweep_orphans if sweep_orphans is None else sweep_orphans
+    summary = {"documents": expired(settings), "files": [], "vector_files": []}
+    with metrics.track("garbage_collection"):
+        if not dry_run:
+            for file_id in summary["documents"]:
+                try:
+                    delete_document(file_id)
+                except (KeyError, DocumentBusy):
+                    pass
+
+        vectorstore = get_vectorstore()
+        if sweep_orphans:
+            docs = get_registry().all()
+            known = {doc["file_id"] for doc in docs}
+            known_paths = {os.path.abspath(doc["path"]) for doc in docs if doc.get("path")}
+            summary["files"] = orphan_files(known, known_paths)
+            summary["vector_files"] = sorted(orphan_vector_files(vectorstore, known))
+        if not dry_run:
+            for path in summary["files"]:
+                _remove_path(path)
+            for file_id in summary["vector_files"]:
+                delete_vectors(file_id, vectorstore, get_chunk_store())
+            summary["compacted"] = compact(vectorstore, force=force_compact)
+    print(f"[gc] {'would remove' if dry_run else 'removed'}: "
+          f"{len(summary['documents'])} documents, {len(summary['files'])} files, "
+          f"vectors of {len(summary['vector_files'])} unregistered documents")
+    return summary
+
+
+def _due(interval):
+    stamp = os.path.join(get_settings().state_dir, "gc.last")
+    try:
+        if time.time() - os.stat(stamp).st_mtime < interval:
+            return False
+    except FileNotFoundError:
+        pass
+    storage.atomic_write_bytes(stamp, b"")
+    return True
+
+
+def _loop(interval):
+    while True:
+        try:
+            # every worker runs the loop; the lock and stamp let one of them do the pass
+            with storage.file_lock(os.path.join(get_settings().state_dir, "gc")):
+                due = _due(interval)
+            if due:
+                collect()
+        except Exception as e:
+            print(f"[gc] failed: {e}")
+        time.sleep(interval)
+
+
+def start(settings=None):
+    """Run `collect` every `DEALLENS_GC_INTERVAL_HOURS` in a daemon thread (no-op when 0)."""
+    settings = settings or get_settings()
+    if settings.gc_interval_hours <= 0:
+        return None
+    thread = threading.Thread(target=_loop, args=(settings.gc_interval_hours * 3600,), name="gc", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="remove what is listed (default: only list it)")
+    parser.add_argument("--orphans", action="store_true", default=None,
+                        help="also sweep files and vectors of unregistered documents")
+    parser.add_argument("--compact", action="store_true", help="VACUUM every database regardless of free space")
+    args = parser.parse_args(argv)
+    return collect(dry_run=not args.apply, force_compact=args.compact, sweep_orphans=args.orphans)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Runtime configuration for the backend, read once from the environment.
+
+Relative paths are resolved against the backend directory, so the app
+behaves the same whichever directory uvicorn is started from.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _path(env, default):
+    value = os.getenv(env, default)
+    return value if os.path.isabs(value) else os.path.join(BASE_DIR, value)
+
+
+@dataclass(frozen=True)
+class Settings:
+    vectorstore_dir: str
+    collection_name: str
+    embedding_provider: str
+    llm_provider: str
+    upload_dir: str
+    report_dir: str
+    mapping_path: str
+    schema_path: str
+    frontend_url: str
+    state_dir: str
+    chunk_store_path: str
+    workers: int
+    documents_path: str
+    ingest_root: str
+    ingest_processes: int
+    ingest_threads: int
+    max_llm_calls: int
+    ingest_strategy: str
+    summary_min_chars: int
+    report_batching: bool
+    report_group_overlap: float
+    report_group_max: int
+    vector_backend: str
+    memmap_dir: str
+    hnsw_threshold: int
+    vector_dim: int
+    vector_dtype: str
+    vector_rescore: bool
+    rescore_factor: int
+    retrieval_overfetch: int
+    retrieval_margin: float
+    retrieval_min_score: Optional[float]
+    retrieval_image_k: int
+    sessions_path: str
+    chat_history_tokens: int
+    chat_keep_turns: int
+    chat_context_chunks: int
+    partition_mode: str
+    page_min_chars: int
+    partition_cache: bool
+    partition_cache_dir: str
+    ingest_window_pages: int
+    ingest_memory_mb: int
+    spool_dir: str
+    retention_days: float
+    retention_failed_days: float
+    gc_interval_hours: float
+    gc_sweep_orphans: bool
+    portfolio_workers: int
+    portfolio_timeout: float
+    portfolio_context_tokens: int
+    screening_path: str
+    table_slice_rows: int
+    table_dir: str
+
+    @property
+    def multiprocess(self):
+        """Several uvicorn workers share the stores on this host."""
+        return self.workers > 1
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            vectorstore_dir=_path("DEALLENS_VECTORSTORE_DIR", "chroma_db"),
+            collection_name=os.getenv("DEALLENS_COLLECTION", "multi_modal_rag"),
+            embedding_provider=os.getenv("DEALLENS_EMBEDDING_PROVIDER", "openai"),
+            llm_provider=os.getenv("DEALLENS_LLM_PROVIDER", "openai"),
+            upload_dir=_path("DEALLENS_UPLOAD_DIR", "uploads"),
+            report_dir=_path("DEALLENS_REPORT_DIR", "reports"),
+            mapping_path=_path("DEALLENS_MAPPING_PATH", "summary_to_chunk.pkl"),
+            schema_path=_path("DEALLENS_SCHEMA_PATH", "schema.json"),
+            frontend_url=os.getenv("DEALLENS_FRONTEND_URL", "http://localhost:3000"),
+            state_dir=_path("DEALLENS_STATE_DIR", "state"),
+            chunk_store_path=_path("DEALLENS_CHUNK_STORE", os.path.join("state", "chunks.sqlite3")),
+            workers=int(os.getenv("DEALLENS_WORKERS", "1")),
+            documents_path=_path("DEALLENS_DOCUMENTS_DB", os.path.join("state", "documents.sqlite3")),
+            # server-side directories accepted by the batch ingestion API must live under here
+            ingest_root=_path("DEALLENS_INGEST_ROOT", "inbox"),
+            ingest_processes=int(os.getenv("DEALLENS_INGEST_PROCESSES", str(min(4, os.cpu_count() or 1)))),
+            ingest_threads=int(os.getenv("DEALLENS_INGEST_THREADS", "4")),
+            max_llm_calls=int(os.getenv("DEALLENS_MAX_LLM_CALLS", "8")),
+            # summary | raw | hybrid | tables, see vectorStoring.STRATEGIES
+            ingest_strategy=os.getenv("DEALLENS_INGEST_STRATEGY", "summary"),
+            summary_min_chars=int(os.getenv("DEALLENS_SUMMARY_MIN_CHARS", "1500")),
+            # extract sections with overlapping context in one LLM call (reportMaker.group_sections)
+            report_batching=os.getenv("DEALLENS_REPORT_BATCHING", "0").lower() in ("1", "true", "yes"),
+            report_group_overlap=float(os.getenv("DEALLENS_REPORT_GROUP_OVERLAP", "0.5")),
+            report_group_max=int(os.getenv("DEALLENS_REPORT_GROUP_MAX", "4")),
+            # chroma | memmap (vectorindex.py)
+            vector_backend=os.getenv("DEALLENS_VECTOR_BACKEND", "chroma"),
+            memmap_dir=_path("DEALLENS_MEMMAP_DIR", "vector_index"),
+            hnsw_threshold=int(os.getenv("DEALLENS_HNSW_THRESHOLD", "20000")),
+            # memmap search matrix: truncate to N dims (0 = full) and float32 | float16 | int8
+            vector_dim=int(os.getenv("DEALLENS_VECTOR_DIM", "0")),
+            vector_dtype=os.getenv("DEALLENS_VECTOR_DTYPE", "float32"),
+            vector_rescore=os.getenv("DEALLENS_VECTOR_RESCORE", "1").lower() in ("1", "true", "yes"),
+            rescore_factor=int(os.getenv("DEALLENS_RESCORE_FACTOR", "4")),
+            # rag(): one scored search over k * overfetch candidates; per modality keep
+            # hits within `margin` of its best score (and above min_score, if set)
+            retrieval_overfetch=int(os.getenv("DEALLENS_RETRIEVAL_OVERFETCH", "3")),
+            retrieval_margin=float(os.getenv("DEALLENS_RETRIEVAL_MARGIN", "0.2")),
+            retrieval_min_score=float(os.environ["DEALLENS_RETRIEVAL_MIN_SCORE"])
+            if os.getenv("DEALLENS_RETRIEVAL_MIN_SCORE") else None,
+            # image summaries are searched separately with their own k
+            retrieval_image_k=int(os.getenv("DEALLENS_RETRIEVAL_IMAGE_K", "2")),
+            # chat sessions (sessions.py): older turns are summarized past this many tokens
+            sessions_path=_path("DEALLENS_SESSIONS_DB", os.path.join("state", "sessions.sqlite3")),
+            chat_history_tokens=int(os.getenv("DEALLENS_CHAT_HISTORY_TOKENS", "1500")),
+            chat_keep_turns=int(os.getenv("DEALLENS_CHAT_KEEP_TURNS", "4")),
+            chat_context_chunks=int(os.getenv("DEALLENS_CHAT_CONTEXT_CHUNKS", "20")),
+            # auto: hi_res only for pages that need layout / tables (pages.py); hi_res: every page
+            partition_mode=os.getenv("DEALLENS_PARTITION_MODE", "auto"),
+            page_min_chars=int(os.getenv("DEALLENS_PAGE_MIN_CHARS", "200")),
+            # raw partition elements per page (partitioncache.py), so re-ingesting or
+            # re-chunking skips layout detection
+            partition_cache=os.getenv("DEALLENS_PARTITION_CACHE", "1").lower() in ("1", "true", "yes"),
+            partition_cache_dir=_path("DEALLENS_PARTITION_CACHE_DIR", "partition_cache"),
+            # bounded-memory ingestion (vectorStoring.storing_windowed): pages per window
+            # (0 = whole document) and an RSS ceiling that shrinks the windows (0 = none)
+            ingest_window_pages=int(os.getenv("DEALLENS_INGEST_WINDOW_PAGES", "0")),
+            ingest_memory_mb=int(os.getenv("DEALLENS_INGEST_MEMORY_MB", "0")),
+            spool_dir=_path("DEALLENS_SPOOL_DIR", os.path.join("state", "spool")),
+            # garbage collection (cleanup.py): delete documents unused for N days, failed or
+            # never-ingested ones after N days (0 = keep), and run every N hours in the app (0 = off)
+            retention_days=float(os.getenv("DEALLENS_RETENTION_DAYS", "0")),
+            retention_failed_days=float(os.getenv("DEALLENS_RETENTION_FAILED_DAYS", "0")),
+            gc_interval_hours=float(os.getenv("DEALLENS_GC_INTERVAL_HOURS", "0")),
+            # also remove uploads / reports / vectors of no registered document (opt-in)
+            gc_sweep_orphans=os.getenv("DEALLENS_GC_SWEEP_ORPHANS", "0").lower() in ("1", "true", "yes"),
+            # portfolio chat (portfolio.py): concurrent per-document searches, seconds a
+            # document may take before it is left out (0 = wait), and the merged context size
+            portfolio_workers=int(os.getenv("DEALLENS_PORTFOLIO_WORKERS", "8")),
+            portfolio_timeout=float(os.getenv("DEALLENS_PORTFOLIO_TIMEOUT", "5")),
+            portfolio_context_tokens=int(os.getenv("DEALLENS_PORTFOLIO_CONTEXT_TOKENS", "6000")),
+            # report fields as typed columns for cross-deal screening (screening.py)
+            screening_path=_path("DEALLENS_SCREENING_DB", os.path.join("state", "screening.sqlite3")),
+            # tables longer than N rows are embedded as N-row slices with the header repeated
+            # (rowslices.py, 0 = off), their rows kept per document under table_dir
+            table_slice_rows=int(os.getenv("DEALLENS_TABLE_SLICE_ROWS", "40")),
+            table_dir=_path("DEALLENS_TABLE_DIR", os.path.join("state", "tables")),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    return Settings.from_env()
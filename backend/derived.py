@@ -0,0 +1,256 @@
+"""
+Derived deal metrics computed from table facts, without an LLM.
+
+Price per unit / SF, gross potential rent, occupancy, the unit mix and the
+cap rate check are arithmetic on figures the tables already give
+(`tables.table_facts`: line items plus the columnar rent roll). `derive`
+computes them for a whole batch of deals at once: every scalar is one
+numpy array over the deals, and the rent rolls of all deals are
+concatenated with a deal index so per-deal and per-unit-type sums are
+single `bincount`s. One deal is a batch of one.
+
+- gross potential rent: stated figure, else rent roll (monthly rent x units x 12)
+- occupancy: occupied share of the rent roll's units with a known status,
+  else 100% less the vacancy percentage
+
+Rent roll totals (units, SF, GPR, occupancy, the unit mix) are only used
+when the roll is complete: its unit count matches the stated unit count or
+the roll's own total row. A memorandum often shows only an excerpt of the
+roll, and its few rows are not the property; those fields are then left to
+the LLM.
+- price per unit / SF, NOI per unit, expense ratio (opex / EGI, else GPR)
+- cap rate check: NOI / price against the stated cap rate, within
+  `CAP_RATE_TOLERANCE` percentage points
+- unit mix: units, share, average SF, rent and rent per SF per bedroom count
+
+`modeling_prefill` shapes the results like the `modeling_data` section, so
+`tables.prefill` fills those fields exactly and the LLM is not asked for
+them. Figures the memorandum states itself keep precedence.
+
+Usage (from `backend/`), recomputing every registered deal:
+
+    python derived.py [--file-id ID ...]
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+# stated vs NOI / price, in percentage points
+CAP_RATE_TOLERANCE = 0.25
+ROLL_COLUMNS = ("bedrooms", "units", "sf", "rent", "occupied")
+
+
+def _fact(facts, name):
+    entry = facts.get(name)
+    value = entry.get("value") if isinstance(entry, dict) else None
+    return np.nan if value is None else float(value)
+
+
+def _scalars(facts_list, name):
+    return np.array([_fact(facts, name) for facts in facts_list], dtype=float)
+
+
+def _float(values):
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+
+def _roll_totals(facts_list):
+    """Unit count stated on each deal's rent roll total row (nan if none)."""
+    return _float([(facts.get("rent_roll") or {}).get("total_units") for facts in facts_list])
+
+
+def _rolls(facts_list):
+    """Concatenated rent rolls: `{column: array}` plus the "deal" index of every row."""
+    columns = {name: [] for name in ROLL_COLUMNS}
+    deal = []
+    for i, facts in enumerate(facts_list):
+        roll = facts.get("rent_roll") or {}
+        rows = len(roll.get("rent") or [])
+        deal.append(np.full(rows, i, dtype=np.int64))
+        for name in ROLL_COLUMNS:
+            columns[name].append(_float((roll.get(name) or [None] * rows)[:rows]))
+    out = {name: np.concatenate(parts) if parts else np.empty(0) for name, parts in columns.items()}
+    out["deal"] = np.concatenate(deal) if deal else np.empty(0, dtype=np.int64)
+    return out
+
+
+def _per_deal(deal, weights, n):
+    return np.bincount(deal, weights=weights, minlength=n)
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = numerator / denominator
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+# -------------------------------
+# Engine
+# -------------------------------
+def unit_mix(roll, n):
+    """Per deal, a list of unit-type rows (bedrooms ascending)."""
+    has_type = ~np.isnan(roll["bedrooms"])
+    units = np.where(np.isnan(roll["units"]), 0.0, roll["units"])[has_type]
+    deal, bedrooms = roll["deal"][has_type], roll["bedrooms"][has_type].astype(np.int64)
+    sf, rent = roll["sf"][has_type], roll["rent"][has_type]
+    if not len(deal):
+        return [[] for _ in range(n)]
+
+    keys, group = np.unique(np.stack([deal, bedrooms], axis=1), axis=0, return_inverse=True)
+    group = group.ravel()
+    g = len(keys)
+    count = np.bincount(group, weights=units, minlength=g)
+    known_sf = ~np.isnan(sf)
+    known_rent = ~np.isnan(rent)
+    avg_sf = _ratio(
+        np.bincount(group, weights=np.where(known_sf, sf * units, 0), minlength=g),
+        np.bincount(group, weights=units * known_sf, minlength=g),
+    )
+    avg_rent = _ratio(
+        np.bincount(group, weights=np.where(known_rent, rent * units, 0), minlength=g),
+        np.bincount(group, weights=units * known_rent, minlength=g),
+    )
+    deal_units = _per_deal(keys[:, 0], count, n)
+    share = _ratio(count, deal_units[keys[:, 0]]) * 100
+    rent_per_sf = _ratio(avg_rent, avg_sf)
+
+    out = [[] for _ in range(n)]
+    for row in range(g):
+        out[keys[row, 0]].append({
+            "bedrooms": int(keys[row, 1]),
+            "number_of_units": _value(count[row], 0),
+            "percentage_of_units": _value(share[row], 1),
+            "average_unit_square_feet": _value(avg_sf[row], 0),
+            "average_monthly_rent": _value(avg_rent[row], 2),
+            "average_rent_per_sf": _value(rent_per_sf[row], 2),
+        })
+    return out
+
+
+def derive(facts_list, tolerance=CAP_RATE_TOLERANCE):
+    """Derived metrics for each deal's table facts (same order); None where inputs are missing."""
+    facts_list = [facts or {} for facts in facts_list]
+    n = len(facts_list)
+    roll = _rolls(facts_list)
+    deal = roll["deal"]
+
+    # Rent roll totals per deal
+    units_known = np.where(np.isnan(roll["units"]), 0.0, roll["units"])
+    roll_units = _per_deal(deal, units_known, n)
+    roll_sf = _per_deal(deal, np.where(np.isnan(roll["sf"]), 0.0, roll["sf"] * units_known), n)
+    roll_rent = _per_deal(deal, np.where(np.isnan(roll["rent"]), 0.0, roll["rent"] * units_known), n)
+    status_known = ~np.isnan(roll["occupied"])
+    occupied = _per_deal(deal, np.where(status_known, roll["occupied"] * units_known, 0.0), n)
+    with_status = _per_deal(deal, units_known * status_known, n)
+    stated_units = _scalars(facts_list, "units")
+    # complete: the roll accounts for every unit the memorandum or the roll's total row states
+    complete = (roll_units > 0) & (
+        (np.abs(roll_units - stated_units) < 0.5) | (np.abs(roll_units - _roll_totals(facts_list)) < 0.5)
+    )
+
+    # Stated figures, rent roll where the tables do not state them and the roll is complete
+    price = _scalars(facts_list, "asking_price")
+    noi = _scalars(facts_list, "net_operating_income")
+    units = np.where(np.isnan(stated_units) & complete, roll_units, stated_units)
+    sf = _scalars(facts_list, "total_square_feet")
+    sf = np.where(np.isnan(sf) & (roll_sf > 0) & complete, roll_sf, sf)
+    roll_gpr = np.where(roll_rent > 0, roll_rent * 12, np.nan)
+    stated_gpr = _scalars(facts_list, "gross_potential_rent")
+    gpr = np.where(np.isnan(stated_gpr) & complete, roll_gpr, stated_gpr)
+    expenses = np.abs(_scalars(facts_list, "total_expenses"))
+    egi = _scalars(facts_list, "effective_gross_income")
+    vacancy = _scalars(facts_list, "vacancy_percentage")
+    stated_cap = _scalars(facts_list, "cap_rate")
+
+    occupancy = np.where(complete & (with_status > 0), _ratio(occupied, with_status) * 100, 100 - vacancy)
+    implied_cap = _ratio(noi, price) * 100
+    cap_gap = stated_cap - implied_cap
+    metrics = {
+        "units": units,
+        "total_square_feet": sf,
+        "gross_potential_rent": gpr,
+        "monthly_gross_potential_rent": gpr / 12,
+        "rent_roll_gross_potential_rent": roll_gpr,
+        "rent_roll_units": np.where(roll_units > 0, roll_units, np.nan),
+        "occupancy": occupancy,
+        "price_per_unit": _ratio(price, units),
+        "price_per_sf": _ratio(price, sf),
+        "noi_per_unit": _ratio(noi, units),
+        "expense_ratio": _ratio(expenses, np.where(np.isnan(egi), gpr, egi)) * 100,
+        "implied_cap_rate": implied_cap,
+        "cap_rate_gap": cap_gap,
+    }
+    consistent = np.abs(cap_gap) <= tolerance
+    mix = unit_mix(roll, n)
+
+    out = []
+    for i in range(n):
+        row = {name: _value(values[i], 4) for name, values in metrics.items()}
+        row["cap_rate_consistent"] = None if np.isnan(cap_gap[i]) else bool(consistent[i])
+        row["rent_roll_complete"] = bool(complete[i])
+        row["unit_mix"] = mix[i]
+        out.append(row)
+    return out
+
+
+def _value(x, digits):
+    if x is None or np.isnan(x):
+        return None
+    x = round(float(x), digits)
+    return int(x) if digits == 0 else x
+
+
+# -------------------------------
+# Report fields
+# -------------------------------
+def modeling_prefill(metrics):
+    """`modeling_data` fields (schema.json shape) from one deal's `derive` result."""
+    out = {}
+
+    def put(path, value):
+        if value is None:
+            return
+        target = out
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = value
+
+    put(("gross_potential_rent", "actual"), metrics["gross_potential_rent"])
+    if metrics["price_per_unit"] is not None:
+        put(("price_per_unit",), f"${metrics['price_per_unit']:,.0f}")
+    if metrics["price_per_sf"] is not None:
+        put(("price_per_sf",), f"${metrics['price_per_sf']:,.2f}")
+    if metrics["units"] is not None:
+        put(("rent_roll_mix", "total_units"), int(metrics["units"]))
+    if metrics["total_square_feet"] is not None:
+        put(("rent_roll_mix", "total_square_feet"), int(metrics["total_square_feet"]))
+    put(("rent_roll_mix", "annual_gross_potential_rent"), metrics["gross_potential_rent"])
+    if metrics["monthly_gross_potential_rent"] is not None:
+        put(("rent_roll_mix", "monthly_gross_potential_rent"), round(metrics["monthly_gross_potential_rent"], 2))
+    if metrics["unit_mix"] and metrics["rent_roll_complete"]:
+        put(("rent_roll_mix", "unit_types"), [
+            {**row, "percentage_of_units": None if row["percentage_of_units"] is None
+             else f"{row['percentage_of_units']:g}%"}
+            for row in metrics["unit_mix"]
+        ])
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file-id", nargs="*", help="only these documents (default: all)")
+    args = parser.parse_args(argv)
+
+    from stores import get_registry
+
+    registry = get_registry()
+    file_ids = args.file_id or [doc["file_id"] for doc in registry.all()]
+    for file_id, metrics in zip(file_ids, derive([registry.facts(file_id) for file_id in file_ids])):
+        print(json.dumps({"fileId": file_id, **metrics}))
+
+
+if __name__ == "__main__":
+    main()
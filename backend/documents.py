@@ -0,0 +1,179 @@
+"""
+SQLite registry of ingested documents and their ingestion progress.
+
+One row per uploaded file (`file_id` is the key returned by the upload
+APIs). Batch jobs group rows by `job_id`. Like the chunk store it lives in
+the shared state directory, so any worker can answer a progress request.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# column -> SQL type; new columns are added to existing databases on open
+COLUMNS = {
+    "file_id": "TEXT PRIMARY KEY",
+    "job_id": "TEXT",
+    "filename": "TEXT",
+    "path": "TEXT",
+    "status": "TEXT",
+    "stage": "TEXT",
+    "chunks": "INTEGER",
+    "images": "INTEGER",
+    "entries": "INTEGER",
+    "error": "TEXT",
+    "created_at": "REAL",
+    "updated_at": "REAL",
+    "started_at": "REAL",
+    "finished_at": "REAL",
+    "facts": "TEXT",  # JSON, see tables.table_facts
+    "strategy": "TEXT",  # ingestion strategy the vectors were built with
+    "revision": "INTEGER",  # revised versions applied (revisions.py)
+    "delta": "TEXT",  # JSON outcome of the last revision
+    "revised_at": "REAL",
+    "legacy": "INTEGER",  # 1: registered by `backfill` from files that predate the registry
+    "accessed_at": "REAL",  # last report read, for retention (cleanup.py)
+}
+
+# Ingestion statuses, in order
+QUEUED, PARTITIONING, SUMMARIZING, STORING, DONE, FAILED = (
+    "queued", "partitioning", "summarizing", "storing", "done", "failed",
+)
+UPLOADED = "uploaded"
+
+# report reads record `accessed_at` at most this often (seconds)
+TOUCH_INTERVAL = 60
+
+# uploads are "<file_id>_<filename>", reports "<file_id>_report.json[...]"
+FILE_ID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class DocumentRegistry:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                + ", ".join(f"{name} {typ}" for name, typ in COLUMNS.items())
+                + ")"
+            )
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+            for name, typ in COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE documents ADD COLUMN {name} {typ}")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_job ON documents (job_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, file_id, filename, path, status=UPLOADED, job_id=None, **fields):
+        now = time.time()
+        row = {
+            "file_id": file_id,
+            "job_id": job_id,
+            "filename": filename,
+            "path": path,
+            "status": status,
+            "created_at": now,
+            "updated_at": now,
+            **fields,
+        }
+        names = ", ".join(row)
+        with self._conn() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO documents ({names}) VALUES ({', '.join('?' * len(row))})",
+                list(row.values()),
+            )
+
+    def update(self, file_id, **fields):
+        fields["updated_at"] = time.time()
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown document fields: {sorted(unknown)}")
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn() as conn:
+            conn.execute(
+                f"UPDATE documents SET {assignments} WHERE file_id = ?", [*fields.values(), file_id]
+            )
+
+    def touch(self, file_id, now=None):
+        """Record a read of `file_id`'s report without changing `updated_at`."""
+        now = now or time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE documents SET accessed_at = ? WHERE file_id = ? AND (accessed_at IS NULL OR accessed_at < ?)",
+                (now, file_id, now - TOUCH_INTERVAL),
+            )
+
+    def get(self, file_id):
+        row = self._conn().execute("SELECT * FROM documents WHERE file_id = ?", (file_id,)).fetchone()
+        return dict(row) if row else None
+
+    def job(self, job_id):
+        rows = self._conn().execute(
+            "SELECT * FROM documents WHERE job_id = ? ORDER BY created_at, filename", (job_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def delete(self, file_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM documents WHERE file_id = ?", (file_id,))
+
+    def all(self):
+        return [dict(row) for row in self._conn().execute("SELECT * FROM documents ORDER BY created_at")]
+
+    def backfill(self, upload_dir, report_dir):
+        """Register the uploads and reports written before the registry existed (once).
+
+        Rows are marked `legacy`: status "done" when there is a report, else
+        "uploaded". Returns how many rows were added.
+        """
+        with self._conn() as conn:
+            if conn.execute("SELECT 1 FROM registry_meta WHERE key = 'backfilled'").fetchone():
+                return 0
+            found = {}
+            for directory, is_report in ((upload_dir, False), (report_dir, True)):
+                if not os.path.isdir(directory):
+                    continue
+                for name in sorted(os.listdir(directory)):
+                    match = FILE_ID.match(name)
+                    if not match:
+                        continue
+                    doc = found.setdefault(match.group(0), {"filename": None, "path": None, "report": False})
+                    if is_report:
+                        doc["report"] = True
+                    elif name[len(match.group(0)):].startswith("_"):
+                        doc["filename"] = name[len(match.group(0)) + 1:]
+                        doc["path"] = os.path.join(upload_dir, name)
+            now = time.time()
+            added = 0
+            for file_id, doc in found.items():
+                added += conn.execute(
+                    "INSERT OR IGNORE INTO documents (file_id, filename, path, status, created_at, updated_at, legacy)"
+                    " VALUES (?, ?, ?, ?, ?, ?, 1)",
+                    (file_id, doc["filename"], doc["path"], DONE if doc["report"] else UPLOADED, now, now),
+                ).rowcount
+            conn.execute("INSERT OR REPLACE INTO registry_meta (key, value) VALUES ('backfilled', ?)", (str(now),))
+        if added:
+            print(f"Registered {added} documents that predate the registry")
+        return added
+
+    def facts(self, file_id):
+        """Table facts recorded for `file_id` at ingest ({} if none)."""
+        row = self._conn().execute("SELECT facts FROM documents WHERE file_id = ?", (file_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def set_facts(self, file_id, facts):
+        self.update(file_id, facts=json.dumps(facts))
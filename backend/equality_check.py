@@ -1,165 +1,274 @@
-# validate_mapping.py
-import os
-import pickle
+"""
+Consistency check between the vector store and the chunk store.
+
+Every vector carries the `doc_id` of the chunk it stands for; every chunk
+store entry should have at least one vector. The check pages through the
+vector store `--batch-size` rows at a time, writes `(vector id, doc_id)`
+pairs to a temporary SQLite index and computes the differences there
+against the chunk store (attached read-only), so neither side is ever held
+in memory. It reports:
+
+- orphans:    vectors whose doc_id has no chunk (or no doc_id at all)
+- missing:    chunks no vector points to (never retrievable)
+- duplicates: doc_ids with more than one vector
+
+With `--repair`, in batches and under the vectorstore write lock:
+
+- missing chunks are embedded again (text as is, images by their summary)
+  into the document and type recorded with them in the chunk store;
+  chunks stored without that record (before it existed) are reported as
+  unrepairable, since a vector without its `file_id` is never retrieved
+- orphans are deleted, or with `--orphans restore` their chunk is written
+  back from the vector's `original_content` metadata
+
+Usage (from `backend/`):
+
+    python equality_check.py
+    python equality_check.py --repair --orphans restore --batch-size 1000
+"""
+
+import argparse
 import base64
-from typing import Set, List, Dict, Any
+import binascii
+import os
+import sqlite3
+import tempfile
+from urllib.parse import quote
 
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import storage
+from config import get_settings
 
-PICKLE_PATH = "summary_to_chunk.pkl"
-CHROMA_DIR = "./chroma_db"
-COLLECTION_NAME = "multi_modal_rag"
-EMBED_MODEL = "models/gemini-embedding-001"
+SAMPLE = 10
 
+_ORPHANS = """
+SELECT vector_id, doc_id FROM vectors v
+WHERE doc_id IS NULL OR NOT EXISTS (SELECT 1 FROM store.chunks c WHERE c.doc_id = v.doc_id)
+"""
+_MISSING = """
+SELECT doc_id FROM store.chunks c
+WHERE NOT EXISTS (SELECT 1 FROM vectors v WHERE v.doc_id = c.doc_id)
+"""
+_DUPLICATES = """
+SELECT doc_id, COUNT(*) FROM vectors WHERE doc_id IS NOT NULL GROUP BY doc_id HAVING COUNT(*) > 1
+"""
 
-def safe_load_pickle(path: str) -> Dict[str, Any]:
-    if not os.path.exists(path):
-        print(f"[info] pickle not found at {path}. Returning empty mapping.")
-        return {}
-    with open(path, "rb") as f:
-        return pickle.load(f)
+# PNG, JPEG and GIF signatures of a decoded chunk value
+_IMAGE_MAGIC = (b"\x89PNG", b"\xff\xd8\xff", b"GIF8")
 
 
-def try_collect_chroma_ids(collection) -> (List[str], List[dict]):
-    """
-    Attempts to call the underlying Chroma collection .get() and return ids + metadatas.
-    Returns (ids_list, metadatas_list). If not available, returns ([], []).
-    """
-    try:
-        collection_data = collection.get()
-        ids = collection_data.get("ids", []) or []
-        metadatas = collection_data.get("metadatas", []) or []
-        return ids, metadatas
-    except Exception as e:
-        print("[warning] Failed to call collection.get():", e)
-        return [], []
-
-
-def extract_doc_ids_from_metadatas(metadatas: List[dict]) -> Set[str]:
-    ids = set()
-    for md in metadatas:
-        if not isinstance(md, dict):
-            continue
-        # common places to keep user doc id:
-        #  - metadata['doc_id']
-        #  - metadata.get('id') or metadata.get('source')
-        for key in ("doc_id", "id", "source"):
-            if key in md and isinstance(md[key], str):
-                ids.add(md[key])
-        # Also, if the metadata itself contains values that look like UUIDs,
-        # collect them conservatively
-        # (rare; used only as fallback)
-        for v in md.values():
-            if isinstance(v, str) and len(v) >= 8 and "-" in v:
-                ids.add(v)
-    return ids
-
-
-def is_base64_string(s: str) -> bool:
-    if not isinstance(s, str):
+def _batches(cursor, size):
+    while True:
+        rows = cursor.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def _content(value):
+    """Chunk store value as text (older stores kept unstructured elements)."""
+    if isinstance(value, str):
+        return value
+    return getattr(value, "page_content", None) or getattr(value, "text", None) or str(value)
+
+
+def is_image(content):
+    """True for base64 text that decodes to a PNG/JPEG/GIF."""
+    if not isinstance(content, str) or len(content) < 16:
         return False
     try:
-        # validate=True ensures non-base64 chars raise binascii.Error
-        base64.b64decode(s, validate=True)
-        return True
-    except Exception:
+        head = base64.b64decode(content[:16], validate=True)
+    except (binascii.Error, ValueError):
         return False
+    return head.startswith(_IMAGE_MAGIC)
 
 
-def print_summary_preview(mapping: Dict[str, Any], limit: int = 50):
-    print("\nPreview of chunks in summary_to_chunk.pkl:\n")
-    for i, (doc_id, chunk) in enumerate(mapping.items()):
-        if i >= limit:
-            break
-        if isinstance(chunk, str):
-            if is_base64_string(chunk):
-                print(f"{doc_id}: IMAGE chunk, base64 length={len(chunk)}")
-            else:
-                # plain string (text)
-                print(f"{doc_id}: TEXT chunk (str), length={len(chunk)}")
-        else:
-            # objects like CompositeElement
-            typ = type(chunk)
-            # attempt to read page_content if present
-            page_content = getattr(chunk, "page_content", None)
-            if isinstance(page_content, str):
-                print(f"{doc_id}: TEXT chunk (CompositeElement), page_content length={len(page_content)}")
-            else:
-                print(f"{doc_id}: UNKNOWN chunk type, stored as {typ}")
-
-
-def main():
-    # 1. load pickle
-    summary_to_chunk = safe_load_pickle(PICKLE_PATH)
-    print(f"Number of entries in {PICKLE_PATH}: {len(summary_to_chunk)}\n")
-
-    # 2. load chroma (collection)
-    try:
-        vectorstore = Chroma(
-            persist_directory=CHROMA_DIR,
-            collection_name=COLLECTION_NAME,
-            embedding_function=GoogleGenerativeAIEmbeddings(model=EMBED_MODEL),
-        )
-    except Exception as e:
-        print("[error] failed to initialize Chroma vectorstore:", e)
-        return
-
-    # 3. attempt to read underlying collection ids and metadatas
-    try:
-        collection = vectorstore._collection  # direct handle to chroma collection
-    except Exception:
-        collection = None
-
-    chroma_ids = []
-    chroma_metadatas = []
-    if collection is not None:
-        chroma_ids, chroma_metadatas = try_collect_chroma_ids(collection)
-
-    print(f"Number of doc_ids in vectorstore (collection.ids): {len(chroma_ids)}")
-    # print small sample
-    if len(chroma_ids) > 0:
-        print("sample collection ids:", chroma_ids[:10])
-
-    # 4. extract user doc_ids from metadatas (if you stored 'doc_id' in metadata)
-    metadata_doc_ids = extract_doc_ids_from_metadatas(chroma_metadatas)
-    print(f"Number of metadata-doc_ids found in collection metadatas: {len(metadata_doc_ids)}")
-    if len(list(metadata_doc_ids)) > 0:
-        print("sample metadata doc_ids:", list(metadata_doc_ids)[:10])
-
-    # 5. Build sets for comparison
-    pkl_ids = set(summary_to_chunk.keys())
-    chroma_ids_set = set(chroma_ids)
-    chroma_meta_ids_set = set(metadata_doc_ids)
-
-    # Primary comparison strategy:
-    # - If you stored doc_id in metadata, compare metadata_doc_ids vs pickle keys (most reliable)
-    # - Otherwise compare internal collection ids vs pickle keys (less common)
-    if chroma_meta_ids_set:
-        missing_in_pkl = chroma_meta_ids_set - pkl_ids
-        missing_in_chroma_meta = pkl_ids - chroma_meta_ids_set
-        print("\nUsing metadata doc_ids for comparison (preferred):")
-        print(f"Doc IDs present in collection metadatas but missing in pickle ({len(missing_in_pkl)}): {missing_in_pkl}")
-        print(f"Doc IDs present in pickle but missing in collection metadatas ({len(missing_in_chroma_meta)}): {missing_in_chroma_meta}")
-    else:
-        missing_in_pkl = chroma_ids_set - pkl_ids
-        missing_in_chroma = pkl_ids - chroma_ids_set
-        print("\nNo doc_id found in metadatas. Falling back to collection internal ids for comparison:")
-        print(f"Doc IDs present in vectorstore.internal_ids but missing in pickle ({len(missing_in_pkl)}): {missing_in_pkl}")
-        print(f"Doc IDs present in pickle but missing in vectorstore.internal_ids ({len(missing_in_chroma)}): {missing_in_chroma}")
-
-    # 6. Preview mapping content (type detection)
-    print_summary_preview(summary_to_chunk)
-
-    # 7. Extra diagnostics: print full metadata list length
-    if chroma_metadatas:
-        print("\n[diagnostic] Example metadata entries (first 5):")
-        for md in chroma_metadatas[:5]:
-            print(md)
-
-    print("\nDone.")
+# -------------------------------
+# Scan
+# -------------------------------
+def _pages(vectorstore, batch_size):
+    """(ids, metadatas) of the vector store, `batch_size` rows at a time."""
+    offset = 0
+    while True:
+        page = vectorstore.get(limit=batch_size, offset=offset, include=["metadatas"])
+        ids = page.get("ids") or []
+        if not ids:
+            return
+        yield ids, page.get("metadatas") or [{}] * len(ids)
+        offset += len(ids)
+
+
+def open_index(path, chunk_store_path):
+    """Scratch database for the vector side, with the chunk store attached as `store`."""
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}", uri=True)
+    conn.execute("CREATE TABLE vectors (vector_id TEXT PRIMARY KEY, doc_id TEXT)")
+    conn.execute("ATTACH DATABASE ? AS store", (f"file:{quote(os.path.abspath(chunk_store_path))}?mode=ro",))
+    return conn
+
+
+def scan(vectorstore, conn, batch_size=500):
+    """Copy every vector's `(id, doc_id)` into the index; returns the vector count."""
+    total = 0
+    for ids, metadatas in _pages(vectorstore, batch_size):
+        rows = [(vector_id, (metadata or {}).get("doc_id")) for vector_id, metadata in zip(ids, metadatas)]
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO vectors (vector_id, doc_id) VALUES (?, ?)", rows)
+        total += len(rows)
+    conn.execute("CREATE INDEX vectors_doc_id ON vectors (doc_id)")
+    return total
+
+
+def check(conn):
+    """Counts and sample ids of each kind of inconsistency."""
+
+    def _count(query):
+        return conn.execute(f"SELECT COUNT(*) FROM ({query})").fetchone()[0]
+
+    return {
+        "vectors": conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0],
+        "chunks": conn.execute("SELECT COUNT(*) FROM store.chunks").fetchone()[0],
+        "orphans": _count(_ORPHANS),
+        "missing": _count(_MISSING),
+        "duplicates": _count(_DUPLICATES),
+        "sample": {
+            "orphans": [row[0] for row in conn.execute(f"{_ORPHANS} LIMIT {SAMPLE}")],
+            "missing": [row[0] for row in conn.execute(f"{_MISSING} LIMIT {SAMPLE}")],
+            "duplicates": [row[0] for row in conn.execute(f"{_DUPLICATES} LIMIT {SAMPLE}")],
+        },
+    }
+
+
+# -------------------------------
+# Repair
+# -------------------------------
+def embed_missing(conn, vectorstore, chunk_store, batch_size=500, provider=None):
+    """Add a vector for every chunk that has none and a recorded `file_id`.
+
+    Returns `(added, unrepairable doc_ids)`.
+    """
+    from langchain_core.documents import Document
+
+    from revisions import fingerprint
+    from stores import add_embedded, embed_documents, vectorstore_write_lock
+    from summaries import summariesImages
+
+    provider = provider or get_settings().llm_provider
+    added = 0
+    unrepairable = []
+    for rows in _batches(conn.execute(_MISSING), batch_size):
+        doc_ids = [doc_id for (doc_id,) in rows]
+        contents = [_content(value) for value in chunk_store.mget(doc_ids)]
+        tags = chunk_store.tags(doc_ids)
+        docs = []
+        images = []
+        for doc_id, content in zip(doc_ids, contents):
+            if content is None:
+                continue
+            file_id, kind = tags.get(doc_id, (None, None))
+            if not file_id:
+                unrepairable.append(doc_id)
+                continue
+            if kind == "image" or (kind is None and is_image(content)):
+                images.append((doc_id, file_id, content))
+                continue
+            metadata = {
+                "doc_id": doc_id, "type": kind or "text", "file_id": file_id, "original_content": content,
+                "fingerprint": fingerprint(content), "representation": "raw",
+            }
+            docs.append(Document(page_content=content, metadata=metadata))
+        summaries = summariesImages([content for _, _, content in images], provider=provider) if images else []
+        for (doc_id, file_id, content), summary in zip(images, summaries):
+            metadata = {
+                "doc_id": doc_id, "type": "image", "file_id": file_id, "original_content": content,
+                "fingerprint": fingerprint(content), "representation": "summary",
+            }
+            docs.append(Document(page_content=getattr(summary, "content", None) or str(summary), metadata=metadata))
+        if not docs:
+            continue
+        embeddings = embed_documents(vectorstore, docs)
+        with vectorstore_write_lock():
+            add_embedded(vectorstore, docs, embeddings)
+        storage.bump("vectorstore")
+        added += len(docs)
+        print(f"[repair] embedded {added} missing chunks")
+    if unrepairable:
+        print(f"[repair] {len(unrepairable)} missing chunks have no recorded document and were not "
+              f"embedded (e.g. {unrepairable[:SAMPLE]})")
+    return added, unrepairable
+
+
+def fix_orphans(conn, vectorstore, chunk_store, batch_size=500, restore=False):
+    """Delete orphan vectors, or write their chunk back with `restore`.
+
+    Returns `(deleted, restored)`. An orphan without a doc_id or an
+    `original_content` cannot be restored and is deleted either way.
+    """
+    from stores import vectorstore_write_lock
+
+    deleted = restored = 0
+    for rows in _batches(conn.execute(_ORPHANS), batch_size):
+        vector_ids = [vector_id for vector_id, _ in rows]
+        chunks, tags = {}, {}
+        if restore:
+            found = vectorstore.get(ids=vector_ids, include=["metadatas"])
+            for vector_id, metadata in zip(found["ids"], found["metadatas"]):
+                metadata = metadata or {}
+                if metadata.get("doc_id") and metadata.get("original_content"):
+                    chunks[vector_id] = (metadata["doc_id"], metadata["original_content"])
+                    tags[metadata["doc_id"]] = (metadata.get("file_id"), metadata.get("type"))
+        doomed = [vector_id for vector_id in vector_ids if vector_id not in chunks]
+        with vectorstore_write_lock():
+            if chunks:
+                chunk_store.mset(list(chunks.values()), tags=tags)
+            if doomed:
+                vectorstore.delete(ids=doomed)
+        if doomed:
+            storage.bump("vectorstore")
+        deleted += len(doomed)
+        restored += len(chunks)
+        print(f"[repair] orphans: {deleted} deleted, {restored} restored")
+    return deleted, restored
+
+
+# -------------------------------
+# CLI
+# -------------------------------
+def print_report(report):
+    print(f"Vectors: {report['vectors']}  Chunks: {report['chunks']}")
+    for kind, label in (
+        ("orphans", "vectors without a chunk"),
+        ("missing", "chunks without a vector"),
+        ("duplicates", "doc_ids with several vectors"),
+    ):
+        print(f"{label:<30} {report[kind]:>8}")
+        if report["sample"][kind]:
+            print(f"    e.g. {report['sample'][kind]}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per page / repair batch")
+    parser.add_argument("--repair", action="store_true", help="embed missing chunks and fix orphans")
+    parser.add_argument("--orphans", choices=["delete", "restore"], default="delete",
+                        help="what --repair does with orphan vectors")
+    args = parser.parse_args(argv)
+
+    from stores import get_chunk_store, get_vectorstore
+
+    vectorstore = get_vectorstore()
+    chunk_store = get_chunk_store()
+    with tempfile.TemporaryDirectory(prefix="deallens-check-") as workdir:
+        conn = open_index(os.path.join(workdir, "index.sqlite3"), chunk_store.path)
+        try:
+            scan(vectorstore, conn, args.batch_size)
+            report = check(conn)
+            print_report(report)
+            if args.repair and (report["missing"] or report["orphans"]):
+                _, report["unrepairable"] = embed_missing(conn, vectorstore, chunk_store, args.batch_size)
+                fix_orphans(conn, vectorstore, chunk_store, args.batch_size, restore=args.orphans == "restore")
+        finally:
+            conn.close()
+    return report
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,260 @@
+"""
+Bulk ingestion of many PDFs.
+
+Partitioning (unstructured hi_res) is CPU-bound and runs in a process pool;
+summarizing and embedding are network-bound and run in a thread pool. As
+soon as one document is partitioned its summaries start, so the LLM calls
+of one document overlap the partitioning of the next. All LLM calls go
+through `llms.llm_slot`, which caps them process-wide
+(`DEALLENS_MAX_LLM_CALLS`).
+
+Progress is recorded per document in the documents registry
+(`documents.py`), which every worker can read. Revised versions of an
+ingested document go through the same pools and are applied as a delta
+(`submit_revision`, revisions.py). With windowed ingestion enabled
+(`DEALLENS_INGEST_WINDOW_PAGES` / `DEALLENS_INGEST_MEMORY_MB`) each document
+is partitioned and stored a page window at a time in the thread pool.
+"""
+
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import documents
+import metrics
+from config import get_settings
+from stores import get_registry, get_retriever, get_vectorstore
+
+_pools_lock = threading.Lock()
+_pools = {}
+
+
+def _pool(kind):
+    with _pools_lock:
+        if kind not in _pools:
+            settings = get_settings()
+            if kind == "process":
+                # spawn: forking a process that already runs threads is unsafe
+                _pools[kind] = ProcessPoolExecutor(
+                    max_workers=settings.ingest_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                _pools[kind] = ThreadPoolExecutor(
+                    max_workers=settings.ingest_threads, thread_name_prefix="ingest"
+                )
+        return _pools[kind]
+
+
+# -------------------------------
+# Inputs
+# -------------------------------
+def pdfs_in_directory(directory):
+    """PDF paths under `directory`, which must be inside `DEALLENS_INGEST_ROOT`."""
+    root = os.path.realpath(get_settings().ingest_root)
+    directory = os.path.realpath(directory if os.path.isabs(directory) else os.path.join(root, directory))
+    if os.path.commonpath([root, directory]) != root:
+        raise ValueError(f"Directory must be inside {root}")
+    if not os.path.isdir(directory):
+        raise FileNotFoundError(directory)
+
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        paths.extend(os.path.join(dirpath, name) for name in filenames if name.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def new_upload_path(filename):
+    """(file_id, path) for a new upload, named like the single-file upload API."""
+    file_id = str(uuid.uuid4())
+    return file_id, os.path.join(get_settings().upload_dir, f"{file_id}_{os.path.basename(filename)}")
+
+
+def copy_into_uploads(path):
+    file_id, target = new_upload_path(path)
+    shutil.copyfile(path, target)
+    return file_id, target
+
+
+# -------------------------------
+# Pipeline
+# -------------------------------
+def _partition_document(file_id, path):
+    # Runs in a worker process
+    from vectorStoring import chunking
+
+    get_registry().update(file_id, status=documents.PARTITIONING, stage="partitioning", started_at=time.time())
+    start = time.perf_counter()
+    chunks, images = chunking(path)
+    return chunks, images, time.perf_counter() - start
+
+
+def _store_document(file_id, chunks, images, provider, strategy):
+    from vectorStoring import store_chunks
+
+    registry = get_registry()
+    registry.update(file_id, status=documents.SUMMARIZING, stage="summarizing",
+                    chunks=len(chunks), images=len(images))
+    try:
+        with metrics.track("storing", provider=provider):
+            summary_to_chunk, _ = store_chunks(
+                chunks, images, get_retriever(), provider=provider, file_id=file_id, strategy=strategy,
+                progress=lambda stage: registry.update(file_id, status=documents.STORING, stage=stage),
+            )
+    except Exception as e:
+        print(f"Ingestion of {file_id} failed: {e}")
+        registry.update(file_id, status=documents.FAILED, error=str(e), finished_at=time.time())
+        return
+    registry.update(file_id, status=documents.DONE, stage=None, entries=len(summary_to_chunk),
+                    finished_at=time.time())
+
+
+def _revise_document(file_id, chunks, images, provider, strategy, previous_path=None):
+    from revisions import apply_revision, record
+
+    registry = get_registry()
+    registry.update(file_id, status=documents.SUMMARIZING, stage="summarizing",
+                    chunks=len(chunks), images=len(images))
+    try:
+        delta = apply_revision(
+            file_id, chunks, images, get_retriever(), provider=provider, strategy=strategy,
+            progress=lambda stage: registry.update(file_id, status=documents.STORING, stage=stage),
+        )
+    except Exception as e:
+        print(f"Revision of {file_id} failed: {e}")
+        registry.update(file_id, status=documents.FAILED, error=str(e), finished_at=time.time())
+        return
+    record(file_id, delta)
+    registry.update(file_id, status=documents.DONE, stage=None, error=None, finished_at=time.time())
+    doc = registry.get(file_id)
+    if previous_path and doc and os.path.abspath(previous_path) != os.path.abspath(doc["path"]):
+        try:
+            os.unlink(previous_path)
+        except FileNotFoundError:
+            pass
+
+
+def _ingest_windowed(file_id, path, provider, strategy):
+    # Partitions in this thread, one page window at a time (vectorStoring.storing_windowed)
+    from vectorStoring import storing_windowed
+
+    registry = get_registry()
+    registry.update(file_id, status=documents.PARTITIONING, stage="partitioning", started_at=time.time())
+    try:
+        entries, chunks, images = storing_windowed(
+            path, get_retriever(), provider=provider, file_id=file_id, strategy=strategy,
+            progress=lambda stage: registry.update(file_id, status=documents.STORING, stage=stage),
+        )
+    except Exception as e:
+        print(f"Ingestion of {file_id} failed: {e}")
+        registry.update(file_id, status=documents.FAILED, error=str(e), finished_at=time.time())
+        return
+    registry.update(file_id, status=documents.DONE, stage=None, chunks=chunks, images=images,
+                    entries=entries, finished_at=time.time())
+
+
+def _partitioned(file_id, provider, strategy, future, store=_store_document, **store_kwargs):
+    if future.cancelled() or future.exception() is not None:
+        error = "cancelled" if future.cancelled() else str(future.exception())
+        print(f"Partitioning of {file_id} failed: {error}")
+        get_registry().update(file_id, status=documents.FAILED, error=error, finished_at=time.time())
+        return
+    chunks, images, seconds = future.result()
+    # The worker process's own metrics are lost with it; record the stage here
+    metrics.STAGE_SECONDS.observe(seconds, **metrics.current_labels(stage="chunking"))
+    metrics.count("chunks", len(chunks))
+    metrics.count("images", len(images))
+    _pool("thread").submit(store, file_id, chunks, images, provider, strategy, **store_kwargs)
+
+
+def submit(paths, provider=None, job_id=None, strategy=None):
+    """Queue `{file_id: path}` for ingestion; returns the job id immediately.
+
+    `strategy` is one of `vectorStoring.STRATEGIES` (default `DEALLENS_INGEST_STRATEGY`).
+    """
+    provider = provider or get_settings().llm_provider
+    strategy = strategy or get_settings().ingest_strategy
+    job_id = job_id or str(uuid.uuid4())
+    registry = get_registry()
+    for file_id, path in paths.items():
+        registry.add(file_id, os.path.basename(path).split("_", 1)[-1], path,
+                     status=documents.QUEUED, job_id=job_id)
+
+    from vectorStoring import windowed
+
+    if windowed():
+        # Bounded memory: no whole-document chunk lists passed between processes
+        for file_id, path in paths.items():
+            _pool("thread").submit(_ingest_windowed, file_id, path, provider, strategy)
+        print(f"Queued {len(paths)} documents as job {job_id} (windowed)")
+        return job_id
+
+    processes = _pool("process")
+    for file_id, path in paths.items():
+        future = processes.submit(_partition_document, file_id, path)
+        future.add_done_callback(lambda f, file_id=file_id: _partitioned(file_id, provider, strategy, f))
+    print(f"Queued {len(paths)} documents as job {job_id}")
+    return job_id
+
+
+def submit_revision(file_id, path, provider=None, strategy=None):
+    """Queue a revised version (`path`) of an ingested document for delta re-ingestion.
+
+    The document keeps its `file_id`; see revisions.py.
+    """
+    from vectorStoring import STRATEGIES
+
+    provider = provider or get_settings().llm_provider
+    registry = get_registry()
+    doc = registry.get(file_id)
+    previous = (doc or {}).get("strategy")
+    strategy = strategy or (previous if previous in STRATEGIES else None) or get_settings().ingest_strategy
+    registry.update(file_id, path=path, filename=os.path.basename(path).split("_", 1)[-1],
+                    status=documents.QUEUED, stage=None, error=None)
+
+    future = _pool("process").submit(_partition_document, file_id, path)
+    future.add_done_callback(lambda f: _partitioned(
+        file_id, provider, strategy, f, store=_revise_document, previous_path=(doc or {}).get("path"),
+    ))
+    print(f"Queued revision of {file_id}")
+
+
+def _summarize(file_id, provider):
+    from vectorStoring import summarize_raw
+
+    registry = get_registry()
+    registry.update(file_id, stage="summarizing")
+    try:
+        summarize_raw(file_id, get_vectorstore(), provider=provider)
+    except Exception as e:
+        print(f"Summarizing {file_id} failed: {e}")
+        registry.update(file_id, stage=None, error=str(e))
+        return
+    registry.update(file_id, stage=None)
+
+
+def summarize_later(file_id, provider=None):
+    """Queue summaries for a document ingested with a raw / partial strategy."""
+    _pool("thread").submit(_summarize, file_id, provider or get_settings().llm_provider)
+
+
+def job_status(job_id):
+    docs = get_registry().job(job_id)
+    if not docs:
+        return None
+    counts = {}
+    for doc in docs:
+        counts[doc["status"]] = counts.get(doc["status"], 0) + 1
+    finished = counts.get(documents.DONE, 0) + counts.get(documents.FAILED, 0)
+    return {
+        "jobId": job_id,
+        "total": len(docs),
+        "finished": finished,
+        "done": finished == len(docs),
+        "counts": counts,
+        "documents": docs,
+    }
@@ -0,0 +1,124 @@
+"""
+Chat model and embedding factories, keyed by provider name.
+
+Every pipeline stage asks this module for its models instead of building
+`ChatOpenAI` / `ChatGoogleGenerativeAI` itself, so alternative providers
+(e.g. the deterministic stand-ins used by `benchmarks/`) can be plugged in
+with `register_provider` without touching the pipeline code.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import metrics
+from config import get_settings
+
+# -------------------------------
+# Built-in providers
+# -------------------------------
+def _openai_chat(**kwargs):
+    from langchain_openai import ChatOpenAI
+
+    params = {
+        "model": "gpt-4o-mini",
+        "temperature": 0,
+        "max_retries": 2,
+        "api_key": os.getenv("OPENAI_API_KEY"),
+    }
+    params.update(kwargs)
+    return ChatOpenAI(**params)
+
+
+def _openai_embeddings(**kwargs):
+    from langchain_openai import OpenAIEmbeddings
+
+    params = {"model": "text-embedding-3-large"}
+    params.update(kwargs)
+    return OpenAIEmbeddings(**params)
+
+
+def _gemini_chat(**kwargs):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    params = {
+        "model": "gemini-2.5-flash",
+        "temperature": 0,
+        "max_tokens": None,
+        "timeout": None,
+        "max_retries": 2,
+    }
+    params.update(kwargs)
+    return ChatGoogleGenerativeAI(**params)
+
+
+def _gemini_embeddings(**kwargs):
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    params = {"model": "models/gemini-embedding-001"}
+    params.update(kwargs)
+    return GoogleGenerativeAIEmbeddings(**params)
+
+
+PROVIDERS = {
+    "openai": {"chat": _openai_chat, "embeddings": _openai_embeddings},
+    "gemini": {"chat": _gemini_chat, "embeddings": _gemini_embeddings},
+}
+
+
+def register_provider(name, chat=None, embeddings=None):
+    """Register (or replace) the chat / embedding factories for `name`."""
+    entry = PROVIDERS.setdefault(name, {})
+    if chat is not None:
+        entry["chat"] = chat
+    if embeddings is not None:
+        entry["embeddings"] = embeddings
+
+
+def _factory(provider, kind):
+    try:
+        return PROVIDERS[provider][kind]
+    except KeyError:
+        raise ValueError(f"Unsupported provider for {kind}: {provider}") from None
+
+
+def chat_model(provider="openai", **kwargs):
+    """Build the chat model for `provider`; kwargs override the defaults."""
+    kwargs.setdefault("callbacks", [metrics.LLMCallback(provider)])
+    return _factory(provider, "chat")(**kwargs)
+
+
+def embedding_model(provider="openai", **kwargs):
+    """Build the embedding model for `provider`; kwargs override the defaults."""
+    return metrics.InstrumentedEmbeddings(_factory(provider, "embeddings")(**kwargs), provider)
+
+
+# -------------------------------
+# Global concurrency cap
+# -------------------------------
+@lru_cache(maxsize=None)
+def _llm_semaphore():
+    return threading.BoundedSemaphore(get_settings().max_llm_calls)
+
+
+@contextmanager
+def llm_slot():
+    """Hold one of the `DEALLENS_MAX_LLM_CALLS` process-wide LLM call slots."""
+    semaphore = _llm_semaphore()
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def limited(model):
+    """`model.invoke` as a runnable step that waits for an LLM call slot."""
+    from langchain_core.runnables import RunnableLambda
+
+    def invoke(messages, config):
+        with llm_slot():
+            return model.invoke(messages, config)
+
+    return RunnableLambda(invoke)
@@ -0,0 +1,295 @@
+"""
+In-process pipeline metrics, exposed in Prometheus text format on `/metrics`.
+
+Stages are timed with `track()`:
+
+    with metrics.track("similarity_search", provider="openai"):
+        results = vectorstore.similarity_search(query, k=k)
+
+`track` records a duration histogram and a call counter (with an `ok` /
+`error` status) labeled by stage, provider and section, and makes those
+labels current so LLM calls made inside the block (see `LLMCallback`) are
+attributed to the same stage and section.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self.header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(c), s)) for k, (c, s) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_LABELS = ("stage", "provider", "section")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "deallens_stage_duration_seconds", "Wall time spent in a pipeline stage.", STAGE_LABELS
+)
+STAGE_CALLS = REGISTRY.counter(
+    "deallens_stage_calls_total", "Pipeline stage invocations by outcome.", STAGE_LABELS + ("status",)
+)
+STAGE_ITEMS = REGISTRY.counter(
+    "deallens_stage_items_total", "Items produced or consumed by a stage (chunks, images, texts, ...).",
+    STAGE_LABELS + ("kind",),
+)
+LLM_SECONDS = REGISTRY.histogram(
+    "deallens_llm_call_duration_seconds", "Latency of individual chat model calls.", STAGE_LABELS
+)
+LLM_CALLS = REGISTRY.counter(
+    "deallens_llm_calls_total", "Chat model calls by outcome.", STAGE_LABELS + ("status",)
+)
+LLM_TOKENS = REGISTRY.counter(
+    "deallens_llm_tokens_total", "Chat model tokens by kind (prompt / completion).", STAGE_LABELS + ("kind",)
+)
+IMAGE_BYTES = REGISTRY.counter(
+    "deallens_image_bytes_sent_total", "Decoded image bytes sent to chat models.", STAGE_LABELS
+)
+RETRIES = REGISTRY.counter(
+    "deallens_retries_total", "Application-level retries of model calls.", STAGE_LABELS
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "deallens_cache_requests_total", "Cache lookups by cache and result (hit / miss).", ("cache", "result")
+)
+
+# Labels of the innermost `track()` block, inherited by threads LangChain spawns.
+_current = contextvars.ContextVar("deallens_stage", default={"stage": "", "provider": "", "section": ""})
+
+
+def current_labels(**overrides):
+    labels = dict(_current.get())
+    labels.update({k: v for k, v in overrides.items() if v})
+    return labels
+
+
+@contextmanager
+def track(stage, provider="", section=""):
+    """Time a stage and make its labels current for nested LLM / embedding calls."""
+    parent = _current.get()
+    labels = {
+        "stage": stage,
+        "provider": provider or parent["provider"],
+        "section": section or parent["section"],
+    }
+    token = _current.set(labels)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield labels
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        STAGE_SECONDS.observe(time.perf_counter() - start, **labels)
+        STAGE_CALLS.inc(status=status, **labels)
+
+
+def count(kind, amount=1, **labels):
+    """Add `amount` items of `kind` to the current stage."""
+    STAGE_ITEMS.inc(amount, kind=kind, **current_labels(**labels))
+
+
+def image_bytes(img_b64, **labels):
+    """Account for a base64 image about to be sent to a chat model."""
+    IMAGE_BYTES.inc(len(img_b64) * 3 // 4, **current_labels(**labels))
+
+
+def retry(**labels):
+    RETRIES.inc(**current_labels(**labels))
+
+
+def cache(name, hit):
+    CACHE_REQUESTS.inc(cache=name, result="hit" if hit else "miss")
+
+
+def render():
+    return REGISTRY.render()
+
+
+# -------------------------------
+# LangChain hooks
+# -------------------------------
+def _token_usage(response):
+    """Pull (prompt, completion) token counts out of an LLMResult."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    prompt = usage.get("prompt_tokens")
+    completion = usage.get("completion_tokens")
+    if prompt is None:
+        prompt = completion = 0
+        for generations in response.generations:
+            for generation in generations:
+                meta = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt += meta.get("input_tokens", 0)
+                completion += meta.get("output_tokens", 0)
+    return prompt or 0, completion or 0
+
+
+class LLMCallback(BaseCallbackHandler):
+    """Records latency, outcome and token usage of every chat model call."""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self._started = {}
+
+    def _labels(self):
+        return current_labels(provider=self.provider)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        labels = self._labels()
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            LLM_SECONDS.observe(time.perf_counter() - start, **labels)
+        LLM_CALLS.inc(status="ok", **labels)
+        prompt, completion = _token_usage(response)
+        LLM_TOKENS.inc(prompt, kind="prompt", **labels)
+        LLM_TOKENS.inc(completion, kind="completion", **labels)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        labels = self._labels()
+        start = self._started.pop(run_id, None)
+        if start is not None:
+            LLM_SECONDS.observe(time.perf_counter() - start, **labels)
+        LLM_CALLS.inc(status="error", **labels)
+
+
+class InstrumentedEmbeddings(Embeddings):
+    """Wraps an Embeddings object and times its calls as the `embedding` stage."""
+
+    def __init__(self, inner, provider):
+        self.inner = inner
+        self.provider = provider
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def embed_documents(self, texts):
+        with track("embedding", provider=self.provider):
+            count("texts", len(texts))
+            return self.inner.embed_documents(texts)
+
+    def embed_query(self, text):
+        with track("embedding", provider=self.provider):
+            count("queries")
+            return self.inner.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        with track("embedding", provider=self.provider):
+            count("texts", len(texts))
+            return await self.inner.aembed_documents(texts)
+
+    async def aembed_query(self, text):
+        with track("embedding", provider=self.provider):
+            count("queries")
+            return await self.inner.aembed_query(text)
@@ -1,57 +1,24 @@
-import pickle
-from base64 import b64decode
-from langchain_chroma import Chroma
-from langchain.schema import Document
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import HumanMessage
-from langchain_openai import ChatOpenAI
+import contextvars
 import time
-from langchain_openai import OpenAIEmbeddings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+from langchain_core.messages import HumanMessage
+
+from config import get_settings
+from llms import chat_model, llm_slot
+from revisions import fingerprint
+import metrics
 
-#     return retriever
-import pickle
-from langchain.vectorstores import Chroma
-from langchain.storage import InMemoryStore
-from langchain.retrievers.multi_vector import MultiVectorRetriever
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-import os
 
 
 def create_retriever():
     print("now i am in retriever")
-    persist_dir = "./chroma_db"
-
-    # Load persisted vectorstore
-    # vectorstore = Chroma(
-    #     persist_directory=persist_dir,
-    #     collection_name="multi_modal_rag",
-    #     embedding_function=GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-
-    vectorstore = Chroma(
-        persist_directory="./chroma_db",
-        collection_name="multi_modal_rag",
-        embedding_function=OpenAIEmbeddings(model="text-embedding-3-large")
-    )
-
+    # Shares the process-wide vectorstore and mapping instead of opening its own
+    from stores import get_retriever
 
-    # Create InMemoryStore and populate it from pickle
-    store = InMemoryStore()
-    if os.path.exists("summary_to_chunk.pkl"):
-        with open("summary_to_chunk.pkl", "rb") as f:
-            mapJson = pickle.load(f)
-        store.mset([(k, v) for k, v in mapJson.items()])
+    return get_retriever()
 
-    # Now pass the proper store to the retriever
-    retriever = MultiVectorRetriever(
-        vectorstore=vectorstore,
-        docstore=store,
-        id_key="doc_id",
-    )
-
-    return retriever
 # -------------------------------
 # Load summary_to_chunk mapping
 # -------------------------------
@@ -61,17 +28,8 @@ def create_retriever():
 # -------------------------------
 # Load vectorstore
 # -------------------------------
-# vectorstore = Chroma(
-#     persist_directory="./chroma_db",
-#     collection_name="multi_modal_rag",
-#     embedding_function=GoogleGenerativeAIEmbeddings(model="models/gemini-embedding-001")
-# )
+# The vectorstore is created lazily and shared, see stores.get_vectorstore()
 
-vectorstore = Chroma(
-    persist_directory="./chroma_db",
-    collection_name="multi_modal_rag",
-    embedding_function=OpenAIEmbeddings(model="text-embedding-3-large")
-)
 
 
 # -------------------------------
@@ -386,18 +344,223 @@ vectorstore = Chroma(
 # response = rag(query, vectorstore, summary_to_chunk)
 # print("\n--- LLM RESPONSE ---\n", response)
 
-import time
-from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
-# from langchain_google_genai import ChatGoogleGenerativeAI   # if you want Gemini fallback
 
-import os
-import time
-from langchain.schema import HumanMessage
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+# Metadata "type" values searched per modality
+MODALITIES = {"text": ["text", "table"], "image": ["image"]}
+
+
+def _modality(doc):
+    kind = doc.metadata.get("type")
+    return "text" if kind in MODALITIES["text"] else kind
+
+
+def _where(types, file_id=None):
+    """Chroma-style `where` clause (also understood by `vectorindex`)."""
+    clauses = [{"type": types[0]} if len(types) == 1 else {"type": {"$in": types}}]
+    if file_id:
+        clauses.append({"file_id": file_id})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
 
-def rag(query, vectorstore, summary_to_chunk=None, k=5, min_text_chunks=1, llm_provider="openai",structure=None):
+
+@lru_cache(maxsize=None)
+def _search_pool():
+    return ThreadPoolExecutor(max_workers=len(MODALITIES) * 2, thread_name_prefix="retrieve")
+
+
+def _scored_search(vectorstore, embedding, k, where):
+    # Chroma's *_with_relevance_scores by vector returns distances; convert like LangChain does
+    relevance = vectorstore._select_relevance_score_fn()
+    hits = vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+    return [(doc, relevance(distance)) for doc, distance in hits]
+
+
+def search_modalities(query, vectorstore, limits, file_id=None):
+    """`{modality: [(doc, relevance), ...]}`, one filtered search per modality.
+
+    The query is embedded once; the searches run concurrently with their
+    own k (`limits`) and the type / document filters pushed into the store.
+    """
+    embedding = vectorstore.embeddings.embed_query(query)
+    futures = {
+        modality: _search_pool().submit(
+            contextvars.copy_context().run, _scored_search,
+            vectorstore, embedding, limit, _where(MODALITIES[modality], file_id),
+        )
+        for modality, limit in limits.items() if limit > 0
+    }
+    return {modality: future.result() for modality, future in futures.items()}
+
+
+def select(scored, limits, min_text_chunks=1, margin=0.2, min_score=None):
+    """Pick context from `(doc, relevance)` candidates, best first.
+
+    Each modality gets its own cutoff (`margin` below its best score, never
+    under `min_score`), since image summaries and text chunks score on
+    different scales, and keeps at most `limits[modality]` candidates above
+    it. `min_text_chunks` is then met from the remaining text candidates.
+    Returns (texts, images, diagnostics).
+    """
+    best = {}
+    for doc, score in scored:
+        best.setdefault(_modality(doc), score)
+    cutoffs = {
+        modality: top - margin if min_score is None else max(min_score, top - margin)
+        for modality, top in best.items()
+    }
+
+    chosen, seen, taken = [], set(), {}
+    for doc, score in scored:
+        chunk = doc.metadata.get("original_content")
+        modality = _modality(doc)
+        if not chunk or chunk in seen:
+            continue
+        if taken.get(modality, 0) < limits.get(modality, 0) and score >= cutoffs[modality]:
+            chosen.append((doc, score, chunk))
+            seen.add(chunk)
+            taken[modality] = taken.get(modality, 0) + 1
+
+    # Minimum-text guarantee from the same candidates
+    missing = min_text_chunks - taken.get("text", 0)
+    for doc, score in scored:
+        if missing <= 0:
+            break
+        chunk = doc.metadata.get("original_content")
+        if chunk and chunk not in seen and _modality(doc) == "text":
+            chosen.append((doc, score, chunk))
+            seen.add(chunk)
+            missing -= 1
+
+    texts = [chunk for doc, _, chunk in chosen if _modality(doc) == "text"]
+    images = [chunk for doc, _, chunk in chosen if _modality(doc) == "image"]
+    diagnostics = {
+        "k": len(chosen),
+        "candidates": len(scored),
+        "cutoffs": {modality: round(cutoff, 4) for modality, cutoff in cutoffs.items()},
+        "scores": [
+            {"type": doc.metadata.get("type"), "score": round(score, 4)} for doc, score, _ in chosen
+        ],
+        # content fingerprints of the chosen chunks (revisions.py)
+        "chunks": [doc.metadata.get("fingerprint") or fingerprint(chunk) for doc, _, chunk in chosen],
+    }
+    return texts, images, diagnostics
+
+
+def _untagged(file_id):
+    """True if `file_id`'s vectors may predate file_id tagging (no registry row, or a legacy one)."""
+    from stores import get_registry
+
+    doc = get_registry().get(file_id)
+    return doc is None or bool(doc.get("legacy"))
+
+
+def retrieve(query, vectorstore, k=5, min_text_chunks=1, diagnostics=None, file_id=None, image_k=None):
+    """Steps 1-3 of `rag`: (texts, images) of original content for `query`.
+
+    Text/table and image summaries are searched separately (`k` and
+    `image_k`, default `DEALLENS_RETRIEVAL_IMAGE_K`, each over-fetched by
+    `DEALLENS_RETRIEVAL_OVERFETCH`) and narrowed by `select`. `file_id`
+    limits the search to one document; when none of its vectors match, all
+    documents are searched only for a document registered before vectors
+    carried a file_id, otherwise there is no context (`diagnostics["scope"]`
+    says which). Pass a dict as `diagnostics` to get the chosen k, cutoffs
+    and scores back.
+    """
+    settings = get_settings()
+    image_k = settings.retrieval_image_k if image_k is None else image_k
+    overfetch = max(1, settings.retrieval_overfetch)
+    limits = {"text": k, "image": image_k}
+    fetch = {modality: limit * overfetch for modality, limit in limits.items()}
+
+    # Step 1: Similarity search (scored, per modality, concurrently)
+    scope = "document" if file_id else "all"
+    with metrics.track("similarity_search"):
+        found = search_modalities(query, vectorstore, fetch, file_id=file_id)
+        if file_id and not any(found.values()):
+            if _untagged(file_id):
+                # Ingested before vectors carried their file_id
+                print(f"No vectors tagged with {file_id}, searching all documents")
+                found = search_modalities(query, vectorstore, fetch)
+                scope = "all (untagged document)"
+            else:
+                # failed, deleted or not ingested yet: never answer from other deals
+                print(f"No vectors for document {file_id}, no context")
+                scope = "none (document has no vectors)"
+    scored = sorted((hit for hits in found.values() for hit in hits), key=lambda hit: -hit[1])
+    print("Similarity search returned: " + ", ".join(f"{m}={len(h)}" for m, h in found.items()))
+
+    # Steps 2-3: Cut weak matches per modality, ensure minimum text chunks
+    texts, images, info = select(
+        scored, limits, min_text_chunks=min_text_chunks,
+        margin=settings.retrieval_margin, min_score=settings.retrieval_min_score,
+    )
+    info["file_id"] = file_id
+    info["scope"] = scope
+    metrics.count("retrieval_candidates", len(scored))
+    metrics.count("retrieval_selected", info["k"])
+    if diagnostics is not None:
+        diagnostics.update(info)
+
+    print(f"Retrieved text chunks: {len(texts)}, images: {len(images)} (cutoffs={info['cutoffs']})")
+    return texts, images
+
+
+def image_block(img_b64, llm_provider="openai"):
+    """Message content block for a base64 PNG, in the provider's format."""
+    if llm_provider == "gemini":
+        # Gemini expects image_url with data URI string
+        return {"type": "image_url", "image_url": f"data:image/png;base64,{img_b64}"}
+    # OpenAI (and the offline stand-ins) expect raw base64 data in a content block
+    return {
+        "type": "image",
+        "source_type": "base64",
+        "data": img_b64,
+        "mime_type": "image/png",
+    }
+
+
+def generate(query, texts, images, llm_provider="openai", structure=None, max_texts=5):
+    """Steps 4-6 of `rag`: answer `query` from already retrieved context."""
+    # Step 4: Prepare messages for LLM
+    content_list = []
+
+    if texts:
+        context_text = "\n".join(map(str, texts[:max_texts]))  # limit to max_texts chunks
+        content_list.append({"type": "text", "text": f"Context:\n{context_text}"})
+
+    for img_b64 in images:
+        metrics.image_bytes(img_b64)
+        content_list.append(image_block(img_b64, llm_provider))
+
+    content_list.append({"type": "text", "text": f"Question: {query}"})
+    message_local = HumanMessage(content=content_list)
+
+    # Step 5: Select LLM
+    llm = chat_model(llm_provider)
+    if structure:
+        print("atrructure is ", structure)
+        llm = llm.with_structured_output(structure)
+
+    # Step 6: Call LLM with retry
+    for attempt in range(2):  # 2 attempts
+        try:
+            if attempt:
+                metrics.retry()
+            with llm_slot():
+                response = llm.invoke([message_local])
+            print("--- RAG PIPELINE END ---\n")
+            return response
+        except Exception as e:
+            print(f"Attempt {attempt+1} failed: {e}")
+            if attempt == 0:
+                print("Retrying in 60s...")
+                time.sleep(60)
+
+    print("All retries failed.")
+    return None
+
+
+def rag(query, vectorstore, summary_to_chunk=None, k=5, min_text_chunks=1, llm_provider="openai",structure=None,
+        diagnostics=None, file_id=None):
     """
     RAG pipeline with text and image retrieval.
     Args:
@@ -406,114 +569,18 @@ def rag(query, vectorstore, summary_to_chunk=None, k=5, min_text_chunks=1, llm_p
         summary_to_chunk: optional mapping fn (unused here).
         k (int): initial top-k results.
         min_text_chunks (int): minimum number of text chunks to retrieve.
-        llm_provider (str): "openai" or "gemini"
+        llm_provider (str): provider registered in `llms` ("openai", "gemini", ...)
+        diagnostics (dict): optional, filled with the retrieval's chosen k and scores.
+        file_id (str): optional, only search this document's vectors.
     """
     print(f"\n--- RAG PIPELINE START ---")
     # print(f"Query: {query}")
     print("sending doe similarity search")
 
-    try:
-        # Step 1: Similarity search
-        results = vectorstore.similarity_search(query, k=k)
-        # print("result we have ", results)
-        print(f"Similarity search returned: {len(results)}")
-
-        # Step 2: Map to original chunks
-        retrieved_texts, retrieved_images = [], []
-
-        for doc in results:
-            chunk = doc.metadata.get("original_content")
-            if not chunk:
-                continue
-            if doc.metadata.get("type") in ["text", "table"]:
-                retrieved_texts.append(chunk)
-            elif doc.metadata.get("type") == "image":
-                retrieved_images.append(chunk)
-
-        # Step 3: Ensure minimum text chunks
-        combined_texts = list(dict.fromkeys(retrieved_texts))  # deduplicate
-
-        if len(combined_texts) < min_text_chunks:
-            print("Not enough text chunks, expanding search...")
-            more_results = vectorstore.similarity_search(query, k=k * 3)
-            for doc in more_results:
-                chunk = doc.metadata.get("original_content")
-                if (
-                    chunk
-                    and doc.metadata.get("type") in ["text", "table"]
-                    and chunk not in combined_texts
-                ):
-                    combined_texts.append(chunk)
-                    if len(combined_texts) >= min_text_chunks:
-                        break
-
-        print(f"Retrieved text chunks: {len(combined_texts)}")
-        # print(f"Retrieved image chunks: {len(retrieved_images)}")
-
-        # Step 4: Prepare messages for LLM
-        content_list = []
-
-        if combined_texts:
-            context_text = "\n".join(map(str, combined_texts[:5]))  # limit to 5 chunks
-            content_list.append({"type": "text", "text": f"Context:\n{context_text}"})
-
-        # Format images per provider
-        def format_image(img_b64):
-            if llm_provider == "gemini":
-                # Gemini expects image_url with data URI string
-                return {"type": "image_url", "image_url": f"data:image/png;base64,{img_b64}"}
-            elif llm_provider == "openai":
-                # OpenAI expects raw base64 data in a content block
-                return {
-                    "type": "image",
-                    "source_type": "base64",
-                    "data": img_b64,
-                    "mime_type": "image/png",
-                }
-            else:
-                raise ValueError("Unsupported provider for image formatting")
-
-        for img_b64 in retrieved_images:
-            content_list.append(format_image(img_b64))
-
-        content_list.append({"type": "text", "text": f"Question: {query}"})
-        message_local = HumanMessage(content=content_list)
-
-        # Step 5: Select LLM
-        if llm_provider == "openai":
-            llm = ChatOpenAI(
-                model="gpt-4o-mini",
-                temperature=0,
-                max_retries=2,
-                api_key=os.getenv("OPENAI_API_KEY"),  # safer: load from env
-            )
-        elif llm_provider == "gemini":
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                temperature=0,
-                max_retries=2,
-            )
-        else:
-            raise ValueError(f"Unsupported LLM provider: {llm_provider}")
-
-        # Step 6: Call LLM with retry
-        for attempt in range(2):  # 2 attempts
-            try:
-                if(structure):
-                    print("atrructure is ", structure)
-                    llm = llm.with_structured_output(structure)
-                    response = llm.invoke([message_local])
-                else:
-                    response = llm.invoke([message_local])
-                print("--- RAG PIPELINE END ---\n")
-                return response
-            except Exception as e:
-                print(f"Attempt {attempt+1} failed: {e}")
-                if attempt == 0:
-                    print("Retrying in 60s...")
-                    time.sleep(60)
-
-        print("All retries failed.")
-        return None
-    except Exception as e:
-        print("excepting is ,",e)
\ No newline at end of file
+    with metrics.track("rag", provider=llm_provider):
+        try:
+            texts, images = retrieve(query, vectorstore, k=k, min_text_chunks=min_text_chunks,
+                                     diagnostics=diagnostics, file_id=file_id)
+            return generate(query, texts, images, llm_provider=llm_provider, structure=structure)
+        except Exception as e:
+            print("excepting is ,",e)
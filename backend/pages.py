@@ -0,0 +1,175 @@
+"""
+Cheap per-page pre-pass that decides which pages need layout inference.
+
+`chunking` used to run every page through unstructured's `hi_res`
+strategy (layout model + table structure inference). Most memorandum
+pages are plain, text-native prose that the `fast` text extractor handles
+just as well. A page is sent to `hi_res` when its text layer is too thin
+(scanned / drawn text), when it places an image, or when it looks like a
+table (ruled lines or rows of numbers); everything else goes to `fast`.
+
+Classification only reads the text layer and the raw content stream with
+pypdf, so it costs milliseconds per page. The same pass computes a content
+digest per page (content stream plus every font / image / form it uses),
+which keys the partition cache (partitioncache.py).
+"""
+
+import hashlib
+import io
+import re
+from dataclasses import dataclass
+
+HI_RES, FAST = "hi_res", "fast"
+
+# drawn line segments / rectangles in a content stream
+_RULE_OPS = re.compile(rb"(?<![A-Za-z])(?:re|l)(?![A-Za-z])")
+# string operands (text shown on the page), skipped when counting operators
+_STRINGS = re.compile(rb"\((?:\\.|[^\\()])*\)|<[0-9A-Fa-f\s]*>")
+_PAINT = re.compile(rb"/([^\s/\[\]()<>{}%]+)\s+Do(?![A-Za-z])")
+_NUMBER = re.compile(r"^[($-]*\$?\d[\d,.]*%?\)?$")
+
+
+@dataclass
+class PageInfo:
+    number: int  # 1-based
+    strategy: str
+    chars: int
+    images: int
+    rules: int
+    numeric_rows: int
+    digest: str = ""
+
+
+def _numeric_rows(text, min_numbers=2):
+    """Lines holding `min_numbers` or more numeric cells (unruled tables)."""
+    rows = 0
+    for line in text.splitlines():
+        if sum(bool(_NUMBER.match(token)) for token in line.split()) >= min_numbers:
+            rows += 1
+    return rows
+
+
+def _images(page, data):
+    """Images the page actually paints (`/Name Do`), not just ones its resources list."""
+    painted = set(_PAINT.findall(data))
+    if not painted:
+        return 0
+    try:
+        xobjects = page["/Resources"].get_object().get("/XObject")
+    except (KeyError, AttributeError):
+        return 0
+    if not xobjects:
+        return 0
+    xobjects = xobjects.get_object()
+    return sum(
+        1 for name in xobjects
+        if name.encode("latin-1")[1:] in painted and xobjects[name].get_object().get("/Subtype") == "/Image"
+    )
+
+
+class _Digester:
+    """sha256 of PDF objects; shared objects (fonts, images) are hashed once per file."""
+
+    def __init__(self):
+        self._memo = {}
+
+    def _ref(self, ref):
+        key = (ref.idnum, ref.generation)
+        if key not in self._memo:
+            self._memo[key] = b"cycle"  # placeholder while the object is being hashed
+            h = hashlib.sha256()
+            self._feed(h, ref.get_object())
+            self._memo[key] = h.digest()
+        return self._memo[key]
+
+    def _feed(self, h, obj):
+        import pypdf.generic as g
+
+        if isinstance(obj, g.IndirectObject):
+            h.update(b"R" + self._ref(obj))
+        elif isinstance(obj, g.StreamObject):
+            self._feed(h, {k: v for k, v in obj.items() if k not in ("/Length", "/Filter", "/DecodeParms")})
+            h.update(b"S" + obj.get_data())
+        elif isinstance(obj, dict):
+            h.update(b"<<")
+            for key in sorted(obj):
+                if key != "/Parent":
+                    h.update(str(key).encode("utf-8", "replace"))
+                    self._feed(h, obj[key])
+            h.update(b">>")
+        elif isinstance(obj, list):
+            h.update(b"[")
+            for item in obj:
+                self._feed(h, item)
+            h.update(b"]")
+        else:
+            h.update(repr(obj).encode("utf-8", "replace") + b" ")
+
+    def page(self, page):
+        h = hashlib.sha256()
+        self._feed(h, {k: v for k, v in page.items() if k not in ("/Contents", "/Parent")})
+        contents = page.get_contents()
+        h.update(b"C" + (contents.get_data() if contents is not None else b""))
+        return h.hexdigest()
+
+
+def classify_page(page, number, min_chars=200, min_rules=12, min_numeric_rows=4):
+    text = page.extract_text() or ""
+    contents = page.get_contents()
+    data = contents.get_data() if contents is not None else b""
+    ops = _STRINGS.sub(b" ", data)
+    info = PageInfo(
+        number=number,
+        strategy=FAST,
+        chars=len(text.strip()),
+        images=_images(page, ops),
+        rules=len(_RULE_OPS.findall(ops)),
+        numeric_rows=_numeric_rows(text),
+    )
+    if (
+        info.chars < min_chars
+        or info.images
+        or info.rules >= min_rules
+        or info.numeric_rows >= min_numeric_rows
+    ):
+        info.strategy = HI_RES
+    return info
+
+
+def classify_pages(file_path, min_chars=200):
+    """PageInfo (with its digest) for every page of the PDF."""
+    import pypdf
+
+    reader = pypdf.PdfReader(file_path)
+    digester = _Digester()
+    infos = []
+    for i, page in enumerate(reader.pages):
+        info = classify_page(page, i + 1, min_chars=min_chars)
+        info.digest = digester.page(page)
+        infos.append(info)
+    return infos
+
+
+def runs(infos):
+    """Adjacent pages sharing a strategy: [(strategy, [page numbers])], in page order."""
+    groups = []
+    for info in infos:
+        if groups and groups[-1][0] == info.strategy and groups[-1][1][-1] == info.number - 1:
+            groups[-1][1].append(info.number)
+        else:
+            groups.append((info.strategy, [info.number]))
+    return groups
+
+
+def extract_pages(file_path, numbers):
+    """A new PDF (file-like) holding only pages `numbers` (1-based) of `file_path`."""
+    import pypdf
+
+    reader = pypdf.PdfReader(file_path)
+    writer = pypdf.PdfWriter()
+    for number in numbers:
+        writer.add_page(reader.pages[number - 1])
+    out = io.BytesIO()
+    writer.write(out)
+    out.seek(0)
+    return out
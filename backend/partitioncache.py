@@ -0,0 +1,121 @@
+"""
+Per-page cache of unstructured partition output.
+
+Layout detection (`hi_res`) is by far the slowest step of ingestion, and
+its output only depends on the page and the partition parameters; the
+chunking that follows is cheap. So the raw elements of every page are
+kept under a key of
+
+    sha256(page digest (pages.py) + partition parameters + unstructured version)
+
+and re-ingesting a document, ingesting the same pages again inside another
+file, or re-chunking with different `CHUNKING` settings loads them instead
+of partitioning again.
+
+On disk (`DEALLENS_PARTITION_CACHE_DIR`):
+
+- `pages/<key[:2]>/<key>.json.gz`: the page's elements as unstructured
+  element dicts (text, table HTML, coordinates, ...), without file-specific
+  metadata (filename, page number), which is set again on load.
+- `images/<sha[:2]>/<sha>`: extracted image payloads, stored once as raw
+  bytes and referenced from the elements by their sha256.
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+
+import storage
+
+# bump when the stored form changes
+FORMAT = 1
+# set from the file being ingested, not stored
+_FILE_METADATA = ("filename", "file_directory", "last_modified", "page_number", "image_base64")
+
+
+def _version():
+    try:
+        from unstructured.__version__ import __version__
+    except ImportError:
+        return "unknown"
+    return __version__
+
+
+class PartitionCache:
+    def __init__(self, root):
+        self.root = root
+
+    def key(self, digest, params):
+        """Cache key of one page partitioned with `params`."""
+        spec = json.dumps(
+            {"format": FORMAT, "unstructured": _version(), "params": params},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(f"{digest}\n{spec}".encode("utf-8")).hexdigest()
+
+    def _page_path(self, key):
+        return os.path.join(self.root, "pages", key[:2], f"{key}.json.gz")
+
+    def _image_path(self, sha):
+        return os.path.join(self.root, "images", sha[:2], sha)
+
+    # -------------------------------
+    # Read
+    # -------------------------------
+    def get(self, key, number, filename):
+        """Elements of a cached page as page `number` of `filename`, or None on a miss."""
+        from unstructured.staging.base import elements_from_dicts
+
+        try:
+            with gzip.open(self._page_path(key), "rt", encoding="utf-8") as f:
+                dicts = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable partition cache entry {key}: {e}")
+            return None
+
+        refs = [d.pop("image_ref", None) for d in dicts]
+        elements = elements_from_dicts(dicts)
+        for element, ref in zip(elements, refs):
+            element.metadata.filename = filename
+            element.metadata.page_number = number
+            if ref is not None:
+                try:
+                    with open(self._image_path(ref), "rb") as f:
+                        element.metadata.image_base64 = base64.b64encode(f.read()).decode("ascii")
+                except FileNotFoundError:
+                    # payload pruned: the entry is no longer complete
+                    return None
+        return elements
+
+    # -------------------------------
+    # Write
+    # -------------------------------
+    def put(self, key, elements):
+        """Store the elements of one page (an empty list for a page without any)."""
+        from unstructured.staging.base import elements_to_dicts
+
+        dicts = elements_to_dicts(elements)
+        for element, d in zip(elements, dicts):
+            metadata = d.get("metadata", {})
+            for name in _FILE_METADATA:
+                metadata.pop(name, None)
+            payload = element.metadata.image_base64
+            if payload:
+                d["image_ref"] = self._put_image(base64.b64decode(payload))
+
+        path = self._page_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(dicts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        storage.atomic_write_bytes(path, gzip.compress(data, 6, mtime=0))
+
+    def _put_image(self, data):
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._image_path(sha)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            storage.atomic_write_bytes(path, data)
+        return sha
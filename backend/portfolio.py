@@ -0,0 +1,145 @@
+"""
+Questions across several documents (`/api/portfolio/chat`).
+
+"Which of these properties have a cap rate above 6%?" needs context from
+every selected deal. The question is embedded once; a text/table search
+then runs per document, all documents concurrently, each filtered to its
+own `file_id` (one memmap segment, or one Chroma `where`). Documents that
+have not answered within `DEALLENS_PORTFOLIO_TIMEOUT` seconds are left
+out and reported as timed out instead of holding up the answer.
+
+The candidates are merged into one context under
+`DEALLENS_PORTFOLIO_CONTEXT_TOKENS`: first each document's best chunk (so
+every deal can be answered for), then the rest by score. Every chunk is
+labelled with its document, and one LLM call writes the answer.
+
+Images are not searched; portfolio questions are about figures and terms.
+"""
+
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import metrics
+from config import get_settings
+
+PORTFOLIO_PROMPT = (
+    "You are an analyst assistant comparing commercial real estate deals. The context "
+    "below holds excerpts from several offering memoranda, each labelled with its deal. "
+    "Answer the question for every deal it applies to, naming the deal for each figure. "
+    "If a deal's excerpts do not answer it, say so for that deal."
+)
+
+
+@lru_cache(maxsize=None)
+def _pool():
+    return ThreadPoolExecutor(max_workers=get_settings().portfolio_workers, thread_name_prefix="portfolio")
+
+
+def _search(vectorstore, embedding, k, file_id):
+    from noPklRetrieval import MODALITIES, _scored_search, _where
+
+    start = time.perf_counter()
+    hits = _scored_search(vectorstore, embedding, k, _where(MODALITIES["text"], file_id))
+    return hits, time.perf_counter() - start
+
+
+def fan_out(question, vectorstore, file_ids, k=5, timeout=None):
+    """`({file_id: [(doc, relevance), ...]}, {file_id: status})`.
+
+    Searches the documents concurrently; status is "ok" (with the seconds
+    it took), "timeout" or "error".
+    """
+    settings = get_settings()
+    timeout = settings.portfolio_timeout if timeout is None else timeout
+    embedding = vectorstore.embeddings.embed_query(question)
+    futures = {
+        _pool().submit(contextvars.copy_context().run, _search, vectorstore, embedding, k, file_id): file_id
+        for file_id in file_ids
+    }
+    done, pending = wait(futures, timeout=timeout or None)
+
+    hits, status = {}, {}
+    for future in pending:
+        future.cancel()  # not started yet; a running search finishes unobserved
+        status[futures[future]] = {"status": "timeout"}
+    for future in done:
+        file_id = futures[future]
+        try:
+            hits[file_id], seconds = future.result()
+            status[file_id] = {"status": "ok", "seconds": round(seconds, 3), "candidates": len(hits[file_id])}
+        except Exception as e:
+            print(f"Portfolio search of {file_id} failed: {e}")
+            status[file_id] = {"status": "error", "error": str(e)}
+    metrics.count("portfolio_timeouts", len(pending))
+    return hits, status
+
+
+def merge(hits, budget_tokens, min_score=None):
+    """`[(file_id, chunk, relevance)]` within `budget_tokens`: each document's best, then by score."""
+    from sessions import estimate_tokens
+
+    ranked = sorted(
+        (
+            (score, file_id, doc.metadata.get("original_content"))
+            for file_id, found in hits.items()
+            for doc, score in found
+            if doc.metadata.get("original_content") and (min_score is None or score >= min_score)
+        ),
+        key=lambda hit: -hit[0],
+    )
+    firsts, seen_files = [], set()
+    for hit in ranked:
+        if hit[1] not in seen_files:
+            firsts.append(hit)
+            seen_files.add(hit[1])
+
+    chosen, seen, used = [], set(), 0
+    for score, file_id, chunk in firsts + ranked:
+        if chunk in seen:
+            continue
+        cost = estimate_tokens(str(chunk))
+        if used + cost > budget_tokens:
+            continue
+        chosen.append((file_id, chunk, score))
+        seen.add(chunk)
+        used += cost
+    return chosen
+
+
+def build_messages(question, chosen, names):
+    blocks = [f"[Deal: {names.get(file_id) or file_id}]\n{chunk}" for file_id, chunk, _ in chosen]
+    return [
+        SystemMessage(content=PORTFOLIO_PROMPT),
+        HumanMessage(content="Context:\n\n" + "\n\n".join(blocks) + f"\n\nQuestion: {question}"),
+    ]
+
+
+def ask(question, file_ids, vectorstore, llm_provider="openai", diagnostics=None):
+    """Answer `question` from the documents `file_ids`; returns the LLM message.
+
+    Pass a dict as `diagnostics` to get each document's search status and
+    the chunks used per document back.
+    """
+    from sessions import _invoke
+    from stores import get_registry
+
+    settings = get_settings()
+    registry = get_registry()
+    names = {file_id: (registry.get(file_id) or {}).get("filename") for file_id in file_ids}
+
+    with metrics.track("portfolio_chat", provider=llm_provider):
+        with metrics.track("similarity_search"):
+            hits, status = fan_out(question, vectorstore, file_ids)
+        chosen = merge(hits, settings.portfolio_context_tokens, settings.retrieval_min_score)
+        metrics.count("retrieval_selected", len(chosen))
+        answer = _invoke(build_messages(question, chosen, names), llm_provider)
+
+    if diagnostics is not None:
+        for file_id, chunk, _ in chosen:
+            status[file_id]["chunks"] = status[file_id].get("chunks", 0) + 1
+        diagnostics.update(documents=status, k=len(chosen))
+    return answer
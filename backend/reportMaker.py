@@ -2,13 +2,11 @@ import json
 from typing import Dict, Any
 
 # Import your rag function and vectorstore
-from noPklRetrieval import rag  # adjust to your actual file/module
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_chroma import Chroma
-import pickle
-from langchain_openai import OpenAIEmbeddings
+from noPklRetrieval import rag, retrieve, generate  # adjust to your actual file/module
+from functools import lru_cache
+from config import get_settings
+import metrics
+import tables
 
 
 # # ===== LLM Initialization (Gemini) =====
@@ -44,7 +42,7 @@ from langchain_openai import OpenAIEmbeddings
 #         return {"raw_text": structured.content}  # fallback
 
 # # ===== Main: Build Full Report =====
-# def build_report(vectorstore, summary_to_chunk) -> Dict[str, Any]:
+# def build_report(vectorstore, summary_to_chunk, llm_provider="openai") -> Dict[str, Any]:
 #     full_report = {}
 
 #     for section, query in SECTION_QUERIES.items():
@@ -60,20 +58,9 @@ from langchain_openai import OpenAIEmbeddings
 import json
 import re
 from typing import Dict, Any
-from langchain_google_genai import ChatGoogleGenerativeAI
-import os
 
-# ===== Init Gemini =====
-# llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0)
-llm = ChatOpenAI(
-    model="gpt-4o-mini",
-    temperature=0,
-    max_retries=2,
-    api_key=os.getenv("OPENAI_API_KEY"),  # safer: load from env
-    # base_url="...",
-    # organization="...",
-    # other params...
-)
+# ===== LLM =====
+# Chat models are built per call through llms.chat_model (see rag), not at import.
 
 # ===== Section Queries =====
 SECTION_QUERIES = {
@@ -87,40 +74,181 @@ SECTION_QUERIES = {
     "proscons":"Generate pros and cons based on detailed property information including location, unit types and counts, rental income data, operating expenses, net operating income, property taxes, year built, lot size, occupancy rates, market demographics, investment highlights, financing terms, and any risk factors mentioned. If no information is found, return empty pros and cons."
 }
 
-with open("schema.json","r",encoding="utf-8") as f:
-    SECTION_SCHEMAS = json.load(f)
+@lru_cache(maxsize=None)
+def section_schemas() -> Dict[str, Any]:
+    """Structured-output schemas per section, read from schema.json on first use."""
+    with open(get_settings().schema_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def __getattr__(name):
+    # Keeps `reportMaker.SECTION_SCHEMAS` working without reading the file at import
+    if name == "SECTION_SCHEMAS":
+        return section_schemas()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _as_dict(data):
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            return None
+    return data if isinstance(data, dict) else None
+
 
 import time
 # ===== Helper: RAG + Structuring =====
-def extract_section(query: str, vectorstore, summary_to_chunk,structure) -> Dict[str, Any]:
-    rag_result = rag(query, vectorstore, summary_to_chunk,structure = structure)
+def extract_section(query: str, vectorstore, summary_to_chunk,structure, llm_provider="openai", file_id=None,
+                    diagnostics=None) -> Dict[str, Any]:
+    rag_result = rag(query, vectorstore, summary_to_chunk,structure = structure, llm_provider=llm_provider,
+                     file_id=file_id, diagnostics=diagnostics)
     return rag_result
 
+
+# ===== Section batching =====
+def group_sections(contexts, min_overlap=0.5, max_group=4):
+    """Group sections whose retrieved chunks overlap.
+
+    `contexts` maps section -> (texts, images). A section joins the first
+    group already holding at least `min_overlap` of its text chunks, so a
+    group's combined context stays close to its largest member's.
+    """
+    groups = []
+    for section, (texts, _) in contexts.items():
+        chunks = set(texts)
+        for group in groups:
+            if chunks and len(group["sections"]) < max_group and \
+                    len(chunks & group["chunks"]) / len(chunks) >= min_overlap:
+                group["sections"].append(section)
+                group["chunks"] |= chunks
+                break
+        else:
+            groups.append({"sections": [section], "chunks": chunks})
+    return [group["sections"] for group in groups]
+
+
+def combined_schema(structures):
+    """One object schema with a property per section."""
+    return {
+        "title": "ReportSections",
+        "description": "Several report sections extracted from the same context",
+        "type": "object",
+        "properties": dict(structures),
+        "required": list(structures),
+    }
+
+
+def _extract_group(sections, contexts, structures, llm_provider):
+    if len(sections) == 1:
+        section = sections[0]
+        texts, images = contexts[section]
+        return {section: generate(SECTION_QUERIES[section], texts, images, llm_provider, structures[section])}
+
+    # Union of the members' context, in retrieval order
+    texts = list(dict.fromkeys(t for section in sections for t in contexts[section][0]))
+    images = list(dict.fromkeys(i for section in sections for i in contexts[section][1]))
+    query = "Fill every section of the schema from the context. Instructions per section:\n" + "\n".join(
+        f"- {section}: {SECTION_QUERIES[section]}" for section in sections
+    )
+    data = _as_dict(generate(
+        query, texts, images, llm_provider,
+        combined_schema({section: structures[section] for section in sections}),
+        max_texts=5 * len(sections),
+    )) or {}
+    return {section: data.get(section) for section in sections}
+
+
 # ===== Full Report Builder =====
-def build_report(vectorstore, summary_to_chunk) -> Dict[str, Any]:
-    report = {}
-    import time
-    # time.sleep(20)
-    for section, query in SECTION_QUERIES.items():
-        structure = SECTION_SCHEMAS[section]
-        print(f"🔎 Extracting {section}...")
-        data = extract_section(query, vectorstore, summary_to_chunk,structure)
-        print("done with section,", section)
-        if data:
-            if isinstance(data, str):
-                try:
-                    print("Trying json.loads")
-                    report[section] = json.loads(data)
-                except json.JSONDecodeError:
-                    report[section] = data  # fallback to raw string if JSON fails
-            elif isinstance(data, dict):
-                report[section] = data
+def _finish_section(section, data, prefill):
+    if prefill:
+        data = tables.merge(_as_dict(data), prefill)
+    print("done with section,", section)
+    if isinstance(data, str):
+        try:
+            print("Trying json.loads")
+            data = json.loads(data)
+        except json.JSONDecodeError:
+            pass  # keep the raw string if JSON fails
+    print("section is ", section, " and ", data )
+    return data
+
+
+def iter_sections(vectorstore, summary_to_chunk, llm_provider="openai", facts=None, batched=None,
+                  file_id=None, sections=None, sources=None):
+    """Yield `(section, data)` as soon as each section is extracted.
+
+    `sections` limits the run to those sections (default: all). Sections
+    filled entirely from table `facts` come first, without an LLM call.
+    Pass a dict as `sources` to get each section's chunk fingerprints.
+    """
+    sources = {} if sources is None else sources
+    settings = get_settings()
+    batched = settings.report_batching if batched is None else batched
+    sections = [s for s in SECTION_QUERIES if sections is None or s in sections]
+    with metrics.track("build_report", provider=llm_provider):
+        prefills, structures = {}, {}
+        for section in sections:
+            structure = section_schemas()[section]
+            prefills[section] = tables.prefill(section, facts)
+            if prefills[section]:
+                structure = tables.missing_schema(structure, prefills[section])
+                metrics.count("prefilled_sections")
+            if structure is None:
+                print(f"{section} filled from tables, skipping LLM")
+                sources[section] = []
+                yield section, _finish_section(section, None, prefills[section])
             else:
-                # If data is other type, store as is or convert accordingly
-                report[section] = data
-        print("section is ", section, " and ", data )
+                structures[section] = structure
+
+        if batched:
+            contexts = {}
+            for section in structures:
+                diagnostics = {}
+                with metrics.track("build_report", section=section):
+                    contexts[section] = retrieve(
+                        SECTION_QUERIES[section], vectorstore, diagnostics=diagnostics, file_id=file_id
+                    )
+                sources[section] = diagnostics.get("chunks", [])
+            groups = group_sections(contexts, settings.report_group_overlap, settings.report_group_max)
+            metrics.count("section_groups", len(groups))
+            for group in groups:
+                print(f"🔎 Extracting {', '.join(group)}...")
+                with metrics.track("build_report", section="+".join(group)):
+                    results = _extract_group(group, contexts, structures, llm_provider)
+                for section in group:
+                    yield section, _finish_section(section, results.get(section), prefills[section])
+        else:
+            for section in structures:
+                print(f"🔎 Extracting {section}...")
+                diagnostics = {}
+                with metrics.track("build_report", section=section):
+                    data = extract_section(
+                        SECTION_QUERIES[section], vectorstore, summary_to_chunk, structures[section], llm_provider,
+                        file_id=file_id, diagnostics=diagnostics,
+                    )
+                sources[section] = diagnostics.get("chunks", [])
+                yield section, _finish_section(section, data, prefills[section])
 
-    return report
+
+def assemble(sections):
+    """Report dict from `(section, data)` pairs, in section order, empty sections dropped."""
+    found = dict(sections)
+    return {section: found[section] for section in SECTION_QUERIES if found.get(section)}
+
+
+def build_report(vectorstore, summary_to_chunk, llm_provider="openai", facts=None, batched=None,
+                 file_id=None) -> Dict[str, Any]:
+    """`facts` (from tables.table_facts at ingest) prefill the financial sections;
+    the LLM is only asked for the fields they leave missing. `file_id` limits
+    retrieval to that document's vectors.
+
+    With `batched` (default DEALLENS_REPORT_BATCHING) sections whose retrieved
+    chunks overlap are extracted together in one structured-output call."""
+    # import time
+    # time.sleep(20)
+    return assemble(iter_sections(
+        vectorstore, summary_to_chunk, llm_provider, facts=facts, batched=batched, file_id=file_id
+    ))
 
 # ===== Runner =====
 # if __name__ == "__main__":
@@ -145,10 +273,12 @@ if __name__ == "__main__":
     #     collection_name="multi_modal_rag",
     #     embedding_function=OpenAIEmbeddings(model="text-embedding-3-large")
     # )
-    with open("summary_to_chunk.pkl", "rb") as f:
-        summary_to_chunk = pickle.load(f)
+    from stores import get_summary_to_chunk, get_vectorstore
+
+    vectorstore = get_vectorstore()
+    summary_to_chunk = get_summary_to_chunk()
 
-    report = build_report(vectorstore, summary_to_chunk)
+    report = build_report(vectorstore, summary_to_chunk, get_settings().llm_provider)
 
     # Save JSON output
     with open("final_report.json", "w") as f:
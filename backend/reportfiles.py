@@ -0,0 +1,274 @@
+"""
+Cached report files and their HTTP delivery.
+
+A report is stored as compact JSON (`<key>_report.json`). Next to it the
+whole `/report/{file_key}` response body (`{"status":"success","report":...}`)
+is kept precompressed with gzip, and with brotli when the `brotli` package
+is installed, in content-addressed files `<key>_report.<etag>.json.gz|br`.
+`<key>_report.json.etag` names the current version and is replaced last,
+so a reader never pairs an ETag with other content.
+
+Cache hits are served from those files as they are: no JSON parse or dump,
+no compression per request, and `If-None-Match` is answered with 304 after
+reading the small ETag file alone.
+
+While a report is incomplete its finished sections are kept one file each
+in `<key>_report.sections/`, so streamed and per-section requests don't
+redo them; writing the full report removes that directory.
+
+`<key>_report.sources.json` (and `<name>.sources.json` per cached section)
+records the fingerprints of the chunks each section was extracted from, so
+a document revision only invalidates the sections it touches
+(revisions.py).
+
+Writing or removing a report also updates its row in the screening index
+(screening.py).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+import storage
+
+PREFIX = b'{"status":"success","report":'
+SUFFIX = b"}"
+# preferred first
+ENCODINGS = {"br": "br", "gzip": "gz"}
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def dumps(report):
+    return json.dumps(report, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _etag_path(path):
+    return f"{path}.etag"
+
+
+def _stem(path):
+    return path[: -len(".json")] if path.endswith(".json") else path
+
+
+def sources_path(path):
+    return f"{_stem(path)}.sources.json"
+
+
+def variant_path(path, etag, encoding):
+    return f"{_stem(path)}.{etag}.json.{ENCODINGS[encoding]}"
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+# -------------------------------
+# Storage
+# -------------------------------
+def write(path, report, sources=None):
+    """Store `report` and its compressed response bodies; returns the ETag.
+
+    `sources` maps section -> fingerprints of the chunks it was extracted from.
+    """
+    data = dumps(report)
+    body = PREFIX + data + SUFFIX
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    previous = current_etag(path)
+
+    storage.atomic_write_bytes(variant_path(path, etag, "gzip"), gzip.compress(body, 9, mtime=0))
+    brotli = _brotli()
+    if brotli is not None:
+        storage.atomic_write_bytes(variant_path(path, etag, "br"), brotli.compress(body, quality=11))
+    storage.atomic_write_bytes(path, data)
+    if sources is not None:
+        storage.atomic_write_bytes(sources_path(path), dumps(sources))
+    else:
+        _unlink(sources_path(path))
+    storage.atomic_write_bytes(_etag_path(path), etag.encode("ascii"))
+
+    if previous and previous != etag:
+        for encoding in ENCODINGS:
+            _unlink(variant_path(path, previous, encoding))
+    clear_sections(path)
+    _update_screening(path, report)
+    return etag
+
+
+def remove(path):
+    """Delete the stored report (not its section cache)."""
+    etag = current_etag(path)
+    # ETag first: without it the report counts as missing
+    _unlink(_etag_path(path))
+    if etag:
+        for encoding in ENCODINGS:
+            _unlink(variant_path(path, etag, encoding))
+    _unlink(path)
+    _unlink(sources_path(path))
+    _update_screening(path)
+
+
+def _update_screening(path, report=None):
+    # Keep the screening index (screening.py) in step; a failure there must not fail the write
+    try:
+        import screening
+
+        if report is None:
+            screening.report_removed(path)
+        else:
+            screening.report_written(path, report)
+    except Exception as e:
+        print(f"Screening index not updated for {path}: {e}")
+
+
+def current_etag(path):
+    try:
+        with open(_etag_path(path), "rb") as f:
+            return f.read().decode("ascii").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read(path):
+    """The stored report, or None."""
+    # Reports are replaced atomically, so an existing file is always complete
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_sources(path):
+    """`{section: [chunk fingerprints]}` recorded with the stored report ({} if none)."""
+    try:
+        with open(sources_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def ensure_current(path):
+    """ETag of the stored report, converting one written before this layout (None if missing)."""
+    etag = current_etag(path)
+    if etag is not None or not os.path.exists(path):
+        return etag
+    with storage.file_lock(path):
+        etag = current_etag(path)
+        if etag is None:
+            report = read(path)
+            if report is None:
+                return None
+            etag = write(path, report)
+    return etag
+
+
+# -------------------------------
+# Sections of an incomplete report
+# -------------------------------
+def sections_dir(path):
+    return f"{_stem(path)}.sections"
+
+
+def section_path(path, name):
+    return os.path.join(sections_dir(path), f"{name}.json")
+
+
+def read_section(path, name):
+    """(found, data) for one finished section."""
+    try:
+        with open(section_path(path, name), "r", encoding="utf-8") as f:
+            return True, json.load(f)
+    except FileNotFoundError:
+        return False, None
+
+
+def write_section(path, name, data, sources=None):
+    os.makedirs(sections_dir(path), exist_ok=True)
+    if sources is not None:
+        storage.atomic_write_bytes(os.path.join(sections_dir(path), f"{name}.sources.json"), dumps(sources))
+    storage.atomic_write_bytes(section_path(path, name), dumps(data))
+
+
+def cached_sections(path, names):
+    """`{name: data}` of the finished sections among `names`, in that order."""
+    found = {}
+    for name in names:
+        hit, data = read_section(path, name)
+        if hit:
+            found[name] = data
+    return found
+
+
+def cached_sources(path, names):
+    """`{name: [chunk fingerprints]}` recorded for the cached sections among `names`."""
+    found = {}
+    for name in names:
+        try:
+            with open(os.path.join(sections_dir(path), f"{name}.sources.json"), "r", encoding="utf-8") as f:
+                found[name] = json.load(f)
+        except FileNotFoundError:
+            pass
+    return found
+
+
+def clear_sections(path):
+    shutil.rmtree(sections_dir(path), ignore_errors=True)
+
+
+# -------------------------------
+# HTTP
+# -------------------------------
+def _accepted_encodings(header):
+    accepted = set()
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def _identity_body(path, chunk_size=1 << 16):
+    yield PREFIX
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            yield block
+    yield SUFFIX
+
+
+def response(path, request, etag=None):
+    """Serve the stored report for `request`: 304, a precompressed body, or streamed JSON."""
+    etag = etag or current_etag(path)
+    headers = {"ETag": f'"{etag}"', "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if headers["ETag"] in candidates or "*" in candidates:
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding"))
+    for encoding in ENCODINGS:
+        variant = variant_path(path, etag, encoding)
+        if encoding in accepted and os.path.exists(variant):
+            return FileResponse(
+                variant, media_type="application/json",
+                headers={**headers, "Content-Encoding": encoding},
+            )
+    return StreamingResponse(_identity_body(path), media_type="application/json", headers=headers)
@@ -0,0 +1,190 @@
+"""
+Delta re-ingestion of a revised document.
+
+A revised memorandum usually differs from the previous version in a few
+pages (an updated rent roll, a new price). Instead of ingesting it as a
+new document, the revision replaces the content of the existing
+`file_id`:
+
+- Pages: unchanged pages are not partitioned again; their elements come
+  from the partition cache, keyed by page digest (pages.py,
+  partitioncache.py).
+- Chunks: every chunk is fingerprinted by its content. Chunks whose
+  fingerprint is already stored for the document keep their vectors and
+  summaries; only new ones are summarized and embedded, and the vectors
+  and chunk store entries of chunks that are gone are deleted.
+- Report: each report section records the fingerprints of the chunks it
+  was extracted from. A section stays valid when the same query against
+  the revised document retrieves the same chunks (and its table prefill is
+  unchanged); only the other sections are extracted again on the next
+  report request.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import metrics
+import rowslices
+import storage
+from config import get_settings
+
+
+def fingerprint(content):
+    """Content fingerprint of a chunk (its original text / table text / image base64)."""
+    return hashlib.sha256(str(content).encode("utf-8")).hexdigest()[:32]
+
+
+def report_path(file_id):
+    return os.path.join(get_settings().report_dir, f"{file_id}_report.json")
+
+
+# -------------------------------
+# Chunks
+# -------------------------------
+def stored_chunks(vectorstore, file_id):
+    """`{fingerprint: [(vector id, doc_id), ...]}` of a document's stored chunks."""
+    found = vectorstore.get(where={"file_id": file_id}, include=["metadatas"])
+    stored = {}
+    for vector_id, metadata in zip(found["ids"], found["metadatas"]):
+        key = metadata.get("fingerprint") or fingerprint(metadata.get("original_content", ""))
+        stored.setdefault(key, []).append((vector_id, metadata.get("doc_id")))
+    return stored
+
+
+def _remove(retriever, stored, fingerprints):
+    vector_ids = [vector_id for key in fingerprints for vector_id, _ in stored[key]]
+    doc_ids = [doc_id for key in fingerprints for _, doc_id in stored[key] if doc_id]
+    if not vector_ids:
+        return 0
+    from stores import vectorstore_write_lock
+
+    with vectorstore_write_lock():
+        retriever.vectorstore.delete(ids=vector_ids)
+        retriever.docstore.mdelete(doc_ids)
+    storage.bump("vectorstore")
+    return len(vector_ids)
+
+
+# -------------------------------
+# Report sections
+# -------------------------------
+def stale_sections(report, sources, vectorstore, file_id, old_facts, new_facts):
+    """Names of the computed sections that no longer hold for the revised document."""
+    from noPklRetrieval import retrieve
+    from reportMaker import SECTION_QUERIES, section_schemas
+    import tables
+
+    stale = []
+    for section in SECTION_QUERIES:
+        if section not in sources and section not in report:
+            continue  # never computed
+        if section not in sources:
+            stale.append(section)  # computed before sections recorded their chunks
+            continue
+        prefill = tables.prefill(section, new_facts)
+        if tables.prefill(section, old_facts) != prefill:
+            stale.append(section)
+            continue
+        if prefill and tables.missing_schema(section_schemas()[section], prefill) is None:
+            continue  # filled from tables alone, no retrieval
+        diagnostics = {}
+        retrieve(SECTION_QUERIES[section], vectorstore, diagnostics=diagnostics, file_id=file_id)
+        if set(diagnostics.get("chunks", [])) != set(sources[section]):
+            stale.append(section)
+    return stale
+
+
+def invalidate_report(file_id, vectorstore, old_facts, new_facts):
+    """Drop the report sections a revision changed; returns their names.
+
+    The sections that still hold go back into the section cache, so the
+    next report request extracts only the stale ones.
+    """
+    import reportfiles
+
+    path = report_path(file_id)
+    with storage.file_lock(path):
+        report = reportfiles.read(path) or {}
+        sources = reportfiles.read_sources(path)
+        names = set(sources) | set(report)
+        cached = reportfiles.cached_sections(path, names)
+        report = {**cached, **report}
+        sources = {**reportfiles.cached_sources(path, names), **sources}
+        if not report and not sources:
+            return []
+
+        stale = stale_sections(report, sources, vectorstore, file_id, old_facts, new_facts)
+        reportfiles.remove(path)
+        reportfiles.clear_sections(path)
+        for section in set(sources) - set(stale):
+            reportfiles.write_section(path, section, report.get(section), sources[section])
+    return stale
+
+
+# -------------------------------
+# Revision
+# -------------------------------
+def apply_revision(file_id, chunks, images, retriever, provider="openai", strategy=None, progress=None):
+    """Bring document `file_id` in line with its revised, partitioned content.
+
+    Kept chunks keep the vectors they have; if those were built with
+    another strategy, the registry records `vectorStoring.MIXED`.
+
+    Returns `{"kept", "added", "removed", "staleSections"}`.
+    """
+    from stores import get_registry
+    from vectorStoring import MIXED, store_chunks
+
+    registry = get_registry()
+    vectorstore = retriever.vectorstore
+    old_facts = registry.facts(file_id)
+    old_strategy = (registry.get(file_id) or {}).get("strategy")
+    stored = stored_chunks(vectorstore, file_id)
+
+    with metrics.track("revision", provider=provider):
+        # store_chunks writes the sidecars of the tables the revision still has
+        rowslices.clear(file_id)
+        added, _ = store_chunks(
+            chunks, images, retriever, provider=provider, file_id=file_id, progress=progress,
+            strategy=strategy, existing=set(stored),
+        )
+        current = {fingerprint(content) for content in _contents(chunks, images)}
+        gone = [key for key in stored if key not in current]
+        removed = _remove(retriever, stored, gone)
+        stale = invalidate_report(file_id, vectorstore, old_facts, registry.facts(file_id))
+
+    delta = {
+        "kept": sum(len(stored[key]) for key in stored if key in current),
+        "added": len(added),
+        "removed": removed,
+        "staleSections": stale,
+    }
+    if delta["kept"] and strategy and old_strategy != strategy:
+        registry.update(file_id, strategy=MIXED)
+    metrics.count("revision_chunks_added", delta["added"])
+    metrics.count("revision_chunks_removed", removed)
+    metrics.count("revision_stale_sections", len(stale))
+    print(f"Revision of {file_id}: {delta}")
+    return delta
+
+
+def _contents(chunks, images):
+    from vectorStoring import _content
+
+    for chunk in chunks:
+        if "Table" in str(type(chunk)) or "CompositeElement" in str(type(chunk)):
+            yield _content(chunk)
+    yield from images
+
+
+def record(file_id, delta):
+    """Store the outcome of a revision on the document's registry row."""
+    from stores import get_registry
+
+    registry = get_registry()
+    doc = registry.get(file_id) or {}
+    registry.update(
+        file_id, revision=(doc.get("revision") or 0) + 1, delta=json.dumps(delta), revised_at=time.time(),
+    )
@@ -0,0 +1,254 @@
+"""
+Row slices of large tables.
+
+`chunk_by_title` cuts a table at `CHUNKING["max_characters"]`, so a rent
+roll of a few hundred units arrives as a few 10k-character table chunks,
+each summarized into one paragraph: "unit 214, lease ends 06/2025" is in
+no embedding. `slice_tables` re-cuts every table longer than
+`DEALLENS_TABLE_SLICE_ROWS` rows at row boundaries (the `TableChunk`s
+of one table, which share a `table_id`, are joined first) into `Table` elements of
+that many rows, each with the header repeated in its HTML and text.
+
+Slices are embedded as they are, not summarized: a "Table rows 41-80 of
+400" line over `Header: value` rows, so a question about one unit or
+lease expiry retrieves the slice holding it. Every slice carries
+`table_id` (a digest of the table's header and rows), `row_slice` and
+`rows` in its metadata; table facts (tables.py) are read from the slices like
+from any other table chunk.
+
+The rows of each sliced table are also kept column by column in
+`DEALLENS_TABLE_DIR/<file_id>/<table_id>.json` (`write_sidecars`), read
+back with `read_table` (`GET /documents/{file_id}/tables/{table_id}`).
+"""
+
+import copy
+import hashlib
+import html
+import json
+import os
+import shutil
+
+import documents
+import storage
+import tables as table_engine
+from config import get_settings
+
+
+def _is_table(chunk):
+    return "Table" in str(type(chunk))
+
+
+def is_slice(chunk):
+    return getattr(getattr(chunk, "metadata", None), "row_slice", None) is not None
+
+
+# -------------------------------
+# Slicing
+# -------------------------------
+def _continues(run, chunk):
+    """True if `chunk` is the next `TableChunk` of the table in `run`."""
+    if not run or type(chunk).__name__ != "TableChunk":
+        return False
+    last = run[-1].metadata
+    table = getattr(chunk.metadata, "table_id", None)
+    return table is not None and table == getattr(last, "table_id", None) and (
+        getattr(chunk.metadata, "chunk_index", None) == (getattr(last, "chunk_index", None) or 0) + 1
+    )
+
+
+def _runs(chunks):
+    """Yield a list of the chunks of each table (one, or its `TableChunk`s), `(chunk,)` for the rest."""
+    run = []
+    for chunk in chunks:
+        if _is_table(chunk) and not is_slice(chunk):
+            if not _continues(run, chunk):
+                if run:
+                    yield run
+                run = []
+            run.append(chunk)
+            continue
+        if run:
+            yield run
+            run = []
+        yield (chunk,)
+    if run:
+        yield run
+
+
+def _rows(pieces):
+    """`(header, rows, pages)` of a table from its chunks; `pages` gives each row's page number.
+
+    Continuation chunks repeat the header rows (`num_carried_over_header_rows`),
+    which is also how many of the first chunk's rows are header when its
+    HTML has no `<th>`s.
+    """
+    carried = max(getattr(piece.metadata, "num_carried_over_header_rows", None) or 0 for piece in pieces)
+    header, rows, pages = [], [], []
+    for i, piece in enumerate(pieces):
+        parsed = table_engine.parse_html_table(getattr(piece.metadata, "text_as_html", None))
+        body = parsed.rows
+        if parsed.header:
+            header = header or parsed.header
+        elif i == 0 and carried:
+            header, body = (body[carried - 1] if len(body) >= carried else []), body[carried:]
+        elif i > 0:
+            body = body[getattr(piece.metadata, "num_carried_over_header_rows", None) or 0:]
+        rows.extend(body)
+        pages.extend([getattr(piece.metadata, "page_number", None)] * len(body))
+    return header, rows, pages
+
+
+def _bounds(n, size):
+    """`(start, end)` of each slice; a short last slice joins the one before."""
+    starts = list(range(0, n, size))
+    if len(starts) > 1 and n - starts[-1] < max(2, size // 4):
+        starts.pop()
+    return [(start, starts[i + 1] if i + 1 < len(starts) else n) for i, start in enumerate(starts)]
+
+
+def table_id(header, rows):
+    return hashlib.sha1(json.dumps([header, rows], ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _html(header, rows):
+    head = "".join(f"<th>{html.escape(cell)}</th>" for cell in header)
+    body = "".join("<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>" for row in rows)
+    return (f"<table><thead><tr>{head}</tr></thead>" if header else "<table>") + f"<tbody>{body}</tbody></table>"
+
+
+def _text(header, rows):
+    return "\n".join(" | ".join(row) for row in ([header] if header else []) + rows)
+
+
+def _slice(first, header, rows, page, tid, index, start, total):
+    from unstructured.documents.elements import Table
+
+    metadata = copy.copy(first.metadata)
+    metadata.text_as_html = _html(header, rows)
+    metadata.page_number = page
+    metadata.orig_elements = None
+    metadata.chunk_index = None
+    metadata.num_carried_over_header_rows = None
+    metadata.table_id = tid
+    metadata.row_slice = index
+    metadata.rows = f"{start + 1}-{start + len(rows)}"
+    metadata.table_rows = total
+    return Table(text=_text(header, rows), metadata=metadata)
+
+
+def slice_tables(chunks, max_rows=None):
+    """`chunks` with every table of more than `max_rows` rows (default
+    `DEALLENS_TABLE_SLICE_ROWS`, 0 = off) replaced by its row slices."""
+    max_rows = get_settings().table_slice_rows if max_rows is None else max_rows
+    if max_rows <= 0:
+        return list(chunks)
+    out = []
+    for run in _runs(chunks):
+        if not _is_table(run[0]):
+            out.extend(run)
+            continue
+        header, rows, pages = _rows(run)
+        if len(rows) <= max_rows:
+            out.extend(run)
+            continue
+        tid = table_id(header, rows)
+        out.extend(
+            _slice(run[0], header, rows[start:end], pages[start], tid, i, start, len(rows))
+            for i, (start, end) in enumerate(_bounds(len(rows), max_rows))
+        )
+    return out
+
+
+def describe(chunk):
+    """What is embedded for a slice: its place in the table, then one `Header: value` line per row."""
+    metadata = chunk.metadata
+    parsed = table_engine.parse_html_table(metadata.text_as_html)
+    caption = f"Table rows {metadata.rows} of {metadata.table_rows}"
+    if metadata.page_number:
+        caption += f" (page {metadata.page_number})"
+    lines = []
+    for row in parsed.rows:
+        names = parsed.header + [""] * (len(row) - len(parsed.header))
+        lines.append("; ".join(f"{name}: {cell}" if name else cell for name, cell in zip(names, row) if cell))
+    return "\n".join([caption] + lines)
+
+
+# -------------------------------
+# Sidecars
+# -------------------------------
+def _dir(file_id):
+    return os.path.join(get_settings().table_dir, file_id)
+
+
+def write_sidecars(file_id, slices):
+    """Store the rows of every sliced table among `slices`, column by column; returns the table_ids."""
+    by_table = {}
+    for chunk in sorted(slices, key=lambda c: (c.metadata.table_id, c.metadata.row_slice)):
+        parsed = table_engine.parse_html_table(chunk.metadata.text_as_html)
+        table = by_table.setdefault(chunk.metadata.table_id, {
+            "table_id": chunk.metadata.table_id,
+            "page_number": chunk.metadata.page_number,
+            "header": parsed.header,
+            "rows": 0,
+            "slices": [],
+            "columns": [[] for _ in parsed.header],
+        })
+        width = max([len(table["columns"])] + [len(row) for row in parsed.rows])
+        table["columns"].extend([None] * table["rows"] for _ in range(width - len(table["columns"])))
+        for row in parsed.rows:
+            for i, column in enumerate(table["columns"]):
+                column.append(row[i] if i < len(row) else None)
+        table["slices"].append({"rows": chunk.metadata.rows, "page_number": chunk.metadata.page_number})
+        table["rows"] += len(parsed.rows)
+    if by_table:
+        os.makedirs(_dir(file_id), exist_ok=True)
+    for tid, table in by_table.items():
+        storage.atomic_write_json(os.path.join(_dir(file_id), f"{tid}.json"), table)
+    return list(by_table)
+
+
+def clear(file_id):
+    """Remove the sidecars of `file_id`; True if there were any."""
+    path = _dir(file_id)
+    if not os.path.isdir(path):
+        return False
+    shutil.rmtree(path, ignore_errors=True)
+    return True
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def list_tables(file_id):
+    """`[{"table_id", "page_number", "header", "rows", "slices"}]` of the sliced tables of `file_id`."""
+    if not documents.FILE_ID.fullmatch(file_id):
+        return []
+    path = _dir(file_id)
+    if not os.path.isdir(path):
+        return []
+    out = []
+    for name in sorted(os.listdir(path)):
+        table = _load(os.path.join(path, name)) if name.endswith(".json") else None
+        if table is not None:
+            table.pop("columns", None)
+            out.append(table)
+    return sorted(out, key=lambda t: (t["page_number"] or 0, t["table_id"]))
+
+
+def read_table(file_id, tid, offset=0, limit=None):
+    """The sidecar of table `tid` with `limit` rows from `offset` (all by default), or None."""
+    # both end up in the path
+    if not documents.FILE_ID.fullmatch(file_id) or not tid or not all(c in "0123456789abcdef" for c in tid):
+        return None
+    table = _load(os.path.join(_dir(file_id), f"{tid}.json"))
+    if table is None:
+        return None
+    end = None if limit is None else offset + limit
+    table["columns"] = [column[offset:end] for column in table["columns"]]
+    table["offset"] = offset
+    return table
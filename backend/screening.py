@@ -0,0 +1,335 @@
+"""
+Columnar index of extracted report fields, for screening deals.
+
+Every scalar field of the section schemas (schema.json) is one typed
+column of the `deals` table, named by its path (`financial_summary.cap_rate`
+is column `financial_summary__cap_rate`); numeric columns are indexed.
+Arrays of objects (comparables, rent roll unit types, ...) get a child
+table each, one row per item, and arrays of strings or free-form objects
+are kept as JSON text. New schema fields become new columns on open.
+
+Rows are written whenever a report is written (reportfiles.write) and
+dropped when it is removed, so screening never opens report files:
+
+    GET /deals/screen?where=financial_summary.cap_rate>=6&where=property_details.unit_count>50
+                     &sort=-financial_summary.asking_price&limit=50
+
+A condition on a child-table field (`comparables.comparables.price<2000000`)
+matches deals with at least one such item. `python screening.py --rebuild`
+indexes the reports already on disk.
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import get_settings
+
+SQL_TYPES = {"integer": "INTEGER", "number": "REAL", "boolean": "INTEGER", "string": "TEXT"}
+NUMERIC = ("INTEGER", "REAL")
+SEPARATOR = "__"
+
+# returned when no `fields` are asked for
+DEFAULT_FIELDS = (
+    "property_details.property_name",
+    "property_details.address",
+    "property_details.unit_count",
+    "property_details.year_built",
+    "financial_summary.asking_price",
+    "financial_summary.cap_rate",
+    "financial_summary.financials_actual.net_operating_income",
+)
+
+_CONDITION = re.compile(r"^\s*([A-Za-z0-9_.]+)\s*(>=|<=|!=|=|>|<|~)\s*(.*?)\s*$")
+_OPERATORS = {">=": ">=", "<=": "<=", "!=": "!=", "=": "=", ">": ">", "<": "<", "~": "LIKE"}
+_NUMBER_JUNK = re.compile(r"[$,%\s]")
+_REPORT_NAME = re.compile(r"^(.+)_report\.json$")
+
+
+def file_id_of(report_path):
+    """`file_id` of a `<file_id>_report.json` path (None for other files)."""
+    match = _REPORT_NAME.match(os.path.basename(report_path))
+    return match.group(1) if match else None
+
+
+# -------------------------------
+# Layout from the schemas
+# -------------------------------
+def _scalar_type(schema):
+    types = schema.get("type")
+    types = [t for t in (types if isinstance(types, list) else [types]) if t != "null"]
+    return SQL_TYPES.get(types[0]) if len(types) == 1 else None
+
+
+def layout(schemas):
+    """`(columns, tables)`: `{path: sql type}` of the deal row and `{array path: {item path: type}}`."""
+    columns, tables = {}, {}
+
+    def walk(schema, path, into):
+        kind = schema.get("type")
+        if kind == "object" and schema.get("properties"):
+            for name, sub in schema["properties"].items():
+                walk(sub, path + (name,), into)
+        elif kind == "array" and (schema.get("items") or {}).get("type") == "object" and into is columns:
+            tables[".".join(path)] = item = {}
+            walk(schema["items"], (), item)
+        else:
+            into[".".join(path)] = _scalar_type(schema) or "TEXT"
+
+    for section, schema in schemas.items():
+        walk(schema, (section,), columns)
+    return columns, tables
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+def _column(path):
+    """Quoted column of field `path`."""
+    return _quote(path.replace(".", SEPARATOR))
+
+
+def _table_name(array):
+    return "items" + SEPARATOR + array.replace(".", SEPARATOR)
+
+
+def _coerce(value, sql_type):
+    if value is None:
+        return None
+    if sql_type == "TEXT":
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        # LLM output sometimes formats figures ("$1,250,000", "6.5%")
+        number = float(_NUMBER_JUNK.sub("", str(value)))
+    except ValueError:
+        return None
+    return int(number) if sql_type == "INTEGER" and number.is_integer() else number
+
+
+def _lookup(data, path):
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+# -------------------------------
+# Index
+# -------------------------------
+class ScreeningIndex:
+    def __init__(self, path, schemas):
+        self.path = path
+        self.columns, self.tables = layout(schemas)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            self._ensure("deals", {"file_id": "TEXT PRIMARY KEY", "filename": "TEXT", "indexed_at": "REAL"},
+                         self.columns, conn)
+            for array, item in self.tables.items():
+                table = _table_name(array)
+                self._ensure(table, {"file_id": "TEXT", "position": "INTEGER"}, item, conn)
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {_quote(table + '__file_id')} ON {_quote(table)} (file_id)")
+
+    @staticmethod
+    def _ensure(table, keys, columns, conn):
+        """Create `table` or add its missing columns; numeric columns get an index."""
+        wanted = {**keys, **{path.replace(".", SEPARATOR): typ for path, typ in columns.items()}}
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(table)} ("
+            + ", ".join(f"{_quote(name)} {typ}" for name, typ in wanted.items())
+            + ")"
+        )
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({_quote(table)})")}
+        for name, typ in wanted.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(name)} {typ}")
+            if typ in NUMERIC:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {_quote(table + SEPARATOR + name)} ON {_quote(table)} ({_quote(name)})"
+                )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------------------
+    # Writes
+    # -------------------------------
+    def put(self, file_id, report, filename=None):
+        """Replace the indexed fields of `file_id` with those of `report`."""
+        row = {"file_id": file_id, "filename": filename, "indexed_at": time.time()}
+        row.update((p.replace(".", SEPARATOR), _coerce(_lookup(report, p), t)) for p, t in self.columns.items())
+        names = ", ".join(_quote(name) for name in row)
+        with self._conn() as conn:
+            self._delete(file_id, conn)
+            conn.execute(f"INSERT INTO deals ({names}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+            for array, item in self.tables.items():
+                entries = _lookup(report, array)
+                if not isinstance(entries, list):
+                    continue
+                cols = ", ".join(["file_id", "position"] + [_column(p) for p in item])
+                conn.executemany(
+                    f"INSERT INTO {_quote(_table_name(array))} ({cols}) VALUES ({', '.join('?' * (len(item) + 2))})",
+                    [
+                        [file_id, position] + [_coerce(_lookup(entry, p), t) for p, t in item.items()]
+                        for position, entry in enumerate(entries) if isinstance(entry, dict)
+                    ],
+                )
+
+    def _delete(self, file_id, conn):
+        conn.execute("DELETE FROM deals WHERE file_id = ?", (file_id,))
+        for array in self.tables:
+            conn.execute(f"DELETE FROM {_quote(_table_name(array))} WHERE file_id = ?", (file_id,))
+
+    def delete(self, file_id):
+        with self._conn() as conn:
+            self._delete(file_id, conn)
+
+    # -------------------------------
+    # Screening
+    # -------------------------------
+    def _field(self, name):
+        """SQL for field `name`: (expression on the deal row, child table or None, sql type)."""
+        if name in self.columns:
+            return _column(name), None, self.columns[name]
+        for array, item in self.tables.items():
+            if name.startswith(array + ".") and name[len(array) + 1:] in item:
+                sub = name[len(array) + 1:]
+                return _column(sub), array, item[sub]
+        raise ValueError(f"Unknown field: {name}")
+
+    def _condition(self, text):
+        match = _CONDITION.match(text)
+        if not match:
+            raise ValueError(f"Bad condition: {text!r} (expected <field><op><value>, op one of {', '.join(_OPERATORS)})")
+        name, op, raw = match.groups()
+        column, array, sql_type = self._field(name)
+        if op == "~":
+            value = f"%{raw}%"
+        elif sql_type in NUMERIC:
+            value = _coerce(raw, sql_type)
+            if value is None:
+                raise ValueError(f"{name} is numeric, got {raw!r}")
+        else:
+            value = raw
+        if array is None:
+            return f"{column} {_OPERATORS[op]} ?", value
+        return (
+            f"EXISTS (SELECT 1 FROM {_quote(_table_name(array))} i WHERE i.file_id = deals.file_id "
+            f"AND i.{column} {_OPERATORS[op]} ?)"
+        ), value
+
+    def screen(self, where=(), sort=(), fields=None, limit=50, offset=0):
+        """`{"total", "deals"}` matching every condition in `where`.
+
+        Conditions look like `financial_summary.cap_rate>=6` (ops: = != > >= < <=,
+        and ~ for "contains"); `sort` fields take a leading "-" for descending
+        (missing values last). Raises ValueError for unknown fields.
+        """
+        clauses, params = [], []
+        for text in where:
+            clause, value = self._condition(text)
+            clauses.append(clause)
+            params.append(value)
+        order = []
+        for name in sort:
+            descending = name.startswith("-")
+            column, array, _ = self._field(name.lstrip("-+"))
+            if array is not None:
+                raise ValueError(f"Cannot sort by list field {name}")
+            order.append(f"{column} IS NULL, {column} {'DESC' if descending else 'ASC'}")
+        fields = list(fields or DEFAULT_FIELDS)
+        for name in fields:
+            if self._field(name)[1] is not None:
+                raise ValueError(f"Cannot return list field {name}")
+
+        sql_where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM deals{sql_where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT file_id, filename, {', '.join(_column(n) for n in fields)} FROM deals{sql_where} "
+            f"ORDER BY {', '.join(order + ['file_id'])} LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)],
+        )
+        deals = [
+            {"fileId": row[0], "filename": row[1], **{name: row[i + 2] for i, name in enumerate(fields)}}
+            for row in rows
+        ]
+        return {"total": total, "deals": deals}
+
+    def fields(self):
+        """`{field: sql type}` of every screenable field."""
+        out = dict(self.columns)
+        for array, item in self.tables.items():
+            out.update((f"{array}.{path}", typ) for path, typ in item.items())
+        return out
+
+
+# -------------------------------
+# Report hooks
+# -------------------------------
+def get_index():
+    from stores import get_screening_index
+
+    return get_screening_index()
+
+
+def report_written(report_path, report):
+    """Index a report just written to `report_path` (reportfiles.write)."""
+    file_id = file_id_of(report_path)
+    if file_id is None:
+        return
+    from stores import get_registry
+
+    doc = get_registry().get(file_id) or {}
+    get_index().put(file_id, report, doc.get("filename"))
+
+
+def report_removed(report_path):
+    file_id = file_id_of(report_path)
+    if file_id is not None:
+        get_index().delete(file_id)
+
+
+def rebuild():
+    """Index every report in the report directory; returns how many."""
+    import reportfiles
+
+    report_dir = get_settings().report_dir
+    count = 0
+    for name in sorted(os.listdir(report_dir)):
+        path = os.path.join(report_dir, name)
+        if file_id_of(path) is None:
+            continue
+        report = reportfiles.read(path)
+        if report is not None:
+            report_written(path, report)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="index the reports already on disk")
+    args = parser.parse_args(argv)
+    if args.rebuild:
+        print(f"Indexed {rebuild()} reports")
+
+
+if __name__ == "__main__":
+    main()
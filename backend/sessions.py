@@ -0,0 +1,260 @@
+"""
+Server-side chat sessions for `/api/chat/{file_id}`.
+
+A session keeps, per document:
+
+- `context`: every chunk shown to the model so far, append-only (up to
+  `DEALLENS_CHAT_CONTEXT_CHUNKS`). The system text followed by this context
+  is a byte-stable prompt prefix across turns, which provider-side prompt
+  caching (e.g. OpenAI's automatic caching of long prefixes) can reuse.
+- `summary` + `turns`: the conversation. Once the turns exceed
+  `DEALLENS_CHAT_HISTORY_TOKENS` the oldest ones are folded into the
+  summary, keeping the last `DEALLENS_CHAT_KEEP_TURNS` messages verbatim.
+
+Prompt layout: system | document context | summary | turns | new question
+(with any chunks that did not fit the context and this turn's images).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import metrics
+from config import get_settings
+from llms import chat_model, llm_slot
+
+SYSTEM_PROMPT = (
+    "You are an analyst assistant for commercial real estate deals. Answer questions "
+    "based only on the document context below, which can include text, tables and images. "
+    "Use the conversation so far to resolve follow-up questions. If the answer is not in "
+    "the context, say so."
+)
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation about a real estate offering memorandum for use as "
+    "context in later turns. Keep every figure, year, name and open question; drop "
+    "pleasantries. Reply with the summary only."
+)
+
+# column -> SQL type; new columns are added to existing databases on open
+COLUMNS = {
+    "session_id": "TEXT PRIMARY KEY",
+    "file_id": "TEXT",
+    "context": "TEXT",  # JSON list of chunks, append-only
+    "summary": "TEXT",
+    "turns": "TEXT",  # JSON list of {"role", "content"}
+    "compactions": "INTEGER",
+    "created_at": "REAL",
+    "updated_at": "REAL",
+}
+
+
+def estimate_tokens(text):
+    return len(text) // 4
+
+
+class SessionStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                + ", ".join(f"{name} {typ}" for name, typ in COLUMNS.items())
+                + ")"
+            )
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+            for name, typ in COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {typ}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _decode(row):
+        if row is None:
+            return None
+        session = dict(row)
+        session["context"] = json.loads(session["context"] or "[]")
+        session["turns"] = json.loads(session["turns"] or "[]")
+        session["summary"] = session["summary"] or ""
+        return session
+
+    def create(self, file_id):
+        now = time.time()
+        session_id = str(uuid.uuid4())
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, file_id, context, summary, turns, compactions, "
+                "created_at, updated_at) VALUES (?, ?, '[]', '', '[]', 0, ?, ?)",
+                (session_id, file_id, now, now),
+            )
+        return self.get(session_id)
+
+    def get(self, session_id):
+        row = self._conn().execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return self._decode(row)
+
+    def delete_file(self, file_id):
+        """Drop every chat session about `file_id`; returns how many there were."""
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM sessions WHERE file_id = ?", (file_id,)).rowcount
+
+    def last_used(self):
+        """`{file_id: time of the latest chat turn}`."""
+        rows = self._conn().execute("SELECT file_id, MAX(updated_at) FROM sessions GROUP BY file_id")
+        return {file_id: updated_at for file_id, updated_at in rows}
+
+    def record_turn(self, session_id, question, answer, context=()):
+        """Append one exchange (and newly pinned context) to the stored session."""
+        conn = self._conn()
+        with conn:
+            # Re-read inside the write transaction so concurrent turns both land
+            conn.execute("BEGIN IMMEDIATE")
+            session = self._decode(
+                conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            )
+            pinned = session["context"] + [c for c in context if c not in session["context"]]
+            turns = session["turns"] + [
+                {"role": "user", "content": question},
+                {"role": "assistant", "content": answer},
+            ]
+            conn.execute(
+                "UPDATE sessions SET context = ?, turns = ?, updated_at = ? WHERE session_id = ?",
+                (json.dumps(pinned), json.dumps(turns), time.time(), session_id),
+            )
+
+    def compact(self, session_id, count, summary, compactions):
+        """Replace the first `count` turns with `summary`.
+
+        `compactions` is the value read before summarizing; if another
+        compaction has landed since, this one is dropped.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            session = self._decode(
+                conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            )
+            if session is None or session["compactions"] != compactions:
+                return False
+            conn.execute(
+                "UPDATE sessions SET summary = ?, turns = ?, compactions = ?, updated_at = ? "
+                "WHERE session_id = ?",
+                (summary, json.dumps(session["turns"][count:]), compactions + 1, time.time(), session_id),
+            )
+        return True
+
+
+# -------------------------------
+# Prompt
+# -------------------------------
+def history_tokens(session):
+    return estimate_tokens(session["summary"]) + sum(estimate_tokens(t["content"]) for t in session["turns"])
+
+
+def build_messages(session, question, context, extra_texts=(), images=(), llm_provider="openai"):
+    """Messages for one turn; everything before the summary is stable across turns."""
+    from noPklRetrieval import image_block
+
+    messages = [SystemMessage(content=SYSTEM_PROMPT)]
+    if context:
+        messages.append(HumanMessage(content="Document context:\n" + "\n\n".join(map(str, context))))
+    if session["summary"]:
+        messages.append(HumanMessage(content=f"Summary of the conversation so far:\n{session['summary']}"))
+    for turn in session["turns"]:
+        cls = HumanMessage if turn["role"] == "user" else AIMessage
+        messages.append(cls(content=turn["content"]))
+
+    content = []
+    if extra_texts:
+        content.append({"type": "text", "text": "More context:\n" + "\n\n".join(map(str, extra_texts))})
+    for img_b64 in images:
+        metrics.image_bytes(img_b64)
+        content.append(image_block(img_b64, llm_provider))
+    content.append({"type": "text", "text": f"Question: {question}"})
+    messages.append(HumanMessage(content=content))
+    return messages
+
+
+# -------------------------------
+# Turns
+# -------------------------------
+def _invoke(messages, llm_provider):
+    llm = chat_model(llm_provider)
+    for attempt in range(2):
+        try:
+            if attempt:
+                metrics.retry()
+            with llm_slot():
+                return llm.invoke(messages)
+        except Exception as e:
+            print(f"Attempt {attempt+1} failed: {e}")
+            if attempt == 0:
+                print("Retrying in 60s...")
+                time.sleep(60)
+    raise RuntimeError("All retries failed.")
+
+
+def ask(session, question, vectorstore, llm_provider="openai", diagnostics=None):
+    """Answer `question` within `session` and record the exchange."""
+    from noPklRetrieval import retrieve
+
+    settings = get_settings()
+    with metrics.track("chat", provider=llm_provider):
+        # Follow-ups ("and 2020?") are retrieved together with the previous question
+        previous = [t["content"] for t in session["turns"] if t["role"] == "user"][-1:]
+        texts, images = retrieve(
+            "\n".join(previous + [question]), vectorstore,
+            diagnostics=diagnostics, file_id=session["file_id"],
+        )
+
+        fresh = [t for t in texts if t not in session["context"]]
+        room = max(0, settings.chat_context_chunks - len(session["context"]))
+        pinned, extra = fresh[:room], fresh[room:]
+
+        messages = build_messages(
+            session, question, session["context"] + pinned, extra, images, llm_provider
+        )
+        answer = _invoke(messages, llm_provider)
+
+    from stores import get_sessions
+
+    get_sessions().record_turn(session["session_id"], question, answer.content, pinned)
+    return answer
+
+
+def compact_if_needed(session_id, llm_provider="openai"):
+    """Fold the oldest turns into the summary once the history is over budget."""
+    from stores import get_sessions
+
+    settings = get_settings()
+    store = get_sessions()
+    session = store.get(session_id)
+    if session is None or history_tokens(session) <= settings.chat_history_tokens:
+        return
+    count = len(session["turns"]) - settings.chat_keep_turns
+    count -= count % 2  # whole exchanges
+    if count <= 0:
+        return
+
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in session["turns"][:count])
+    if session["summary"]:
+        transcript = f"Earlier summary:\n{session['summary']}\n\n{transcript}"
+    with metrics.track("chat_summary", provider=llm_provider):
+        summary = _invoke([SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=transcript)], llm_provider)
+    if store.compact(session_id, count, summary.content, session["compactions"]):
+        print(f"Summarized {count} turns of chat session {session_id}")
@@ -0,0 +1,106 @@
+"""
+Disk spool for image payloads during windowed ingestion.
+
+hi_res partitioning puts every extracted image into the element metadata
+as base64, and chunking copies those elements into each chunk's
+`orig_elements`. For photo-heavy memoranda that is most of a worker's
+memory. `spill_images` writes each payload to a per-ingest spool directory
+as soon as a window is partitioned, leaves a `SpooledImage` reference in
+its place and drops `orig_elements`; the payload is read back only for the
+window being summarized and stored.
+"""
+
+import base64
+import gc
+import os
+import shutil
+import tempfile
+
+
+def rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def release(collect=False):
+    """Hand freed heap back to the OS where possible (after a full GC with `collect`)."""
+    if collect:
+        gc.collect()
+    try:
+        import ctypes
+
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class SpooledImage:
+    """An image payload on disk; `read()` returns its base64 text."""
+
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return base64.b64encode(f.read()).decode("ascii")
+
+
+def load(image):
+    """Base64 text of an image given as base64 text or a `SpooledImage`."""
+    return image.read() if isinstance(image, SpooledImage) else image
+
+
+class Spool:
+    """Temporary directory for one ingestion's images, removed on exit."""
+
+    def __init__(self, root):
+        self.root = root
+        self.directory = None
+        self._count = 0
+
+    def __enter__(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.directory = tempfile.mkdtemp(dir=self.root, prefix="ingest-")
+        return self
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def put(self, image_b64):
+        self._count += 1
+        path = os.path.join(self.directory, f"{self._count:06d}.img")
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(image_b64))
+        return SpooledImage(path)
+
+
+def spill_images(chunks, spool):
+    """Move the chunks' image payloads to `spool`; returns their `SpooledImage`s in order.
+
+    Same images, same order as `vectorStoring.get_images_base64`. The
+    chunks' `orig_elements` are dropped afterwards (nothing downstream of
+    chunking reads them).
+    """
+    images = []
+    for chunk in chunks:
+        if "CompositeElement" in str(type(chunk)):
+            for el in chunk.metadata.orig_elements or []:
+                if "Image" in str(type(el)) and el.metadata.image_base64:
+                    images.append(spool.put(el.metadata.image_base64))
+                    el.metadata.image_base64 = None
+        chunk.metadata.orig_elements = None
+    return images
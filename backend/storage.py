@@ -0,0 +1,131 @@
+"""
+File primitives that are safe with several worker processes on one host.
+
+- `atomic_write_*` write to a temp file in the target directory and
+  `os.replace` it into place, so readers see either the old or the new
+  file, never a torn one.
+- `file_lock` is an advisory `flock` on a sidecar `<path>.lock` file.
+- `bump` / `Watcher` implement a cheap change notification: writers touch
+  a stamp file, readers compare its mtime (one `stat` per check) and
+  refresh their in-process state when it moved.
+"""
+
+import fcntl
+import json
+import os
+import pickle
+import tempfile
+import time
+from contextlib import contextmanager
+
+from config import get_settings
+
+
+# -------------------------------
+# Atomic writes
+# -------------------------------
+@contextmanager
+def atomic_open(path):
+    """Binary file whose content replaces `path` in one step when the block exits cleanly."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def atomic_write_bytes(path, data):
+    with atomic_open(path) as f:
+        f.write(data)
+
+
+def atomic_write_json(path, obj, **dump_kwargs):
+    dump_kwargs.setdefault("ensure_ascii", False)
+    atomic_write_bytes(path, json.dumps(obj, **dump_kwargs).encode("utf-8"))
+
+
+def atomic_write_pickle(path, obj):
+    atomic_write_bytes(path, pickle.dumps(obj))
+
+
+def atomic_copy_stream(path, stream, chunk_size=1 << 20):
+    """Copy a file-like object to `path` without exposing a partial file."""
+    with atomic_open(path) as f:
+        while True:
+            block = stream.read(chunk_size)
+            if not block:
+                break
+            f.write(block)
+
+
+# -------------------------------
+# Locking
+# -------------------------------
+@contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock for `path` (exclusive unless `shared`)."""
+    lock_path = f"{path}.lock"
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# -------------------------------
+# Change notification
+# -------------------------------
+def _stamp_path(name):
+    return os.path.join(get_settings().state_dir, f"{name}.generation")
+
+
+# name -> (stamp before, stamp after) of this process's last bump
+_own_bumps = {}
+
+
+def _read_stamp(name):
+    try:
+        return os.stat(_stamp_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump(name):
+    """Tell every other worker that shared state `name` changed."""
+    path = _stamp_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    before = _read_stamp(name)
+    with open(path, "a"):
+        pass
+    now = time.time_ns()
+    os.utime(path, ns=(now, now))
+    _own_bumps[name] = (before, _read_stamp(name))
+
+
+class Watcher:
+    """Reports whether `bump(name)` was called by another process since the last check.
+
+    A bump of this process's own, with nothing from elsewhere before it, does not count.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._seen = _read_stamp(name)
+
+    def changed(self):
+        stamp = _read_stamp(self.name)
+        if stamp == self._seen:
+            return False
+        # our own bump, made while the stamp was still the one last seen here
+        own = _own_bumps.get(self.name) == (self._seen, stamp)
+        self._seen = stamp
+        return not own
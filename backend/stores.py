@@ -0,0 +1,170 @@
+"""
+Process-wide shared stores, created on first use.
+
+Each worker holds exactly one vectorstore client (Chroma, or the
+memory-mapped index in vectorindex.py with `DEALLENS_VECTOR_BACKEND=memmap`);
+routes get it (and the summary mapping) through FastAPI dependencies instead
+of module globals, so importing the app does not open Chroma or build an
+embedding client.
+
+With several workers (`DEALLENS_WORKERS` > 1) writers bump the
+`vectorstore` generation after adding vectors, and every other worker reopens its
+client the next time it notices the stamp moved.
+"""
+
+import os
+import threading
+import uuid
+import weakref
+from functools import lru_cache
+
+import storage
+from config import get_settings
+from llms import embedding_model
+
+
+# lru_cache does not stop two threads (e.g. bulk ingestion) building a client at once
+_open_lock = threading.RLock()
+
+
+@lru_cache(maxsize=None)
+def _open_vectorstore():
+    settings = get_settings()
+    if settings.vector_backend == "memmap":
+        from vectorindex import MemmapVectorStore
+
+        return MemmapVectorStore(
+            settings.memmap_dir,
+            embedding_model(settings.embedding_provider),
+            hnsw_threshold=settings.hnsw_threshold,
+            dim=settings.vector_dim,
+            dtype=settings.vector_dtype,
+            rescore=settings.vector_rescore,
+            rescore_factor=settings.rescore_factor,
+        )
+    if settings.vector_backend != "chroma":
+        raise ValueError(f"Unsupported vector backend: {settings.vector_backend}")
+
+    from langchain_chroma import Chroma
+
+    vectorstore = Chroma(
+        persist_directory=settings.vectorstore_dir,
+        collection_name=settings.collection_name,
+        embedding_function=embedding_model(settings.embedding_provider),
+    )
+    _stop_when_released(vectorstore)
+    return vectorstore
+
+
+def _stop_when_released(vectorstore):
+    """Stop the Chroma system behind `vectorstore` once nothing holds the vectorstore any more.
+
+    A reopen only drops the cached client: requests, summary threads and
+    batch stores that still hold the old one keep using it until they finish.
+    """
+    from chromadb.api.client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.get(vectorstore._client._identifier)
+    if system is not None:
+        weakref.finalize(vectorstore, _stop_system, system)
+
+
+def _stop_system(system):
+    try:
+        system.stop()
+    except Exception as e:
+        print(f"Stopping a released Chroma client failed: {e}")
+
+
+@lru_cache(maxsize=None)
+def _watcher(name):
+    return storage.Watcher(name)
+
+
+def _drop_vectorstore():
+    _open_vectorstore.cache_clear()
+    try:
+        # Chroma caches one client per path; drop it so the next open re-reads disk.
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return
+    # the old system is stopped by `_stop_when_released`, not here
+    SharedSystemClient.clear_system_cache()
+
+
+def get_vectorstore():
+    with _open_lock:
+        if get_settings().multiprocess and _watcher("vectorstore").changed():
+            print("vectorstore changed in another worker, reopening")
+            _drop_vectorstore()
+        return _open_vectorstore()
+
+
+def vectorstore_write_lock():
+    """Serializes vectorstore writes across worker processes."""
+    return storage.file_lock(os.path.join(get_settings().state_dir, "vectorstore"))
+
+
+def embed_documents(vectorstore, docs):
+    """Embeddings of `docs`; computed before taking `vectorstore_write_lock`, never under it."""
+    return vectorstore.embeddings.embed_documents([doc.page_content for doc in docs]) if docs else []
+
+
+def add_embedded(vectorstore, docs, embeddings, ids=None):
+    """Write `docs` with their precomputed `embeddings` (under `vectorstore_write_lock`); returns the ids."""
+    if not docs:
+        return []
+    ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in docs]
+    texts = [doc.page_content for doc in docs]
+    metadatas = [doc.metadata for doc in docs]
+    if hasattr(vectorstore, "add_embeddings"):
+        return vectorstore.add_embeddings(texts, embeddings, metadatas, ids)
+    # langchain_chroma has no add-with-embeddings; this is what its add_texts does after embedding
+    vectorstore._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts)
+    return ids
+
+
+@lru_cache(maxsize=None)
+def get_chunk_store():
+    from chunkstore import open_chunk_store
+
+    settings = get_settings()
+    return open_chunk_store(settings.chunk_store_path, legacy_pickle=settings.mapping_path)
+
+
+def get_summary_to_chunk():
+    # SQLite-backed, so every read is fresh no matter which worker wrote it
+    return get_chunk_store()
+
+
+def get_retriever():
+    """MultiVectorRetriever over the shared vectorstore and chunk store."""
+    from langchain.retrievers.multi_vector import MultiVectorRetriever
+
+    return MultiVectorRetriever(vectorstore=get_vectorstore(), docstore=get_chunk_store(), id_key="doc_id")
+
+
+@lru_cache(maxsize=None)
+def get_registry():
+    from documents import DocumentRegistry
+
+    settings = get_settings()
+    registry = DocumentRegistry(settings.documents_path)
+    # uploads and reports from before the registry would otherwise look like orphans to cleanup.py
+    registry.backfill(settings.upload_dir, settings.report_dir)
+    return registry
+
+
+@lru_cache(maxsize=None)
+def get_sessions():
+    from sessions import SessionStore
+
+    return SessionStore(get_settings().sessions_path)
+
+
+@lru_cache(maxsize=None)
+def get_screening_index():
+    from reportMaker import section_schemas
+    from screening import ScreeningIndex
+
+    return ScreeningIndex(get_settings().screening_path, section_schemas())
@@ -1,8 +1,9 @@
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
+
+from llms import chat_model, limited, llm_slot
+import metrics
 
 # Helper to convert images to base64
 def convert_image(img):
@@ -24,36 +25,22 @@ def summariesData(texts, tables, provider="openai"):
     Table or text chunk: {element}
     """
 
-    if provider == "gemini":
-        from langchain_google_genai import ChatGoogleGenerativeAI
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2
-        )
-        prompt = ChatPromptTemplate.from_template(prompt_text)
-    elif provider == "openai":
-        from langchain_openai import ChatOpenAI
-        model = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0,
-            max_retries=2,
-            # Use environment variables for keys in real code
-        )
-        prompt = ChatPromptTemplate.from_template(prompt_text)
-    else:
-        raise ValueError("Provider must be 'openai' or 'gemini'")
-    
-    summarize_chain = {"element": lambda x: x} | prompt | model | StrOutputParser()
+    model = chat_model(provider)
+    prompt = ChatPromptTemplate.from_template(prompt_text)
+
+    # `limited` keeps concurrent batches (e.g. bulk ingestion) under the global LLM cap
+    summarize_chain = {"element": lambda x: x} | prompt | limited(model) | StrOutputParser()
 
-    # Summarize text
-    text_summaries = summarize_chain.batch(texts, {"max_concurrency": 3})
+    with metrics.track("summariesData", provider=provider):
+        metrics.count("texts", len(texts))
+        metrics.count("tables", len(tables))
 
-    # Summarize tables (as HTML text metadata)
-    tables_html = [table.metadata.text_as_html for table in tables]
-    table_summaries = summarize_chain.batch(tables_html, {"max_concurrency": 3})
+        # Summarize text
+        text_summaries = summarize_chain.batch(texts, {"max_concurrency": 3})
+
+        # Summarize tables (as HTML text metadata)
+        tables_html = [table.metadata.text_as_html for table in tables]
+        table_summaries = summarize_chain.batch(tables_html, {"max_concurrency": 3})
 
     return text_summaries, table_summaries
 
@@ -167,10 +154,8 @@ def summariesData(texts, tables, provider="openai"):
 
 
 import base64
-from PIL import Image
 import io
-import pillow_avif  # Enables PIL to open AVIF files
-from langchain.schema import HumanMessage
+from langchain_core.messages import HumanMessage
 
 def convert_image(file_path):
     """
@@ -178,6 +163,9 @@ def convert_image(file_path):
     the Base64-encoded string WITHOUT the data URI prefix.
     """
     if isinstance(file_path, str):
+        from PIL import Image
+        import pillow_avif  # Enables PIL to open AVIF files
+
         try:
             with Image.open(file_path) as img:
                 buffer = io.BytesIO()
@@ -194,32 +182,14 @@ def convert_image(file_path):
         return {"error": "Invalid input: expected file path."}
 
 def summariesImages(images, provider="openai"):
-    if provider == "gemini":
-        from langchain_google_genai import ChatGoogleGenerativeAI
-
-        model = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-        )
+    model = chat_model(provider)
 
+    if provider == "gemini":
         def format_image(image):
             # Gemini expects data URI in url field, base64 part only
             return {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}}
 
-    elif provider == "openai":
-        from langchain_openai import ChatOpenAI
-
-        model = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-        )
-
+    else:
         def format_image(image):
             # OpenAI expects base64 without prefix in data field
             return {
@@ -229,9 +199,6 @@ def summariesImages(images, provider="openai"):
                 "mime_type": "image/png",
             }
 
-    else:
-        raise ValueError("Provider must be 'openai' or 'gemini'")
-
     print(f"summaries of images with {provider}")
 
     prompt_text = (
@@ -241,15 +208,19 @@ def summariesImages(images, provider="openai"):
 
     image_summaries = []
 
-    for img_b64 in images:
-        message_content = [
-            {"type": "text", "text": prompt_text},
-            format_image(img_b64),
-        ]
-
-        message = HumanMessage(content=message_content)
-        result = model.invoke([message])
-        image_summaries.append(result)
+    with metrics.track("summariesImages", provider=provider):
+        metrics.count("images", len(images))
+        for img_b64 in images:
+            message_content = [
+                {"type": "text", "text": prompt_text},
+                format_image(img_b64),
+            ]
+
+            message = HumanMessage(content=message_content)
+            metrics.image_bytes(img_b64)
+            with llm_slot():
+                result = model.invoke([message])
+            image_summaries.append(result)
 
     print("image summaries are done")
     return image_summaries
@@ -0,0 +1,434 @@
+"""
+Deterministic extraction of financial fields from parsed tables.
+
+`chunking()` gives every table chunk a `metadata.text_as_html`. At ingest
+each table is parsed into rows and columns, and rows whose label matches a
+common CRE line item (NOI, Cap Rate, Price/Unit, Gross Potential Rent, ...)
+become *facts*. `build_report` uses the facts to fill `financial_summary`
+and `modeling_data` directly and only asks the LLM for the fields that are
+still missing.
+"""
+
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+
+
+# -------------------------------
+# HTML -> rows
+# -------------------------------
+@dataclass
+class ParsedTable:
+    header: list = field(default_factory=list)
+    rows: list = field(default_factory=list)
+
+
+class _TableParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.header_rows = 0
+        self._row = None
+        self._cell = None
+        self._header_cells = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row, self._header_cells = [], 0
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+            self._header_cells += tag == "th"
+            colspan = dict(attrs).get("colspan") or "1"
+            self._span = int(colspan) if colspan.isdigit() else 1
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            text = " ".join("".join(self._cell).split())
+            self._row.extend([text] + [""] * (self._span - 1))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                if self._header_cells == len(self._row) and len(self.rows) == self.header_rows:
+                    self.header_rows += 1
+                self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_html_table(html):
+    parser = _TableParser()
+    parser.feed(html or "")
+    rows = parser.rows
+    header = rows[parser.header_rows - 1] if parser.header_rows else []
+    return ParsedTable(header=header, rows=rows[parser.header_rows:])
+
+
+# -------------------------------
+# Cell values
+# -------------------------------
+_NUMBER = re.compile(r"(\(?-?\$?\s*\d[\d,]*(?:\.\d+)?\)?)(?:\s*(%|k|million|mm|m|billion|b)(?![a-z]))?", re.I)
+_SCALE = {"k": 1e3, "m": 1e6, "mm": 1e6, "million": 1e6, "b": 1e9, "billion": 1e9}
+
+
+def parse_number(text):
+    """'$2,450,000' -> (2450000.0, False); '6.5%' -> (6.5, True); otherwise None.
+
+    Cells with more than one number ('5-10%', '$1.2M - $1.4M') are None too:
+    no single value is the fact, so it is left to the LLM.
+    """
+    if not text:
+        return None
+    text = text.replace("–", "-").replace("−", "-")
+    match = _NUMBER.search(text)
+    if not match or _NUMBER.search(text, match.end()):
+        return None
+    raw, suffix = match.group(1), (match.group(2) or "").lower()
+    negative = raw.startswith("(") and raw.endswith(")") or "-" in raw
+    value = float(re.sub(r"[^\d.]", "", raw))
+    if suffix in _SCALE:
+        value *= _SCALE[suffix]
+    return (-value if negative else value), suffix == "%"
+
+
+# -------------------------------
+# Labels
+# -------------------------------
+# (fact, pattern) in priority order; the first matching pattern wins
+LABELS = [
+    ("price_per_unit", r"\bprice\s*(?:/|per)\s*(?:unit|door)\b|\$\s*/\s*unit"),
+    ("price_per_sf", r"\bprice\s*(?:/|per)\s*(?:sf|sq\.?\s*ft|square\s*f(?:oo|ee)t)\b|\$\s*/\s*sf"),
+    ("asking_price", r"\b(?:asking|list(?:ing)?|offering|purchase|sale)\s*price\b|^price$"),
+    ("cap_rate", r"\bcap(?:italization)?\.?\s*rate\b"),
+    ("irr", r"\birr\b|internal\s*rate\s*of\s*return"),
+    ("net_operating_income", r"\bnet\s*operating\s*income\b|^noi\b|\bnoi$"),
+    ("effective_gross_income", r"\beffective\s*gross\s*(?:income|revenue)\b|^egi\b"),
+    ("gross_potential_rent", r"\bgross\s*(?:potential|scheduled)\s*(?:rent|income)\b|^gpr\b"
+                             r"|\bgross\s*rental\s*income\b|\bpotential\s*rental\s*income\b"),
+    ("vacancy", r"\bvacancy\b"),
+    ("total_expenses", r"\btotal\s*(?:operating\s*)?expenses\b|\btotal\s*opex\b|^operating\s*expenses$"),
+    ("property_taxes", r"\b(?:real\s*estate|property)\s*tax(?:es)?\b|^taxes$"),
+    ("insurance", r"\binsurance\b"),
+    ("maintenance", r"\b(?:repairs?\s*(?:&|and)\s*)?maintenance\b|\brepairs\b"),
+    ("assessed_value", r"\bassessed\s*value\b"),
+    ("units", r"^(?:total\s*|number\s*of\s*|no\.?\s*of\s*|#\s*of\s*)?units$|\bunit\s*count\b"),
+    ("total_square_feet", r"\b(?:total|rentable|gross|building)\s*(?:sf|sq\.?\s*ft|square\s*f(?:oo|ee)t)\b"
+                          r"|^rsf$|^gla$"),
+]
+_LABELS = [(fact, re.compile(pattern, re.I)) for fact, pattern in LABELS]
+
+# Line items that make up an operating expense breakdown
+EXPENSES = re.compile(
+    r"tax|insurance|maintenance|repairs|utilit|water|sewer|electric|gas|trash|management|payroll"
+    r"|salar|administrative|marketing|reserve|landscap|pest|turnover|legal|professional",
+    re.I,
+)
+
+# Column headers that mean "current / in-place" figures rather than pro forma
+_ACTUAL_COLUMN = re.compile(r"actual|current|in[\s-]*place|t-?12|trailing|historical|\b20\d\d\b", re.I)
+_PRO_FORMA_COLUMN = re.compile(r"pro\s*forma|projected|stabilized|budget|year\s*[2-9]", re.I)
+
+
+def match_label(label):
+    label = " ".join(re.sub(r"[:*]", " ", label or "").split())
+    for fact, pattern in _LABELS:
+        if pattern.search(label):
+            return fact
+    return None
+
+
+def _value_columns(table):
+    """Indexes of the columns to read values from, "actual" columns first."""
+    width = max((len(row) for row in table.rows), default=0)
+    columns = list(range(1, width))
+    if table.header:
+        actual = [i for i in columns if i < len(table.header) and _ACTUAL_COLUMN.search(table.header[i])]
+        other = [i for i in columns if i not in actual and not (
+            i < len(table.header) and _PRO_FORMA_COLUMN.search(table.header[i]))]
+        columns = actual + other
+    return columns
+
+
+def table_facts(html):
+    """Facts from one HTML table: {fact: {"value", "percent", "label"}} plus "expense_items"."""
+    table = parse_html_table(html)
+    facts = {}
+    expense_items = []
+
+    # Label / value rows (the common "Item | Amount" layout)
+    columns = _value_columns(table)
+    for row in table.rows:
+        if not row or not row[0]:
+            continue
+        parsed = next(
+            (parse_number(row[i]) for i in columns if i < len(row) and parse_number(row[i])), None
+        )
+        if parsed is None:
+            continue
+        value, percent = parsed
+        fact = match_label(row[0])
+        if fact == "vacancy" and percent:
+            fact = "vacancy_percentage"
+        if fact and fact not in facts:
+            facts[fact] = {"value": value, "percent": percent, "label": row[0]}
+        if fact == "vacancy" and "vacancy_percentage" not in facts:
+            # "Less: Vacancy (5%)" carries the rate in the label
+            rate = re.search(r"(\d+(?:\.\d+)?)\s*%", row[0])
+            if rate:
+                facts["vacancy_percentage"] = {"value": float(rate.group(1)), "percent": True, "label": row[0]}
+        if EXPENSES.search(row[0]) and not percent and fact != "total_expenses":
+            expense_items.append({"name": row[0], "amount": value})
+
+    # Header / single value row layout ("Price | Units | Cap Rate" over one row)
+    if table.header and len(table.rows) == 1:
+        for label, cell in zip(table.header, table.rows[0]):
+            fact, parsed = match_label(label), parse_number(cell)
+            if fact and parsed and fact not in facts:
+                facts[fact] = {"value": parsed[0], "percent": parsed[1], "label": label}
+
+    if expense_items:
+        facts["expense_items"] = expense_items
+    roll = rent_roll(table)
+    if roll:
+        facts["rent_roll"] = roll
+    return facts
+
+
+# -------------------------------
+# Rent rolls
+# -------------------------------
+# Header patterns of rent roll columns; "units" is the unit count of a unit mix row
+RENT_ROLL_HEADERS = {
+    "unit": r"^(?:unit|apt\.?|apartment|suite)\s*(?:#|no\.?|number|id)?$",
+    "bedrooms": r"\bbed(?:room)?s?\b|\bbr\b|unit\s*type|^type$|floor\s*plan|\bmix\b",
+    "units": r"^(?:#|no\.?|number)\s*(?:of\s*)?units$|^units$|^count$|^qty|^quantity$",
+    "sf": r"\bsf\b|sq\.?\s*ft|square\s*f(?:oo|ee)t|^size$|^rsf$",
+    "rent": r"rent",
+    "status": r"status|occupan|vacan",
+}
+_RENT_ROLL_HEADERS = {column: re.compile(pattern, re.I) for column, pattern in RENT_ROLL_HEADERS.items()}
+# rent columns that are not the in-place monthly rent
+_OTHER_RENT = re.compile(r"per\s*(?:sf|sq)|/\s*sf|psf|market|pro\s*forma|potential|deposit|concession", re.I)
+_TOTAL_ROW = re.compile(r"^\s*(?:total|totals|average|avg\.?|summary|subtotal)\b", re.I)
+_VACANT = re.compile(r"vacan|down|model|unrented", re.I)
+_OCCUPIED = re.compile(r"occupied|leased|current|notice|rented|mtm|month", re.I)
+_UNIT_COUNT = re.compile(r"(\d[\d,]*)\s*(?:units?|apts?\.?|apartments|homes)\b", re.I)
+
+
+def _rent_roll_columns(header):
+    """`{column: header index}` of a rent roll table, or None if it is not one."""
+    found = {}
+    for i, label in enumerate(header):
+        for column, pattern in _RENT_ROLL_HEADERS.items():
+            if column in found or not pattern.search(label):
+                continue
+            if column == "rent" and _OTHER_RENT.search(label):
+                continue
+            if column == "units" and "unit" in found:
+                continue
+            found[column] = i
+            break
+    if "rent" not in found or not ({"unit", "bedrooms", "units"} & set(found)):
+        return None
+    return found
+
+
+def _bedrooms(text):
+    if re.search(r"studio|\beff", text or "", re.I):
+        return 0
+    match = re.search(r"(\d+)\s*(?:br|bd|bed|x|/|-)", text or "", re.I) or re.fullmatch(r"\s*(\d+)\s*", text or "")
+    return int(match.group(1)) if match else None
+
+
+def _total_units(row, units_cell):
+    """Unit count stated on a total row ("Total: 120 units", or its # Units cell), or None."""
+    count = parse_number(units_cell)
+    if count is None:
+        match = _UNIT_COUNT.search(" ".join(row))
+        count = parse_number(match.group(1)) if match else None
+    return count[0] if count and not count[1] and count[0] > 0 else None
+
+
+def rent_roll(table):
+    """Columnar rows of a rent roll table (`parse_html_table` result), or None.
+
+    `{"kind", "bedrooms", "units", "sf", "rent", "occupied"}`: kind is "units"
+    (one row per unit) or "mix" (one row per unit type with a unit count);
+    the lists are row-aligned, with None where a row has no value. Rents
+    are monthly. A total row that gives the unit count adds `total_units`,
+    which tells a complete roll from an excerpt (derived.py).
+    """
+    columns = _rent_roll_columns(table.header) if table.header else None
+    if columns is None:
+        return None
+    annual = bool(re.search(r"annual|yearly|/\s*yr", table.header[columns["rent"]], re.I))
+    kind = "mix" if "units" in columns else "units"
+    out = {"kind": kind, "bedrooms": [], "units": [], "sf": [], "rent": [], "occupied": []}
+
+    def cell(row, column):
+        i = columns.get(column)
+        return row[i] if i is not None and i < len(row) else ""
+
+    for row in table.rows:
+        if not any(row):
+            continue
+        if _TOTAL_ROW.match(row[0] or "") or _TOTAL_ROW.match(cell(row, "bedrooms")):
+            total = _total_units(row, cell(row, "units") if kind == "mix" else "")
+            if total:
+                out["total_units"] = total
+            continue
+        rent = parse_number(cell(row, "rent"))
+        status = cell(row, "status")
+        if rent is None and not _VACANT.search(status):
+            continue
+        units = parse_number(cell(row, "units")) if kind == "mix" else (1, False)
+        sf = parse_number(cell(row, "sf"))
+        out["bedrooms"].append(_bedrooms(cell(row, "bedrooms")))
+        out["units"].append(units[0] if units else None)
+        out["sf"].append(sf[0] if sf else None)
+        out["rent"].append(None if rent is None else rent[0] / 12 if annual else rent[0])
+        out["occupied"].append(
+            False if _VACANT.search(status) else True if _OCCUPIED.search(status) else None
+        )
+    return out if len(out["rent"]) >= 2 else None
+
+
+def merge_facts(facts_list):
+    """Combine per-table facts; earlier tables (document order) win.
+
+    Rent roll tables are concatenated (a roll split over several pages is
+    several tables), unit-level rolls taking precedence over unit mixes;
+    their stated `total_units` add up.
+    """
+    merged = {}
+    for facts in facts_list:
+        for fact, value in facts.items():
+            if fact == "rent_roll":
+                current = merged.get(fact)
+                if current is None or (current["kind"] == "mix" and value["kind"] == "units"):
+                    merged[fact] = {key: list(v) if isinstance(v, list) else v for key, v in value.items()}
+                elif current["kind"] == value["kind"]:
+                    for key, column in value.items():
+                        if isinstance(column, list):
+                            current[key].extend(column)
+                    if value.get("total_units"):
+                        current["total_units"] = (current.get("total_units") or 0) + value["total_units"]
+            elif fact == "expense_items":
+                merged.setdefault(fact, [])
+                seen = {item["name"].lower() for item in merged[fact]}
+                merged[fact].extend(item for item in value if item["name"].lower() not in seen)
+            else:
+                merged.setdefault(fact, value)
+    return merged
+
+
+# -------------------------------
+# Facts -> report sections
+# -------------------------------
+def _put(target, path, value):
+    *parents, leaf = path
+    for key in parents:
+        target = target.setdefault(key, {})
+    target[leaf] = value
+
+
+def _money(value):
+    return f"${value:,.0f}"
+
+
+def _percent(value):
+    return f"{value:g}%"
+
+
+def prefill(section, facts):
+    """The part of `section` that `facts` determine, shaped like schema.json."""
+    if not facts:
+        return {}
+
+    def value(name):
+        return facts[name]["value"] if name in facts else None
+
+    out = {}
+
+    def put(path, name, convert=lambda v: v):
+        if value(name) is not None:
+            _put(out, path, convert(value(name)))
+
+    if section == "financial_summary":
+        put(("units",), "units", int)
+        put(("total_square_feet",), "total_square_feet", int)
+        put(("financials_actual", "gross_rental_income"), "gross_potential_rent")
+        put(("financials_actual", "vacancy_allowance", "amount"), "vacancy", abs)
+        put(("financials_actual", "vacancy_allowance", "percentage"), "vacancy_percentage", _percent)
+        put(("financials_actual", "effective_gross_income"), "effective_gross_income")
+        put(("financials_actual", "operating_expenses", "total_calculated_opex"), "total_expenses", abs)
+        for item in ("property_taxes", "insurance", "maintenance"):
+            put(("financials_actual", "operating_expenses", "individual_expenses", item), item, abs)
+        put(("financials_actual", "net_operating_income"), "net_operating_income")
+        put(("asking_price",), "asking_price")
+        put(("cap_rate",), "cap_rate")
+        put(("irr",), "irr")
+        put(("property_taxes",), "property_taxes", abs)
+        put(("assessed_value",), "assessed_value")
+
+    elif section == "modeling_data":
+        put(("gross_potential_rent", "actual"), "gross_potential_rent")
+        put(("NOI", "actual"), "net_operating_income")
+        put(("cap_rate",), "cap_rate", _percent)
+        put(("opex_breakdown", "actual", "total_expenses"), "total_expenses", abs)
+        if facts.get("expense_items"):
+            items = [{"name": item["name"], "amount": abs(item["amount"])} for item in facts["expense_items"]]
+            _put(out, ("opex_breakdown", "actual", "items"), items)
+        put(("price_per_unit",), "price_per_unit", _money)
+        put(("price_per_sf",), "price_per_sf", lambda v: f"${v:,.2f}")
+        put(("rent_roll_mix", "total_units"), "units", int)
+        put(("rent_roll_mix", "total_square_feet"), "total_square_feet", int)
+        put(("rent_roll_mix", "annual_gross_potential_rent"), "gross_potential_rent")
+        if value("gross_potential_rent") is not None:
+            _put(out, ("rent_roll_mix", "monthly_gross_potential_rent"), round(value("gross_potential_rent") / 12, 2))
+        put(("occupancy_history", "vacancy_allowance_percentage"), "vacancy_percentage", _percent)
+        put(("occupancy_history", "vacancy_allowance_amount"), "vacancy", abs)
+        # ratios and the unit mix computed from the facts; stated figures win
+        import derived
+
+        out = merge(derived.modeling_prefill(derived.derive([facts])[0]), out)
+
+    return out
+
+
+def missing_schema(schema, filled):
+    """`schema` reduced to the properties `filled` does not provide, or None if complete."""
+    if not filled:
+        return schema
+    if schema.get("type") != "object" or "properties" not in schema or not isinstance(filled, dict):
+        return None
+
+    properties = {}
+    for name, sub in schema["properties"].items():
+        if name not in filled:
+            properties[name] = sub
+        elif isinstance(filled[name], dict):
+            rest = missing_schema(sub, filled[name])
+            if rest is not None:
+                properties[name] = rest
+    if not properties:
+        return None
+
+    reduced = {key: val for key, val in schema.items() if key not in ("properties", "required")}
+    reduced["properties"] = properties
+    required = [name for name in schema.get("required", []) if name in properties]
+    if required:
+        reduced["required"] = required
+    return reduced
+
+
+def merge(generated, filled):
+    """Deep-merge table values over an LLM result (table values win)."""
+    if not isinstance(generated, dict):
+        return filled
+    out = dict(generated)
+    for key, value in filled.items():
+        out[key] = merge(out.get(key), value) if isinstance(value, dict) else value
+    return out
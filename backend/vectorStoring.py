@@ -1,21 +1,19 @@
-from unstructured.partition.pdf import partition_pdf
-
-
 import uuid
-from langchain_chroma import Chroma
-
-from langchain.storage import InMemoryStore
-from langchain.schema.document import Document
-from langchain.retrievers.multi_vector import MultiVectorRetriever
+from langchain_core.documents import Document
 
 
 from summaries import summariesData, summariesImages
+import metrics
+import rowslices
+import spool
+import storage
+import tables as table_engine
+from revisions import fingerprint
+from config import get_settings
+from stores import add_embedded, embed_documents, get_registry, vectorstore_write_lock
 
-import getpass
 import os
 
-import pickle
-
 # output_path = "./content/"
 # file_path = output_path + 'attention.pdf'
 
@@ -34,23 +32,125 @@ def get_images_base64(chunks):
 
 def chunking(file_path):
     print("chunking")
-    chunks = partition_pdf(
-        filename=file_path,
-        infer_table_structure=True,            # extract tables
-        strategy="hi_res",                     # mandatory to infer tables
+    with metrics.track("chunking"):
+        chunks, images = _partition(file_path)
+        metrics.count("chunks", len(chunks))
+        metrics.count("images", len(images))
+    return chunks, images
+
+
+# by_title chunking, run on the (possibly cached) partition elements
+CHUNKING = dict(
+    max_characters=10000,                  # defaults to 500
+    combine_text_under_n_chars=2000,       # defaults to 0
+    new_after_n_chars=6000,
+)
+
+
+def _chunk(elements):
+    """by_title chunks of `elements`, long tables cut into row slices (rowslices.py)."""
+    # unstructured pulls in the layout model stack; only load it when ingesting
+    from unstructured.chunking.title import chunk_by_title
+
+    return rowslices.slice_tables(chunk_by_title(elements, **CHUNKING))
+
+
+# hi_res partitioning: layout model, table structure and embedded images
+HI_RES = dict(
+    infer_table_structure=True,            # extract tables
+    strategy="hi_res",                     # mandatory to infer tables
+
+    extract_image_block_types=["Image"],   # Add 'Table' to list to extract image of tables
+    # image_output_dir_path=output_path,   # if None, images and tables will saved in base64
+
+    extract_image_block_to_payload=True,   # if true, will extract base64 for API usage
+
+    # extract_images_in_pdf=True,          # deprecated
+)
+
+FAST = dict(strategy="fast")
+
+
+def _classify(file_path, mode="auto"):
+    """pages.PageInfo per page with the strategy `mode` gives it, or None if the PDF can't be read."""
+    import pages
+
+    try:
+        infos = pages.classify_pages(file_path, min_chars=get_settings().page_min_chars)
+    except Exception as e:
+        # e.g. a PDF pypdf can't read; unstructured may still manage
+        print(f"Page classification failed ({e}), partitioning every page with hi_res")
+        return None
+    if mode == "hi_res":
+        for info in infos:
+            info.strategy = pages.HI_RES
+    return infos
+
 
-        extract_image_block_types=["Image"],   # Add 'Table' to list to extract image of tables
-        # image_output_dir_path=output_path,   # if None, images and tables will saved in base64
+def _partition_elements(file_path, mode="auto", infos=None):
+    """Unchunked elements in page order.
 
-        extract_image_block_to_payload=True,   # if true, will extract base64 for API usage
+    Each page is read from the partition cache or partitioned with the
+    strategy it needs (every page hi_res when `mode` is "hi_res"). `infos`
+    (from `_classify`) limits the run to those pages.
+    """
+    from unstructured.partition.pdf import partition_pdf
 
-        chunking_strategy="by_title",          # or 'basic'
-        max_characters=10000,                  # defaults to 500
-        combine_text_under_n_chars=2000,       # defaults to 0
-        new_after_n_chars=6000,
+    import pages
+    from partitioncache import PartitionCache
 
-        # extract_images_in_pdf=True,          # deprecated
+    settings = get_settings()
+    whole = infos is None
+    if whole:
+        infos = _classify(file_path, mode)
+        if infos is None:
+            return partition_pdf(filename=file_path, **HI_RES)
+
+    params = {pages.HI_RES: HI_RES, pages.FAST: FAST}
+    filename = os.path.basename(file_path)
+    cache = PartitionCache(settings.partition_cache_dir) if settings.partition_cache else None
+    keys = {info.number: cache.key(info.digest, params[info.strategy]) for info in infos} if cache else {}
+
+    by_page, misses = {}, []
+    for info in infos:
+        elements = cache.get(keys[info.number], info.number, filename) if cache else None
+        if elements is None:
+            misses.append(info)
+        else:
+            by_page[info.number] = elements
+
+    hi_res_pages = sum(info.strategy == pages.HI_RES for info in misses)
+    print(
+        f"Partitioning {len(misses)} of {len(infos)} pages ({hi_res_pages} hi_res, "
+        f"{len(misses) - hi_res_pages} fast), {len(infos) - len(misses)} from cache"
     )
+    metrics.count("hi_res_pages", hi_res_pages)
+    metrics.count("fast_pages", len(misses) - hi_res_pages)
+    metrics.count("cached_pages", len(infos) - len(misses))
+
+    for strategy, numbers in pages.runs(misses):
+        if whole and len(numbers) == len(infos):
+            elements = partition_pdf(filename=file_path, **params[strategy])
+        else:
+            elements = partition_pdf(
+                file=pages.extract_pages(file_path, numbers),
+                starting_page_number=numbers[0],
+                metadata_filename=filename,
+                **params[strategy],
+            )
+        for number in numbers:
+            by_page[number] = []
+        for element in elements:
+            by_page.setdefault(element.metadata.page_number or numbers[0], []).append(element)
+        if cache:
+            for number in numbers:
+                cache.put(keys[number], by_page[number])
+
+    return [element for number in sorted(by_page) for element in by_page[number]]
+
+
+def _partition(file_path):
+    chunks = _chunk(_partition_elements(file_path, get_settings().partition_mode))
 
     # separate tables from texts
     tables = []
@@ -67,24 +167,163 @@ def chunking(file_path):
     return chunks, images
 
 
-import json
+# -------------------------------
+# Windowed ingestion
+# -------------------------------
+# With DEALLENS_INGEST_WINDOW_PAGES / DEALLENS_INGEST_MEMORY_MB a document is
+# partitioned, chunked, summarized and stored a few pages at a time, with
+# image payloads spilled to disk (spool.py), so a worker's memory follows the
+# window size rather than the page count. Chunks do not span windows.
+def windowed(settings=None):
+    settings = settings or get_settings()
+    return settings.ingest_window_pages > 0 or settings.ingest_memory_mb > 0
+
+
+def chunk_windows(file_path, image_spool):
+    """Yield `(chunks, images)` per page window; images are `spool.SpooledImage`s.
+
+    Windows start at DEALLENS_INGEST_WINDOW_PAGES pages (16 if unset). When
+    DEALLENS_INGEST_MEMORY_MB is set and resident memory is over it after a
+    window has been consumed, the following windows are halved.
+    """
+    settings = get_settings()
+    infos = _classify(file_path, settings.partition_mode)
+    if infos is None:
+        chunks = _chunk(_partition_elements(file_path, settings.partition_mode))
+        yield chunks, spool.spill_images(chunks, image_spool)
+        return
+
+    size = settings.ingest_window_pages or 16
+    start = 0
+    while start < len(infos):
+        window = infos[start:start + size]
+        start += len(window)
+        print(f"Window pages {window[0].number}-{window[-1].number} of {len(infos)}")
+        chunks = _chunk(_partition_elements(file_path, settings.partition_mode, window))
+        images = spool.spill_images(chunks, image_spool)
+        metrics.count("windows")
+        yield chunks, images
+        del chunks, images
+        spool.release()
+
+        if settings.ingest_memory_mb and spool.rss_mb() > settings.ingest_memory_mb:
+            spool.release(collect=True)
+            rss = spool.rss_mb()
+            if rss > settings.ingest_memory_mb and size > 1:
+                size = max(1, size // 2)
+                print(f"RSS {rss:.0f} MB over DEALLENS_INGEST_MEMORY_MB, window down to {size} pages")
+
+
+def storing_windowed(file_path, retriever, provider="openai", file_id=None, strategy=None, progress=None):
+    """`storing` one page window at a time; returns (number of stored entries, chunks, images)."""
+    settings = get_settings()
+    entries = n_chunks = n_images = 0
+    facts = []
+    with metrics.track("storing", provider=provider), spool.Spool(settings.spool_dir) as image_spool:
+        for chunks, images in chunk_windows(file_path, image_spool):
+            n_chunks += len(chunks)
+            n_images += len(images)
+            facts.extend(
+                table_engine.table_facts(getattr(chunk.metadata, "text_as_html", None))
+                for chunk in chunks if "Table" in str(type(chunk))
+            )
+            summary_to_chunk, _ = store_chunks(
+                chunks, images, retriever, provider=provider, file_id=file_id, progress=progress,
+                strategy=strategy, record_facts=False,
+            )
+            entries += len(summary_to_chunk)
+            del chunks, images, summary_to_chunk
+
+    if file_id:
+        get_registry().set_facts(file_id, table_engine.merge_facts(facts))
+    metrics.count("chunks", n_chunks)
+    metrics.count("images", n_images)
+    print(f"Stored {entries} entries from {n_chunks} chunks and {n_images} images in windows")
+    return entries, n_chunks, n_images
+
+
+# -------------------------------
+# Ingestion strategies
+# -------------------------------
+# What gets embedded for text / table chunks (images are always summarized,
+# they have no text of their own):
+#   summary - an LLM summary of every chunk (original behaviour)
+#   raw     - the chunk text itself, no LLM calls; summaries can be added later
+#   hybrid  - summaries for tables and for texts of DEALLENS_SUMMARY_MIN_CHARS or more
+#   tables  - summaries for tables only
+STRATEGIES = ("summary", "raw", "hybrid", "tables")
+# recorded for a document whose revision (revisions.py) kept chunks embedded
+# under another strategy; `summarize_raw` brings it back to "summary"
+MIXED = "mixed"
+
+
+def wants_summary(kind, content, strategy, min_chars):
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown ingestion strategy: {strategy}")
+    if strategy == "summary":
+        return True
+    if strategy == "raw":
+        return False
+    if kind == "table":
+        return True
+    return strategy == "hybrid" and len(content) >= min_chars
+
+
+def _content(chunk):
+    return chunk.page_content if hasattr(chunk, "page_content") else str(chunk)
+
+
+def summarize_for_strategy(texts, tables, strategy, provider="openai"):
+    """Summaries for the chunks `strategy` selects, None for the ones embedded raw."""
+    min_chars = get_settings().summary_min_chars
+    text_idx = [i for i, c in enumerate(texts) if wants_summary("text", _content(c), strategy, min_chars)]
+    table_idx = [i for i, c in enumerate(tables) if wants_summary("table", _content(c), strategy, min_chars)]
+    metrics.count("raw_chunks", len(texts) + len(tables) - len(text_idx) - len(table_idx))
+
+    text_summaries, table_summaries = [None] * len(texts), [None] * len(tables)
+    if text_idx or table_idx:
+        done_texts, done_tables = summariesData(
+            [texts[i] for i in text_idx], [tables[i] for i in table_idx], provider=provider
+        )
+        for i, summary in zip(text_idx, done_texts):
+            text_summaries[i] = summary
+        for i, summary in zip(table_idx, done_tables):
+            table_summaries[i] = summary
+    return text_summaries, table_summaries
 
 
 # below one is stable working
-from base64 import b64decode
-from langchain.schema.document import Document
-
-import uuid
-import pickle
 from io import BytesIO
 import base64
-def storing(file_path, retriever, vectorstore):
+def storing(file_path, retriever, vectorstore, provider="openai", file_id=None, strategy=None):
     print("Will be storing data...")
 
-    # Step 1: Chunk the document
-    chunks, images = chunking(file_path)
-    print("Done chunking")
-    print("Total chunks:", len(chunks), "Images:", len(images))
+    with metrics.track("storing", provider=provider):
+        # Step 1: Chunk the document
+        chunks, images = chunking(file_path)
+        print("Done chunking")
+        print("Total chunks:", len(chunks), "Images:", len(images))
+
+        return store_chunks(chunks, images, retriever, provider=provider, file_id=file_id, strategy=strategy)
+
+
+def store_chunks(chunks, images, retriever, provider="openai", file_id=None, progress=None, strategy=None,
+                 existing=None, record_facts=True):
+    """Summarize already partitioned chunks and persist them (steps 2-7 of `storing`).
+
+    Split out so bulk ingestion can partition in worker processes and run
+    this network-bound part in threads. `file_id` is added to every vector's
+    metadata; `progress(stage)` is called when the storing step starts.
+    `strategy` (default `DEALLENS_INGEST_STRATEGY`) picks what is embedded.
+    Chunks whose fingerprint is in `existing` (a revision's unchanged
+    chunks, see revisions.py) are neither summarized nor stored again.
+    `images` may be `spool.SpooledImage`s; with `record_facts=False` the
+    caller records the document's table facts (windowed ingestion).
+    Callers time it (`storing` wraps it in the "storing" stage).
+    """
+    strategy = strategy or get_settings().ingest_strategy
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown ingestion strategy: {strategy}")
 
     # Separate chunks into texts and tables
     texts = []
@@ -97,13 +336,37 @@ def storing(file_path, retriever, vectorstore):
 
     print("Text chunks:", len(texts), "Table chunks:", len(tables))
 
-    # Step 2: Generate summaries
-    text_summaries, table_summaries = summariesData(texts, tables)
-    image_summaries = summariesImages(images)
+    # Financial line items straight from the parsed tables (no LLM needed)
+    facts = table_engine.merge_facts(
+        table_engine.table_facts(getattr(table.metadata, "text_as_html", None)) for table in tables
+    )
+    metrics.count("table_facts", len(facts))
+    if file_id and record_facts:
+        get_registry().set_facts(file_id, facts)
+    images = [spool.load(image) for image in images]
+
+    # Row slices of long tables are embedded as they are (rowslices.py)
+    slices = [c for c in tables if rowslices.is_slice(c)]
+    tables = [c for c in tables if not rowslices.is_slice(c)]
+    if file_id and slices:
+        rowslices.write_sidecars(file_id, slices)
+    metrics.count("table_slices", len(slices))
+
+    if existing:
+        texts = [c for c in texts if fingerprint(_content(c)) not in existing]
+        tables = [c for c in tables if fingerprint(_content(c)) not in existing]
+        slices = [c for c in slices if fingerprint(_content(c)) not in existing]
+        images = [img for img in images if fingerprint(img) not in existing]
+        print("New text chunks:", len(texts), "New table chunks:", len(tables) + len(slices), "New images:", len(images))
+
+    # Step 2: Generate summaries (for the chunks the ingestion strategy asks for)
+    text_summaries, table_summaries = summarize_for_strategy(texts, tables, strategy, provider=provider)
+    image_summaries = summariesImages(images, provider=provider)
     print("Text summaries:", text_summaries)
 
     # Step 3: Initialize mapping dictionary
     summary_to_chunk = {}
+    summary_docs = []
     id_key = retriever.id_key
 
     # Helper to convert images to base64
@@ -121,11 +384,13 @@ def storing(file_path, retriever, vectorstore):
         metadata = {
             id_key: doc_id,
             "type": "text",
-            "original_content": chunk_content
+            "original_content": chunk_content,
+            "fingerprint": fingerprint(chunk_content),
+            "representation": "raw" if summary is None else "summary",
         }
-        summary_doc = Document(page_content=summary, metadata=metadata)
-        retriever.vectorstore.add_documents([summary_doc])
-        retriever.docstore.mset([(doc_id, {"content": chunk_content})])
+        if file_id:
+            metadata["file_id"] = file_id
+        summary_docs.append(Document(page_content=chunk_content if summary is None else summary, metadata=metadata))
         summary_to_chunk[doc_id] = chunk_content
 
     # Step 5: Add table summaries
@@ -135,11 +400,31 @@ def storing(file_path, retriever, vectorstore):
         metadata = {
             id_key: doc_id,
             "type": "table",
-            "original_content": chunk_content
+            "original_content": chunk_content,
+            "fingerprint": fingerprint(chunk_content),
+            "representation": "raw" if summary is None else "summary",
+        }
+        if file_id:
+            metadata["file_id"] = file_id
+        summary_docs.append(Document(page_content=chunk_content if summary is None else summary, metadata=metadata))
+        summary_to_chunk[doc_id] = chunk_content
+
+    # Step 5b: Add table row slices, embedded row by row instead of summarized
+    for chunk in slices:
+        doc_id = str(uuid.uuid4())
+        chunk_content = _content(chunk)
+        metadata = {
+            id_key: doc_id,
+            "type": "table",
+            "original_content": chunk_content,
+            "fingerprint": fingerprint(chunk_content),
+            "representation": "slice",
+            "table_id": chunk.metadata.table_id,
+            "rows": chunk.metadata.rows,
         }
-        summary_doc = Document(page_content=summary, metadata=metadata)
-        retriever.vectorstore.add_documents([summary_doc])
-        retriever.docstore.mset([(doc_id, {"content": chunk_content})])
+        if file_id:
+            metadata["file_id"] = file_id
+        summary_docs.append(Document(page_content=rowslices.describe(chunk), metadata=metadata))
         summary_to_chunk[doc_id] = chunk_content
 
     # Step 6: Add image summaries
@@ -171,18 +456,64 @@ def storing(file_path, retriever, vectorstore):
         metadata = {
             id_key: doc_id,
             "type": "image",
-            "original_content": chunk_content
+            "original_content": chunk_content,
+            "fingerprint": fingerprint(chunk_content),
+            "representation": "summary",
         }
+        if file_id:
+            metadata["file_id"] = file_id
 
-        summary_doc = Document(page_content=summary_text, metadata=metadata)
-        retriever.vectorstore.add_documents([summary_doc])
-        retriever.docstore.mset([(doc_id, {"content": chunk_content})])
+        summary_docs.append(Document(page_content=summary_text, metadata=metadata))
         summary_to_chunk[doc_id] = chunk_content
 
-    # Step 7: Persist mapping
-    with open("summary_to_chunk.pkl", "wb") as f:
-        pickle.dump(summary_to_chunk, f)
+    # Step 7: Persist vectors and chunks in one batch. Other workers share
+    # these stores, so writes are serialized and announced to them; the
+    # embedding calls happen before, outside the lock.
+    if progress:
+        progress("storing")
+    if summary_docs:
+        embeddings = embed_documents(retriever.vectorstore, summary_docs)
+        with vectorstore_write_lock():
+            add_embedded(retriever.vectorstore, summary_docs, embeddings)
+            retriever.docstore.mset(list(summary_to_chunk.items()), tags={
+                doc.metadata[id_key]: (file_id, doc.metadata["type"]) for doc in summary_docs
+            })
+        storage.bump("vectorstore")
+    if file_id:
+        get_registry().update(file_id, strategy=strategy)
 
     print("Data added to vector DB and mapping saved.")
     print("Total entries in summary_to_chunk:", len(summary_to_chunk))
     return summary_to_chunk, retriever
+
+
+def summarize_raw(file_id, vectorstore, provider="openai"):
+    """Replace a document's raw-text vectors with summary vectors (after a raw/hybrid ingest).
+
+    The chunks themselves do not change, so doc_ids and the chunk store stay as they are.
+    """
+    raw = vectorstore.get(
+        where={"$and": [{"file_id": file_id}, {"representation": "raw"}]},
+        include=["metadatas"],
+    )
+    if not raw["ids"]:
+        return 0
+
+    with metrics.track("summarize_raw", provider=provider):
+        metadatas = raw["metadatas"]
+        texts = [m["original_content"] for m in metadatas]
+        # tables were stored as their text; summarize them through the same chain
+        summaries, _ = summariesData(texts, [], provider=provider)
+        docs = [
+            Document(page_content=summary, metadata={**metadata, "representation": "summary"})
+            for summary, metadata in zip(summaries, metadatas)
+        ]
+        embeddings = embed_documents(vectorstore, docs)
+        with vectorstore_write_lock():
+            add_embedded(vectorstore, docs, embeddings)
+            vectorstore.delete(ids=raw["ids"])
+        storage.bump("vectorstore")
+
+    get_registry().update(file_id, strategy="summary")
+    print(f"Summarized {len(docs)} raw chunks of {file_id}")
+    return len(docs)
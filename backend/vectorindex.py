@@ -0,0 +1,539 @@
+"""
+In-process vector index on memory-mapped files (`DEALLENS_VECTOR_BACKEND=memmap`).
+
+Each document (`file_id` metadata; vectors without one go to "default")
+is a *segment* of two files in `DEALLENS_MEMMAP_DIR`:
+
+- `<segment>.<version>.npy` - float32 matrix of L2-normalized embeddings,
+  opened with `mmap_mode="r"` so every worker shares one page-cached copy
+- `<segment>.json` - the matrix file name plus ids, page contents and
+  metadata, row-aligned
+
+Search is an exact dot product over the matrices (cosine similarity) with
+`argpartition` top-k. Segments larger than `DEALLENS_HNSW_THRESHOLD` rows
+get an in-memory HNSW index when `hnswlib` is installed; metadata filters
+other than the segment's own `file_id` are applied to its over-fetched
+results.
+
+The search matrix can be reduced: truncated to the first
+`DEALLENS_VECTOR_DIM` dimensions (Matryoshka-style, e.g. for
+text-embedding-3) and/or stored as float16 / int8 (`DEALLENS_VECTOR_DTYPE`).
+The full float32 vectors then stay in `<segment>.<version>.full.npy` and
+only the top candidates are rescored against them
+(`DEALLENS_VECTOR_RESCORE`). `benchmarks/recall.py` reports the trade-off.
+
+Segments are rewritten atomically on every write; readers notice the new
+mtime and reopen, so no extra change notification is needed. Writers are
+expected to hold `stores.vectorstore_write_lock()` (as `storing` does).
+
+`MemmapVectorStore` is a LangChain `VectorStore` and also implements the
+small part of Chroma's API the code uses (`get(where=...)`, `delete(ids)`,
+`filter=` on searches), so it can stand in for the Chroma adapter.
+"""
+
+import json
+import os
+import re
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import storage
+
+DEFAULT_SEGMENT = "default"
+# HNSW candidates fetched per wanted hit when a filter (e.g. `type`) is applied afterwards
+HNSW_FILTER_OVERFETCH = 4
+
+
+# -------------------------------
+# Metadata filters (Chroma `where` syntax subset)
+# -------------------------------
+def matches(metadata, where):
+    """Evaluate `{"key": value}`, `{"key": {"$eq"|"$ne"|"$in"|"$nin": ...}}`, `$and`, `$or`."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, expected in condition.items():
+                if op == "$eq" and value != expected:
+                    return False
+                if op == "$ne" and value == expected:
+                    return False
+                if op == "$in" and value not in expected:
+                    return False
+                if op == "$nin" and value in expected:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _segments_in(where):
+    """Segment names a filter restricts the search to, or None for all."""
+    if not where:
+        return None
+    file_id = where.get("file_id")
+    if isinstance(file_id, str):
+        return [file_id]
+    if isinstance(file_id, dict):
+        if "$eq" in file_id:
+            return [file_id["$eq"]]
+        if "$in" in file_id:
+            return list(file_id["$in"])
+    for sub in where.get("$and", []):
+        found = _segments_in(sub)
+        if found is not None:
+            return found
+    return None
+
+
+def _without_file_id(where):
+    """`where` less its `file_id` condition (implied once `_segments_in` picked the segments)."""
+    if not where:
+        return None
+    out = {}
+    for key, condition in where.items():
+        if key == "file_id":
+            continue
+        if key == "$and":
+            condition = [sub for sub in (_without_file_id(c) for c in condition) if sub]
+            if not condition:
+                continue
+            if len(condition) == 1:
+                out.update(condition[0])
+                continue
+        out[key] = condition
+    return out or None
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+# -------------------------------
+# Segments
+# -------------------------------
+class Segment:
+    """One document's vectors (memory-mapped) and sidecar, as of one file version."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.sidecar_path = os.path.join(directory, f"{name}.json")
+        for attempt in range(3):
+            self.version = self.stamp(directory, name)
+            with open(self.sidecar_path, "r", encoding="utf-8") as f:
+                sidecar = json.load(f)
+            try:
+                # A writer may have replaced the segment (and unlinked these files) meanwhile
+                self.vectors = np.load(os.path.join(directory, sidecar["matrix"]), mmap_mode="r")
+                full = sidecar.get("full")
+                self.full = np.load(os.path.join(directory, full), mmap_mode="r") if full else None
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        self.ids = sidecar["ids"]
+        self.texts = sidecar["documents"]
+        self.metadatas = sidecar["metadatas"]
+        self.dim = sidecar.get("dim") or 0
+        self.scale = sidecar.get("scale", 1.0)
+        self._hnsw = None
+
+    @staticmethod
+    def stamp(directory, name):
+        try:
+            return os.stat(os.path.join(directory, f"{name}.json")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, where):
+        if not where:
+            return np.arange(len(self))
+        return np.array([i for i, m in enumerate(self.metadatas) if matches(m, where)], dtype=np.int64)
+
+    def source_vectors(self, rows):
+        """Best available float32 vectors for `rows` (full precision when kept)."""
+        if self.full is not None:
+            return np.asarray(self.full[rows], dtype=np.float32)
+        return np.asarray(self.vectors[rows], dtype=np.float32) * self.scale
+
+    def hnsw(self, threshold):
+        """HNSW index over this segment, or None (small segment or hnswlib missing)."""
+        if len(self) < threshold:
+            return None
+        if self._hnsw is None:
+            try:
+                import hnswlib
+            except ImportError:
+                return None
+            index = hnswlib.Index(space="ip", dim=self.vectors.shape[1])
+            index.init_index(max_elements=len(self), ef_construction=200, M=16)
+            index.add_items(np.asarray(self.vectors, dtype=np.float32), np.arange(len(self)))
+            index.set_ef(128)
+            self._hnsw = index
+        return self._hnsw
+
+    def _scores(self, rows, query):
+        # Blockwise, so int8 / float16 rows are upcast a block at a time
+        out = np.empty(len(rows), dtype=np.float32)
+        whole = len(rows) == len(self)
+        for start in range(0, len(rows), _BLOCK):
+            block = self.vectors[start:start + _BLOCK] if whole else self.vectors[rows[start:start + _BLOCK]]
+            out[start:start + _BLOCK] = np.asarray(block, dtype=np.float32) @ query
+        return out * self.scale
+
+    def _hnsw_search(self, index, query, wanted, where):
+        """Best `wanted` rows matching `where` from the HNSW index, filtered after the search.
+
+        Over-fetches `HNSW_FILTER_OVERFETCH`-fold, growing while too few
+        candidates match; None when a selective filter would need most of
+        the segment anyway (the exact scan over matching rows is then cheaper).
+        """
+        fetch = wanted * (HNSW_FILTER_OVERFETCH if where else 1)
+        while True:
+            n = min(fetch, len(self))
+            if where and n > len(self) // 2:
+                return None
+            labels, distances = index.knn_query(query, k=n)
+            # the index holds the stored (possibly quantized) rows, like `_scores`
+            scores, rows = (1 - distances[0]) * self.scale, labels[0].astype(np.int64)
+            if where:
+                keep = np.array([matches(self.metadatas[row], where) for row in rows], dtype=bool)
+                scores, rows = scores[keep], rows[keep]
+            if len(rows) >= wanted or n == len(self):
+                return scores[:wanted], rows[:wanted]
+            fetch *= HNSW_FILTER_OVERFETCH
+
+    def search(self, query, k, where=None, hnsw_threshold=None, rescore_factor=4):
+        """(scores, row indexes) of the best `k` rows by cosine similarity.
+
+        `where` is applied after the HNSW search when the segment has an
+        index, else by scanning only the matching rows. With a reduced (truncated / quantized) matrix the best
+        `k * rescore_factor` candidates are rescored against the full
+        vectors kept on disk.
+        """
+        if not len(self):
+            return np.empty(0, np.float32), np.empty(0, np.int64)
+        compact_query = _normalize(query[:self.dim])[0] if self.dim else query
+        wanted = k if self.full is None else k * rescore_factor
+
+        index = None if hnsw_threshold is None else self.hnsw(hnsw_threshold)
+        found = self._hnsw_search(index, compact_query, wanted, where) if index is not None else None
+        if found is not None:
+            scores, rows = found
+        else:
+            rows = self.rows(where)
+            if not len(rows):
+                return np.empty(0, np.float32), rows
+            scores = self._scores(rows, compact_query)
+            if wanted < len(scores):
+                top = np.argpartition(-scores, wanted)[:wanted]
+                scores, rows = scores[top], rows[top]
+
+        if self.full is not None:
+            order = np.argsort(rows)  # sequential reads from the full matrix
+            rows = rows[order]
+            scores = np.asarray(self.full[rows], dtype=np.float32) @ query
+            if k < len(scores):
+                top = np.argpartition(-scores, k)[:k]
+                scores, rows = scores[top], rows[top]
+        return scores, rows
+
+
+# -------------------------------
+# Reduced storage
+# -------------------------------
+DTYPES = ("float32", "float16", "int8")
+_BLOCK = 8192
+
+
+def compress(vectors, dim=0, dtype="float32"):
+    """Truncate normalized vectors to `dim` (Matryoshka) and quantize.
+
+    Returns (matrix, scale); scores computed on `matrix` are multiplied by
+    `scale` (int8 stores `round(v / max|v| * 127)`).
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported vector dtype: {dtype}")
+    if dim and dim < vectors.shape[1]:
+        vectors = _normalize(vectors[:, :dim])
+    if dtype == "float16":
+        return vectors.astype(np.float16), 1.0
+    if dtype == "int8":
+        peak = float(np.abs(vectors).max()) if vectors.size else 1.0
+        peak = peak or 1.0
+        return np.round(vectors / peak * 127).astype(np.int8), peak / 127
+    return vectors.astype(np.float32), 1.0
+
+
+def write_segment(directory, name, ids, texts, metadatas, vectors, dim=0, dtype="float32", rescore=True):
+    """Replace segment `name`.
+
+    The matrices go to new, uniquely named files and the sidecar (which
+    names them) is swapped in atomically, so readers always see a matching
+    set; the previous files are unlinked afterwards (open memmaps keep them).
+    A full-precision copy is kept for rescoring when the search matrix is
+    reduced and `rescore` is set.
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    dim = dim if dim and dim < vectors.shape[1] else 0
+    compact, scale = compress(vectors, dim, dtype)
+    token = uuid.uuid4().hex[:12]
+
+    files = {"matrix": f"{name}.{token}.npy", "full": None}
+    with storage.atomic_open(os.path.join(directory, files["matrix"])) as f:
+        np.save(f, compact)
+    if rescore and (dim or dtype != "float32"):
+        files["full"] = f"{name}.{token}.full.npy"
+        with storage.atomic_open(os.path.join(directory, files["full"])) as f:
+            np.save(f, vectors)
+
+    sidecar_path = os.path.join(directory, f"{name}.json")
+    previous = _files_of(sidecar_path)
+    storage.atomic_write_json(sidecar_path, {
+        **files, "dim": dim, "dtype": dtype, "scale": scale,
+        "ids": ids, "documents": texts, "metadatas": metadatas,
+    })
+    for old in previous:
+        _unlink(os.path.join(directory, old))
+
+
+def _files_of(sidecar_path):
+    try:
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+    except FileNotFoundError:
+        return []
+    return [sidecar[key] for key in ("matrix", "full") if sidecar.get(key)]
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _segment_name(file_id):
+    if not file_id:
+        return DEFAULT_SEGMENT
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(file_id))
+
+
+# -------------------------------
+# VectorStore
+# -------------------------------
+class MemmapVectorStore(VectorStore):
+    def __init__(self, directory, embedding_function, hnsw_threshold=20000,
+                 dim=0, dtype="float32", rescore=True, rescore_factor=4):
+        self.directory = directory
+        self._embedding = embedding_function
+        self.hnsw_threshold = hnsw_threshold
+        # storage layout for new writes; existing segments keep the one they were written with
+        self.layout = {"dim": dim, "dtype": dtype, "rescore": rescore}
+        self.rescore_factor = rescore_factor
+        self._segments = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # -------------------------------
+    # Segment cache
+    # -------------------------------
+    def segment_names(self):
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def segment(self, name):
+        """Current version of segment `name`, or None if it does not exist."""
+        version = Segment.stamp(self.directory, name)
+        with self._lock:
+            cached = self._segments.get(name)
+            if version is None:
+                self._segments.pop(name, None)
+                return None
+            if cached is None or cached.version != version:
+                cached = self._segments[name] = Segment(self.directory, name)
+            return cached
+
+    def _segments_for(self, where):
+        names = _segments_in(where)
+        if names is None:
+            names = self.segment_names()
+        return [seg for seg in (self.segment(_segment_name(n)) for n in names) if seg is not None]
+
+    # -------------------------------
+    # Writes
+    # -------------------------------
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """`add_texts` with the embeddings already computed (so callers can embed outside the write lock)."""
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        if not texts:
+            return []
+        vectors = _normalize(embeddings)
+
+        by_segment = {}
+        for row, metadata in enumerate(metadatas):
+            by_segment.setdefault(_segment_name(metadata.get("file_id")), []).append(row)
+
+        for name, rows in by_segment.items():
+            existing = self.segment(name)
+            new_ids = [ids[r] for r in rows]
+            replaced = set(new_ids)
+            keep = [i for i, id_ in enumerate(existing.ids) if id_ not in replaced] if existing else []
+            old = (existing.ids, existing.texts, existing.metadatas) if existing else ([], [], [])
+            added = vectors[rows]
+            if keep:
+                kept = existing.source_vectors(keep)
+                if kept.shape[1] < added.shape[1]:
+                    # no full-precision copy left to extend; match the stored width
+                    added = _normalize(added[:, :kept.shape[1]])
+                added = np.vstack([kept, added])
+            write_segment(
+                self.directory, name,
+                [old[0][i] for i in keep] + new_ids,
+                [old[1][i] for i in keep] + [texts[r] for r in rows],
+                [old[2][i] for i in keep] + [metadatas[r] for r in rows],
+                added, **self.layout,
+            )
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        ids = set(ids or [])
+        for name in self.segment_names():
+            seg = self.segment(name)
+            if seg is None:
+                continue
+            keep = [i for i, id_ in enumerate(seg.ids) if id_ not in ids]
+            if len(keep) == len(seg):
+                continue
+            if keep:
+                write_segment(
+                    self.directory, name,
+                    [seg.ids[i] for i in keep], [seg.texts[i] for i in keep],
+                    [seg.metadatas[i] for i in keep], seg.source_vectors(keep), **self.layout,
+                )
+            else:
+                self.drop_segment(name)
+        return True
+
+    def drop_segment(self, file_id):
+        """Remove every vector of one document."""
+        name = _segment_name(file_id)
+        sidecar_path = os.path.join(self.directory, f"{name}.json")
+        files = _files_of(sidecar_path)
+        _unlink(sidecar_path)
+        for file in files:
+            _unlink(os.path.join(self.directory, file))
+        with self._lock:
+            self._segments.pop(name, None)
+
+    def compact(self):
+        """Remove matrix files no segment names (left by interrupted writes); returns their count."""
+        referenced = set()
+        for name in self.segment_names():
+            referenced.update(_files_of(os.path.join(self.directory, f"{name}.json")))
+        stale = [
+            name for name in os.listdir(self.directory)
+            if (name.endswith(".npy") or name.startswith(".tmp-")) and name not in referenced
+        ]
+        for name in stale:
+            _unlink(os.path.join(self.directory, name))
+        return len(stale)
+
+    # -------------------------------
+    # Reads
+    # -------------------------------
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents"), **kwargs):
+        """Chroma-style `get`: {"ids", "metadatas", "documents"} of matching rows.
+
+        `offset` skips whole segments by their length and slices into the one
+        it lands in, so paging through the index costs one page per call.
+        """
+        wanted = set(ids) if ids else None
+        skip = offset or 0
+        out = {"ids": [], "metadatas": [], "documents": []}
+        for seg in self._segments_for(where):
+            rows = seg.rows(where)
+            if wanted is not None:
+                rows = [i for i in rows if seg.ids[i] in wanted]
+            if skip >= len(rows):
+                skip -= len(rows)
+                continue
+            end = None if not limit else skip + limit - len(out["ids"])
+            for i in rows[skip:end]:
+                out["ids"].append(seg.ids[i])
+                out["metadatas"].append(seg.metadatas[i])
+                out["documents"].append(seg.texts[i])
+            skip = 0
+            if limit and len(out["ids"]) >= limit:
+                break
+        return out
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        query = _normalize(embedding)[0]
+        # the segments already are the file_id condition; what is left (e.g. type) filters rows
+        where = _without_file_id(filter) if _segments_in(filter) is not None else filter
+        hits = []
+        for seg in self._segments_for(filter):
+            scores, rows = seg.search(
+                query, k, where=where, hnsw_threshold=self.hnsw_threshold, rescore_factor=self.rescore_factor
+            )
+            hits.extend((float(score), seg, int(row)) for score, row in zip(scores, rows))
+        hits.sort(key=lambda hit: -hit[0])
+        return [
+            (Document(id=seg.ids[row], page_content=seg.texts[row], metadata=seg.metadatas[row]), 1 - score)
+            for score, seg, row in hits[:k]
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        """Documents with cosine *distance* (lower is closer), like Chroma."""
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        """Same as Chroma's method of this name, which also returns *distances*."""
+        return self.similarity_search_by_vector_with_score(embedding, k, filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, directory=None, **kwargs):
+        store = cls(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
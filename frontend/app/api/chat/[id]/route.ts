@@ -53,7 +53,7 @@ export async function POST(request: NextRequest, { params }: { params: { id: str
   try {
     const { id } = params
     const body = await request.json()
-    const { message } = body
+    const { message, sessionId } = body
 
     if (!id) {
       return NextResponse.json({ error: "Report ID is required" }, { status: 400 })
@@ -64,13 +64,21 @@ export async function POST(request: NextRequest, { params }: { params: { id: str
     }
 
     try {
-      const response = await fetch(`${API_BASE_URL}/api/chat/${id}`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ message }),
-      })
+      // sessionId continues the conversation (history and retrieved context) on the backend
+      const askBackend = (session?: string) =>
+        fetch(`${API_BASE_URL}/api/chat/${id}`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+          },
+          body: JSON.stringify(session ? { message, sessionId: session } : { message }),
+        })
+
+      let response = await askBackend(typeof sessionId === "string" ? sessionId : undefined)
+      if (response.status === 404 && sessionId) {
+        // the session expired or was deleted with its document; start a new one
+        response = await askBackend()
+      }
 
       if (response.ok) {
         const contentType = response.headers.get("content-type")
@@ -118,6 +126,7 @@ export async function POST(request: NextRequest, { params }: { params: { id: str
           console.log("data ", data.answer)
           return NextResponse.json({
             reply: data.answer  || "No response received",
+            sessionId: data.sessionId,
           })
         }
       }
@@ -52,6 +52,13 @@ export function ChatPanel({ reportId, onClose, report, setReport }: ChatPanelPro
   const [showSuggestions, setShowSuggestions] = useState(true)
   const messagesEndRef = useRef<HTMLDivElement>(null)
   const inputRef = useRef<HTMLInputElement>(null)
+  // backend chat session of this report, so follow-up questions keep their context
+  const sessionKey = `deallens-chat-session:${reportId}`
+  const sessionIdRef = useRef<string | null>(null)
+
+  useEffect(() => {
+    sessionIdRef.current = window.localStorage.getItem(sessionKey)
+  }, [sessionKey])
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" })
@@ -103,9 +110,13 @@ export function ChatPanel({ reportId, onClose, report, setReport }: ChatPanelPro
         const apiResponse = await fetch(`/api/chat/${reportId}`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ message: inputValue, report }),
+          body: JSON.stringify({ message: inputValue, report, sessionId: sessionIdRef.current ?? undefined }),
         });
         const data = await apiResponse.json();
+        if (typeof data.sessionId === "string" && data.sessionId !== sessionIdRef.current) {
+          sessionIdRef.current = data.sessionId;
+          window.localStorage.setItem(sessionKey, data.sessionId);
+        }
         displayContent = typeof data.reply === "string" ? data.reply : JSON.stringify(data.reply, null, 2);
         // Replace the loader node with the real answer
         setMessages((prev) =>
@@ -58,9 +58,9 @@ export async function fetchReport(reportId: string) {
   return apiRequest(`/api/report/${reportId}`)
 }
 
-export async function sendChatMessage(reportId: string, message: string) {
+export async function sendChatMessage(reportId: string, message: string, sessionId?: string) {
   return apiRequest(`/api/chat/${reportId}`, {
     method: "POST",
-    body: JSON.stringify({ message }),
+    body: JSON.stringify(sessionId ? { message, sessionId } : { message }),
   })
 }